@@ -14,6 +14,7 @@
 """Exposes all APIs at one place."""
 
 import flask
+import json
 
 from google.protobuf import json_format
 
@@ -60,27 +61,51 @@ class ApiService(object):
     does reflect the actual state of the system as each component is turned on
     or off asynchronously and may be in different progress.
 
+  /usage
+    Get resource usage of apps on all machines.
+    Request: None
+    Response: {machine name: {component name: flightlab.ResourceUsage}} in json
+              format.
+    Resource usage is sampled by clients periodically. This api can be used to
+    find machines that are starved of CPU or leaking memory.
+
+  /display/message?text=<text>
+  /display/image?path=<path>
+  /display/off
+    Displays a message, an image on master machine, or nothing on client
+    machines.
+    Request: optional "group" to target machines of a group, and "machines" to
+             target a comma separated list of machines. All machines are
+             targeted if neither is given. Optional "timeout" in seconds for
+             each machine.
+    Response: flightlab.BroadcastResponse protobuf in json format, with result
+              and latency of each machine.
+
   /exit
     Terminates all clients.
     Request: None
     Response: 'OK'
   """
 
-  def __init__(self, web, system_config, control_service):
+  def __init__(self, web, system_config, control_service, broadcaster):
     """Initializes API service.
 
     Args:
       web: Flask instance.
       system_config: the system config protobuf.
       control_service: service to control clients.
+      broadcaster: service to display content on clients.
     """
     self._system_config = system_config
     self._control_service = control_service
+    self._broadcaster = broadcaster
     web.add_url_rule('/system/on', view_func=self._system_on)
     web.add_url_rule('/system/off', view_func=self._system_off)
     web.add_url_rule('/system/restart', view_func=self._system_restart)
     web.add_url_rule('/config', view_func=self._config)
     web.add_url_rule('/state', view_func=self._state)
+    web.add_url_rule('/usage', view_func=self._usage)
+    web.add_url_rule('/display/<content>', view_func=self._display)
     web.add_url_rule('/exit', view_func=self._exit)
     web.add_url_rule('/debug', view_func=self._debug)
 
@@ -103,6 +128,43 @@ class ApiService(object):
     state = controller_pb2.SystemState(state=self._system_config.state)
     return self._respond_json(state)
 
+  def _usage(self):
+    usage = {}
+    for machine in self._system_config.machines:
+      usage[machine.name] = {}
+      for component in machine.components:
+        kind = component.WhichOneof('kind')
+        if kind in ('app', 'windows_app'):
+          settings = getattr(component, kind)
+          usage[machine.name][component.name] = json_format.MessageToDict(
+              settings.stats.resource_usage)
+    return flask.Response(
+        response=json.dumps(usage), status=200, mimetype='application/json')
+
+  def _display(self, content):
+    args = flask.request.args
+    try:
+      timeout = float(args.get('timeout', 0))
+    except ValueError:
+      return flask.Response(
+          response='Invalid timeout.', status=400, mimetype='text/plain')
+    request = controller_pb2.BroadcastRequest(
+        group_name=args.get('group', ''),
+        machine_names=[x for x in args.get('machines', '').split(',') if x],
+        timeout=timeout)
+    if content == 'message':
+      request.message = args.get('text', '')
+    elif content == 'image':
+      request.image_path = args.get('path', '')
+    elif content == 'off':
+      request.off = True
+    else:
+      flask.abort(404)
+    try:
+      return self._respond_json(self._broadcaster.broadcast(request))
+    except ValueError as e:
+      return flask.Response(response=str(e), status=400, mimetype='text/plain')
+
   def _exit(self):
     self._control_service.send_command(controller_pb2.SystemCommand.EXIT)
     return 'OK'
@@ -0,0 +1,367 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Library for loading system configuration."""
+
+import hashlib
+import os
+import threading
+import time
+
+from common import pattern
+from google.protobuf import message as message_lib
+from google.protobuf import text_format
+from protos import controller_pb2
+
+
+# Fields updated at runtime, which are not part of configuration.
+_RUNTIME_FIELDS = frozenset([
+    'last_heartbeat_timstamp', 'last_run', 'state', 'stats', 'status', 'user'
+])
+
+
+# Version of the cache format, which should be bumped when it changes.
+_CACHE_VERSION = b'1'
+
+
+class ConfigException(Exception):
+  pass
+
+
+def strip_runtime_fields(message):
+  """Gets a copy of configuration protobuf without fields updated at runtime.
+
+  Args:
+    message: configuration protobuf, e.g. flightlab.Machine.
+  Returns:
+    Protobuf of the same type.
+  """
+  copy = type(message)()
+  copy.CopyFrom(message)
+  _clear_runtime_fields(copy)
+  return copy
+
+
+def _clear_runtime_fields(message):
+  for field, value in message.ListFields():
+    if field.name in _RUNTIME_FIELDS:
+      message.ClearField(field.name)
+    elif (field.type != field.TYPE_MESSAGE or
+          field.message_type.GetOptions().map_entry):
+      continue
+    elif isinstance(value, message_lib.Message):
+      _clear_runtime_fields(value)
+    else:
+      for item in value:
+        _clear_runtime_fields(item)
+
+
+def _is_repeated(field):
+  # Field label is deprecated in newer protobuf versions.
+  if hasattr(field, 'is_repeated'):
+    return field.is_repeated
+  return field.label == field.LABEL_REPEATED
+
+
+def update_in_place(message, new, skipped=()):
+  """Sets fields of a protobuf to those of another, keeping sub-messages.
+
+  Unlike CopyFrom(), singular sub-messages held by others stay part of the
+  message and see the new values. Elements of repeated fields are replaced.
+
+  Args:
+    message: protobuf to update.
+    new: protobuf of the same type with new values.
+    skipped: names of fields not to update.
+  """
+  for field in message.DESCRIPTOR.fields:
+    name = field.name
+    if name in skipped:
+      continue
+    oneof = field.containing_oneof
+    if oneof and new.WhichOneof(oneof.name) != name:
+      continue
+    value = getattr(new, name)
+    if _is_repeated(field):
+      container = getattr(message, name)
+      if (field.type == field.TYPE_MESSAGE and
+          field.message_type.GetOptions().map_entry):
+        message.ClearField(name)
+        for key in value:
+          if isinstance(value[key], message_lib.Message):
+            container[key].CopyFrom(value[key])
+          else:
+            container[key] = value[key]
+      else:
+        del container[:]
+        container.extend(value)
+    elif field.type == field.TYPE_MESSAGE:
+      if new.HasField(name):
+        update_in_place(getattr(message, name), value)
+      else:
+        message.ClearField(name)
+    else:
+      setattr(message, name, value)
+  for oneof in message.DESCRIPTOR.oneofs:
+    if not new.WhichOneof(oneof.name) and oneof.name not in skipped:
+      message.ClearField(oneof.name)
+
+
+def _update_items(items, new_items, update):
+  """Updates repeated field of named items in place.
+
+  Args:
+    items: repeated field of protobufs with "name" field to update.
+    new_items: list of protobufs with new values.
+    update: function called with an existing item and its new values.
+  """
+  new_by_name = dict((x.name, x) for x in new_items)
+  for i in reversed(range(len(items))):
+    if items[i].name not in new_by_name:
+      del items[i]
+  names = set(x.name for x in items)
+  for item in items:
+    update(item, new_by_name[item.name])
+  for new_item in new_items:
+    if new_item.name not in names:
+      items.add().CopyFrom(new_item)
+
+
+def diff(old, new):
+  """Compares configuration of named items, e.g. machines or components.
+
+  Fields updated at runtime are ignored.
+
+  Args:
+    old: list of configuration protobufs with "name" field.
+    new: list of configuration protobufs with "name" field.
+  Returns:
+    (names added, names removed, names changed), each in order of the lists.
+  """
+  old = dict((x.name, x) for x in old)
+  new_names = [x.name for x in new]
+  added = [x.name for x in new if x.name not in old]
+  removed = [x for x in old if x not in new_names]
+  changed = [
+      x.name for x in new if x.name in old and
+      strip_runtime_fields(x) != strip_runtime_fields(old[x.name])
+  ]
+  return added, removed, changed
+
+
+def validate(system):
+  """Validates system configuration.
+
+  Args:
+    system: flightlab.System protobuf.
+  Raises:
+    ConfigException: if configuration is invalid.
+  """
+  errors = []
+  names = set()
+  ips = set()
+  for machine in system.machines:
+    if machine.name in names:
+      errors.append('Duplicated machine name "{0}".'.format(machine.name))
+    names.add(machine.name)
+    if machine.ip and machine.ip in ips:
+      errors.append('Duplicated machine IP {0}.'.format(machine.ip))
+    ips.add(machine.ip)
+
+    component_names = set()
+    for component in machine.components:
+      if component.name in component_names:
+        errors.append('Duplicated component name "{0}" on machine "{1}".'.format(
+            component.name, machine.name))
+      component_names.add(component.name)
+      if not component.WhichOneof('kind'):
+        errors.append('Component "{0}" on machine "{1}" has no kind.'.format(
+            component.name, machine.name))
+
+  if system.master_machine_name not in names:
+    errors.append('Master machine "{0}" is not defined.'.format(
+        system.master_machine_name))
+  if errors:
+    raise ConfigException('\n'.join(errors))
+
+
+class ConfigLoader(pattern.Logger):
+  """Loads system configuration from text file through a binary cache.
+
+  Parsing text format is slow for large configuration, so the parsed
+  configuration is validated once and cached next to the text file in binary
+  format, keyed by hash of the text, the protobuf schema and the cache format.
+  The cache is reused until any of them changes.
+
+  Configuration is also where status is kept at runtime, so updates to it
+  should hold lock, which reload() holds while changing it in place.
+  """
+
+  def __init__(self, path, *args, **kwargs):
+    """Creates ConfigLoader instance.
+
+    Args:
+      path: path to system configuration file in text format.
+    """
+    super(ConfigLoader, self).__init__(*args, **kwargs)
+    self._path = path
+    self._cache_path = path + '.cache'
+    self._system = None
+    self._machines_by_ip = {}
+    self._machines_by_name = {}
+    self._lock = threading.RLock()
+
+  @property
+  def lock(self):
+    """Gets lock guarding changes to the loaded configuration."""
+    return self._lock
+
+  @property
+  def system(self):
+    """Gets system configuration, loading it on first use.
+
+    Returns:
+      flightlab.System protobuf.
+    Raises:
+      ConfigException: if configuration is invalid.
+    """
+    if self._system is None:
+      self.load()
+    return self._system
+
+  def load(self):
+    """Loads system configuration.
+
+    Returns:
+      flightlab.System protobuf.
+    Raises:
+      ConfigException: if configuration is invalid.
+    """
+    system = self._read()
+    with self._lock:
+      self._system = system
+      self._machines_by_ip = dict((x.ip, x) for x in system.machines)
+      self._machines_by_name = dict((x.name, x) for x in system.machines)
+    return system
+
+  def _read(self):
+    start_time = time.time()
+    with open(self._path, 'rb') as f:
+      content = f.read()
+    digest = self._get_digest(content)
+
+    system = self._read_cache(digest)
+    if system is not None:
+      source = 'cache'
+    else:
+      source = 'text'
+      system = controller_pb2.System()
+      text_format.Merge(content.decode('utf-8'), system)
+      validate(system)
+      self._write_cache(digest, system)
+
+    self.logger.info('Loaded {0} machines from {1} in {2:.3f} seconds.'.format(
+        len(system.machines), source, time.time() - start_time))
+    return system
+
+  def reload(self):
+    """Reloads system configuration into the one loaded before.
+
+    The loaded configuration is updated in place under lock, so protobufs of
+    machines and components held by others stay part of it. Runtime fields of
+    components whose configuration is unchanged are kept. Existing machines
+    and components keep their order, and added ones are appended.
+
+    Returns:
+      List of names of machines added or changed.
+    Raises:
+      ConfigException: if new configuration is invalid, in which case the
+                       loaded configuration is not changed.
+    """
+    if self._system is None:
+      return [x.name for x in self.load().machines]
+
+    system = self._read()
+    with self._lock:
+      current = self._system
+      added, _, changed = diff(current.machines, system.machines)
+      _update_items(current.machines, system.machines, self._update_machine)
+      update_in_place(current, system,
+                      skipped=('machines', 'state', 'user'))
+      self._machines_by_ip = dict((x.ip, x) for x in current.machines)
+      self._machines_by_name = dict((x.name, x) for x in current.machines)
+    return added + changed
+
+  def _update_machine(self, machine, new):
+    _, _, changed = diff(machine.components, new.components)
+
+    def update_component(component, new_component):
+      if component.name in changed:
+        update_in_place(component, new_component)
+
+    update_in_place(machine, new,
+                    skipped=('components', 'last_heartbeat_timstamp'))
+    _update_items(machine.components, new.components, update_component)
+
+  def get_machine_by_ip(self, ip):
+    """Gets configuration of a machine by IP address.
+
+    Returns:
+      flightlab.Machine protobuf, or None if not found.
+    """
+    if self._system is None:
+      self.load()
+    return self._machines_by_ip.get(ip)
+
+  def get_machine_by_name(self, name):
+    """Gets configuration of a machine by name.
+
+    Returns:
+      flightlab.Machine protobuf, or None if not found.
+    """
+    if self._system is None:
+      self.load()
+    return self._machines_by_name.get(name)
+
+  def _get_digest(self, content):
+    # A cache written with another schema may parse without error into wrong
+    # fields, so the schema is part of the key.
+    sha1 = hashlib.sha1(_CACHE_VERSION)
+    sha1.update(controller_pb2.DESCRIPTOR.serialized_pb)
+    sha1.update(content)
+    return sha1.hexdigest().encode('ascii')
+
+  def _read_cache(self, digest):
+    try:
+      with open(self._cache_path, 'rb') as f:
+        if f.readline().rstrip(b'\n') != digest:
+          return None
+        system = controller_pb2.System()
+        system.ParseFromString(f.read())
+        return system
+    except Exception as e:
+      if os.path.exists(self._cache_path):
+        self.logger.warn('Failed to read config cache: {0}'.format(e))
+      return None
+
+  def _write_cache(self, digest, system):
+    temp_path = self._cache_path + '.tmp'
+    try:
+      with open(temp_path, 'wb') as f:
+        f.write(digest + b'\n')
+        f.write(system.SerializeToString())
+      if os.path.exists(self._cache_path):
+        os.remove(self._cache_path)
+      os.rename(temp_path, self._cache_path)
+    except (IOError, OSError) as e:
+      self.logger.warn('Failed to write config cache: {0}'.format(e))
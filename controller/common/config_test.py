@@ -0,0 +1,86 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test-cases for common.config.ConfigLoader.
+
+Usage: python -m common.config_test
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+from common import config
+from protos import controller_pb2
+
+_CONFIG = """
+master_machine_name: "master"
+machines {
+  name: "master"
+  ip: "10.0.0.1"
+}
+machines {
+  name: "client"
+  ip: "10.0.0.2"
+  components {
+    name: "sim"
+    app { executable_path: "sim.exe" }
+  }
+  components {
+    name: "display"
+    app { executable_path: "display.exe" }
+  }
+}
+"""
+
+
+def test_reload():
+  """Checks protobufs held before reload() stay part of the configuration."""
+  config_dir = tempfile.mkdtemp()
+  path = os.path.join(config_dir, 'config.protoascii')
+  with open(path, 'w') as f:
+    f.write(_CONFIG)
+  loader = config.ConfigLoader(path)
+  system = loader.load()
+  machine = loader.get_machine_by_name('client')
+  sim, display = machine.components
+  sim.status = controller_pb2.Component.ON
+  display.status = controller_pb2.Component.ON
+
+  with open(path, 'w') as f:
+    f.write(
+        _CONFIG.replace('10.0.0.2', '10.0.0.3').replace('display.exe',
+                                                        'display2.exe') +
+        'machines { name: "new" ip: "10.0.0.4" }\n')
+  changed = loader.reload()
+  assert changed == ['new', 'client'], changed
+  assert loader.system is system
+  assert loader.get_machine_by_name('client') is machine
+  assert machine.ip == '10.0.0.3'
+  assert sim.status == controller_pb2.Component.ON  # unchanged, so kept
+  assert display.app.executable_path == 'display2.exe'
+  assert display.status == controller_pb2.Component.NOT_APPLICABLE  # reset
+
+  # Updates to protobufs held across reload() are seen in the configuration.
+  sim.status = controller_pb2.Component.FAILED
+  display.app.status = controller_pb2.App.RUNNING
+  assert system.machines[1].components[0].status == sim.status
+  assert system.machines[1].components[1].app.status == display.app.status
+  print('Reloaded in place: {0} machines, changed: {1}'.format(
+      len(system.machines), changed))
+  shutil.rmtree(config_dir)
+
+
+if __name__ == '__main__':
+  test_reload()
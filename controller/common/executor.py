@@ -0,0 +1,125 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Library for running tasks on a bounded pool of threads."""
+
+import collections
+import sys
+import threading
+import time
+import traceback
+
+from common import pattern
+from concurrent import futures
+
+_Task = collections.namedtuple('_Task', ['name', 'target', 'kwargs', 'time'])
+
+
+class KeyedExecutor(pattern.Closable, pattern.Logger):
+  """Runs tasks on a bounded pool of threads, one at a time per key.
+
+  Tasks of the same key never overlap and run in the order submitted. Only the
+  latest task waiting for a key is kept, so a newer task supersedes the one that
+  has not started yet.
+
+  Timing of every task is logged on DEBUG level and accumulated per key and
+  task name. See get_metrics().
+  """
+
+  def __init__(self, max_workers=4, *args, **kwargs):
+    """Creates KeyedExecutor instance.
+
+    Args:
+      max_workers: maximum number of tasks running at the same time.
+    """
+    super(KeyedExecutor, self).__init__(*args, **kwargs)
+    self._pool = futures.ThreadPoolExecutor(max_workers=max_workers)
+    self._lock = threading.Lock()
+    self._pending = {}  # key => _Task
+    self._active = set()  # keys being drained by the pool
+    self._metrics = {}  # key => {task name => metrics dictionary}
+
+  def submit(self, key, name, target, kwargs=None):
+    """Schedules a task.
+
+    Args:
+      key: key to serialize tasks with, e.g. component name.
+      name: name of the task for logging and metrics.
+      target: function to run.
+      kwargs: a dictionary of all named arguments.
+    """
+    task = _Task(name=name, target=target, kwargs=kwargs or {}, time=time.time())
+    with self._lock:
+      superseded = self._pending.get(key)
+      self._pending[key] = task
+      if superseded:
+        self.logger.debug('[{0}] "{1}" superseded by "{2}".'.format(
+            key, superseded.name, name))
+        self._record(key, superseded.name, 'superseded', 1)
+      if key not in self._active:
+        self._active.add(key)
+        self._pool.submit(self._drain, key)
+
+  def get_metrics(self):
+    """Gets timing of tasks.
+
+    Returns:
+      Dictionary of key => task name => dictionary of "count", "superseded",
+      "last", "total", "max" and "max_wait", in seconds except counts.
+    """
+    with self._lock:
+      return dict((key, dict((name, dict(metrics))
+                             for name, metrics in tasks.items()))
+                  for key, tasks in self._metrics.items())
+
+  def close(self):
+    """Drops pending tasks and stops accepting new ones."""
+    with self._lock:
+      self._pending.clear()
+    self._pool.shutdown(wait=False)
+
+  def _drain(self, key):
+    while True:
+      with self._lock:
+        task = self._pending.pop(key, None)
+        if not task:
+          self._active.discard(key)
+          return
+
+      start_time = time.time()
+      try:
+        task.target(**task.kwargs)
+      except Exception as e:
+        try:
+          exc_type, exc_value, exc_traceback = sys.exc_info()
+          msg = traceback.format_exception(exc_type, exc_value, exc_traceback)
+          self.logger.error('\n'.join(msg))
+        except:
+          self.logger.error('Exception: {0}'.format(e))
+      duration = time.time() - start_time
+      wait = start_time - task.time
+
+      self.logger.debug('[{0}] "{1}" took {2:.3f} seconds (waited {3:.3f} '
+                        'seconds).'.format(key, task.name, duration, wait))
+      with self._lock:
+        self._record(key, task.name, 'count', 1)
+        self._record(key, task.name, 'total', duration)
+        metrics = self._metrics[key][task.name]
+        metrics['last'] = duration
+        metrics['max'] = max(metrics.get('max', 0), duration)
+        metrics['max_wait'] = max(metrics.get('max_wait', 0), wait)
+
+  def _record(self, key, name, metric, value):
+    """Adds value to a metric. Lock must be held."""
+    metrics = self._metrics.setdefault(key, {}).setdefault(name, {})
+    metrics[metric] = metrics.get(metric, 0) + value
@@ -0,0 +1,173 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Library for watching changes of files."""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+
+from common import pattern
+
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def _load_inotify():
+  """Loads inotify functions from libc, or returns None if not available."""
+  if not sys.platform.startswith('linux'):
+    return None
+  try:
+    libc = ctypes.CDLL(
+        ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+    ]
+    return libc
+  except (OSError, AttributeError):
+    return None
+
+
+class DirectoryWatcher(pattern.Worker, pattern.EventEmitter):
+  """Watches files in a directory.
+
+  It uses inotify on Linux, so changes are reported as soon as they happen
+  without scanning the directory. On other platforms, or if inotify is not
+  available, it falls back to polling modification time of files.
+
+  Events:
+    "created": when a file is created or moved into the directory.
+      Args:
+        path: path of the file.
+    "modified": when a file is written or its attributes change.
+      Args:
+        path: path of the file.
+    "deleted": when a file is deleted or moved out of the directory.
+      Args:
+        path: path of the file.
+  """
+
+  _READ_TIMEOUT = 0.5  # sec
+
+  def __init__(self, path, names=None, poll_interval=1, *args, **kwargs):
+    """Creates DirectoryWatcher instance.
+
+    Args:
+      path: directory to watch.
+      names: file names to report. All files are reported if None.
+      poll_interval: seconds between scans if inotify is not available.
+    """
+    super(DirectoryWatcher, self).__init__(*args, **kwargs)
+    self._path = path
+    self._names = set(names) if names else None
+    self._poll_interval = poll_interval
+    self._libc = _load_inotify()
+    self._fd = None
+    self._snapshot = None
+
+  def _on_start(self):
+    if self._libc:
+      fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+      if fd >= 0:
+        mask = (_IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+                _IN_CREATE | _IN_DELETE)
+        path = self._path.encode(sys.getfilesystemencoding())
+        if self._libc.inotify_add_watch(fd, path, mask) >= 0:
+          self._fd = fd
+          return
+      error = os.strerror(ctypes.get_errno())
+      if fd >= 0:
+        os.close(fd)
+      self.logger.warn('Failed to watch {0} with inotify ({1}). Polling '
+                       'instead.'.format(self._path, error))
+    self._snapshot = self._scan()
+
+  def _on_run(self):
+    if self._fd is None:
+      self._sleep(self._poll_interval)
+      self._poll()
+      return
+
+    readable, _, _ = select.select([self._fd], [], [], self._READ_TIMEOUT)
+    if not readable:
+      return
+    try:
+      data = os.read(self._fd, 64 * 1024)
+    except OSError as e:
+      if e.errno == errno.EAGAIN:
+        return
+      raise
+
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(data):
+      _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+      offset += _EVENT_HEADER.size
+      name = data[offset:offset + length].rstrip(b'\0')
+      offset += length
+      name = name.decode(sys.getfilesystemencoding())
+      if mask & (_IN_CREATE | _IN_MOVED_TO):
+        self._report('created', name)
+      elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+        self._report('deleted', name)
+      elif mask & (_IN_CLOSE_WRITE | _IN_ATTRIB):
+        self._report('modified', name)
+
+  def _on_stop(self):
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def _poll(self):
+    snapshot = self._scan()
+    for name, stat in snapshot.items():
+      if name not in self._snapshot:
+        self._report('created', name)
+      elif self._snapshot[name] != stat:
+        self._report('modified', name)
+    for name in self._snapshot:
+      if name not in snapshot:
+        self._report('deleted', name)
+    self._snapshot = snapshot
+
+  def _scan(self):
+    snapshot = {}
+    try:
+      names = os.listdir(self._path)
+    except OSError:
+      return snapshot
+    for name in names:
+      if self._names is not None and name not in self._names:
+        continue
+      try:
+        stat = os.stat(os.path.join(self._path, name))
+        snapshot[name] = (stat.st_mtime, stat.st_size, stat.st_mode)
+      except OSError:
+        pass
+    return snapshot
+
+  def _report(self, event, name):
+    if not name or (self._names is not None and name not in self._names):
+      return
+    self.emit(event, os.path.join(self._path, name))
@@ -105,9 +105,12 @@ class EventEmitter(Closable):
     Returns:
       Self.
     """
-    assert self._event_handlers is not None
-    if event in self._event_handlers:
-      del self._event_handlers[event]
+    # Closed emitter has no subscriber left, so there is nothing to do.
+    if self._event_handlers and event in self._event_handlers:
+      # Replaced rather than modified, so an emit in progress is not affected.
+      self._event_handlers[event] = [
+          x for x in self._event_handlers[event] if x != callback
+      ]
     return self
 
   def emit(self, event, *args, **kwargs):
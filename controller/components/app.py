@@ -13,18 +13,134 @@
 # limitations under the License.
 """Library for components related to running apps."""
 
+import collections
+import os
+import psutil
 import subprocess
+import tempfile
 import threading
+import time
 
 from components import base
+from concurrent import futures
 from protos import controller_pb2
 from utils import app
+from utils import output
+from utils import process
+from utils import resources
+
+
+_IO_CLASSES = {
+    controller_pb2.ResourceControl.IO_REALTIME: 'realtime',
+    controller_pb2.ResourceControl.IO_BEST_EFFORT: 'best_effort',
+    controller_pb2.ResourceControl.IO_IDLE: 'idle',
+}
+
+
+def get_resource_control(name, config):
+  """Creates utils.resources.ResourceControl per configuration.
+
+  Args:
+    name: name of the app.
+    config: flightlab.ResourceControl protobuf.
+  Returns:
+    utils.resources.ResourceControl, or None if nothing is configured.
+  """
+  if config.ByteSize() == 0:
+    return None
+  return resources.ResourceControl(
+      name=name,
+      cpu_affinity=list(config.cpu_affinity),
+      nice=config.nice if config.nice else None,
+      io_class=_IO_CLASSES.get(config.io_class),
+      io_priority=config.io_priority,
+      cgroup=config.cgroup if config.cgroup else None,
+      cpu_limit=config.cpu_limit if config.cpu_limit else None,
+      memory_limit=config.memory_limit if config.memory_limit else None)
+
+
+def get_output_capture(name, options):
+  """Creates utils.output.OutputCapture per configuration.
+
+  Args:
+    name: name of the app.
+    options: flightlab.OutputOptions protobuf.
+  Returns:
+    utils.output.OutputCapture, or None if capturing is disabled.
+  """
+  if options.disabled:
+    return None
+  return output.OutputCapture(
+      name=name,
+      log_dir=(options.log_dir or
+               os.path.join(tempfile.gettempdir(), 'flightlab')),
+      ring_size=options.buffer_size or 256 * 1024,
+      max_file_size=options.max_file_size or 10 * 1024 * 1024,
+      backup_count=options.backup_count or 3)
+
+
+def get_restart_options(policy):
+  """Gets restart options for utils.app.Application.
+
+  Args:
+    policy: flightlab.RestartPolicy protobuf.
+  Returns:
+    Dictionary of named arguments.
+  """
+  return {
+      'initial_backoff': policy.initial_backoff or 1,
+      'max_backoff': policy.max_backoff or 60,
+      'crash_loop_count': policy.crash_loop_count or 5,
+      'crash_loop_window': policy.crash_loop_window or 300,
+  }
+
+
+def update_stats(stats, application):
+  """Updates app statistics protobuf.
+
+  Args:
+    stats: flightlab.AppStats protobuf to update.
+    application: utils.app.Application.
+  """
+  stats.restart_count = application.restart_count
+  stats.crash_count = application.crash_count
+  stats.restart_rate = application.restart_rate
+  stats.uptime = application.uptime
+  stats.start_time = application.start_time or 0
+  stats.shutdown_duration = application.shutdown_duration
+
+  applied = application.applied_resources
+  stats.ClearField('applied_resources')
+  if applied:
+    reverse_io_classes = dict((v, k) for k, v in _IO_CLASSES.items())
+    stats.applied_resources.cpu_affinity.extend(applied.get('cpu_affinity', []))
+    stats.applied_resources.nice = applied.get('nice', 0)
+    stats.applied_resources.io_class = reverse_io_classes.get(
+        applied.get('io_class'), controller_pb2.ResourceControl.IO_UNCHANGED)
+    stats.applied_resources.io_priority = applied.get('io_priority', 0)
+    stats.applied_resources.cgroup = applied.get('cgroup', '')
+    stats.applied_resources.cpu_limit = applied.get('cpu_limit', 0)
+    stats.applied_resources.memory_limit = applied.get('memory_limit', 0)
+
+
+def update_usage(usage, summary):
+  """Updates resource usage protobuf.
+
+  Args:
+    usage: flightlab.ResourceUsage protobuf to update.
+    summary: dictionary from utils.process.ResourceSampler.get_summary().
+  """
+  usage.Clear()
+  if summary:
+    for key, value in summary.items():
+      setattr(usage, key, value)
 
 
 class AppComponent(base.Component):
   """Component to run command-line based app on any platform.
 
-  This component can start app, restart app upon crash, and stop app.
+  This component can start app, restart app upon crash, and stop app. If the
+  app crashes too often, the component is reported FAILED until next start.
 
   Events:
     "status_changed": when status of the app is changed.
@@ -48,21 +164,50 @@ class AppComponent(base.Component):
         working_dir=self.settings.working_dir,
         restart_on_crash=(self.settings.restart_on_crash
                           if self.settings.restart_on_crash else False),
-        env=(self.settings.env if self.settings.env else None))
+        env=(self.settings.env if self.settings.env else None),
+        shutdown_grace_period=(self.settings.shutdown_grace_period
+                               if self.settings.shutdown_grace_period else 5),
+        resources=get_resource_control(self.name, self.settings.resources),
+        output=get_output_capture(self.name, self.settings.output),
+        **get_restart_options(self.settings.restart_policy))
     self._app.on('started', self._on_app_started)
     self._app.on('stopped', self._on_app_stopped)
+    self._app.on('crash_loop', self._on_app_crash_loop)
 
     self._monitor = threading.Timer(1, self._check_status)
     self._monitor.start()
 
+  @property
+  def application(self):
+    """Gets underlaying application.
+
+    Returns:
+      utils.app.Application.
+    """
+    return self._app
+
   def close(self):
     if self._monitor:
       self._monitor.cancel()
       self._monitor = None
     self._app.stop()
+    if self._app.output:
+      self._app.output.close()
+
+  def update_resource_usage(self, summary):
+    """Updates resource usage and other statistics of the app.
+
+    Args:
+      summary: dictionary from utils.process.ResourceSampler.get_summary().
+    """
+    update_stats(self.settings.stats, self._app)
+    update_usage(self.settings.stats.resource_usage, summary)
 
   def _check_status(self):
-    if self._app.has_running_instance():
+    if self._app.in_crash_loop:
+      component_status = controller_pb2.Component.FAILED
+      app_status = controller_pb2.App.CRASH_LOOP
+    elif self._app.has_running_instance():
       component_status = controller_pb2.Component.ON
       app_status = controller_pb2.App.RUNNING
     else:
@@ -73,7 +218,7 @@ class AppComponent(base.Component):
         self.settings.status != app_status):
       self.proto.status = component_status
       self.settings.status = app_status
-      self.emit('status_changed', self)
+      self._emit_status_changed()
 
   def _start(self):
     self.logger.info('[App - {0}] Starting...'.format(self.name))
@@ -91,26 +236,170 @@ class AppComponent(base.Component):
     self.logger.info('[App - {0}] Started.'.format(self.name))
     self.settings.status = controller_pb2.App.RUNNING
     self.proto.status = controller_pb2.Component.ON
-    self.emit('status_changed', self)
+    self._emit_status_changed()
 
   def _on_app_stopped(self, app):
     self.logger.info('[App - {0}] Stopped.'.format(self.name))
     self.settings.status = controller_pb2.App.NOT_RUNNING
     self.proto.status = controller_pb2.Component.OFF
+    self._emit_status_changed()
+
+  def _on_app_crash_loop(self, app):
+    self.logger.error('[App - {0}] Crash loop detected.'.format(self.name))
+    self.settings.status = controller_pb2.App.CRASH_LOOP
+    self.proto.status = controller_pb2.Component.FAILED
+    self._emit_status_changed()
+
+  def _emit_status_changed(self):
+    update_stats(self.settings.stats, self._app)
     self.emit('status_changed', self)
 
 
 class CommandLineComponent(base.Component):
-  """Component to run command-line based apps on any platform."""
+  """Component to run command-line based apps on any platform.
+
+  Commands run one after another in the order listed, except that consecutive
+  commands of the same group run in parallel. A command running longer than its
+  timeout is killed along with its child processes. Results of the latest run
+  are kept in last_run of the settings and reported as status.
+
+  Events:
+    "status_changed": when commands start or finish running.
+      Args:
+        commandline_component: instance of this class.
+  """
+
+  _OUTPUT_TAIL_LINES = 20
+  _KILL_GRACE_PERIOD = 1
+  _OUTPUT_DRAIN_TIMEOUT = 0.5  # sec to read remaining output after exit
 
   def _start(self):
-    for cmd in self.settings.when_on:
-      self.logger.info('[{0}] Running: {1}'.format(self.name, cmd))
-      ret = subprocess.call(cmd)
-      self.logger.info('[{0}] Done (return code={1})'.format(self.name, ret))
+    self._run(self.settings.when_on, self.settings.on_commands)
 
   def _stop(self):
-    for cmd in self.settings.when_off:
-      self.logger.info('[{0}] Running: {1}'.format(self.name, cmd))
-      ret = subprocess.call(cmd)
-      self.logger.info('[{0}] Done (return code={1})'.format(self.name, ret))
\ No newline at end of file
+    self._run(self.settings.when_off, self.settings.off_commands)
+
+  def _restart(self):
+    self._stop()
+    self._start()
+
+  def _run(self, cmds, commands):
+    commands = ([controller_pb2.CommandLine.Command(command=x) for x in cmds] +
+                list(commands))
+    if not commands:
+      return
+
+    self.settings.status = controller_pb2.CommandLine.RUNNING
+    self.proto.status = controller_pb2.Component.TRANSIENT
+    self.emit('status_changed', self)
+
+    run = controller_pb2.CommandLine.Run(start_time=time.time())
+    for group in self._group(commands):
+      if len(group) == 1:
+        run.results.extend([self._execute(group[0])])
+      else:
+        with futures.ThreadPoolExecutor(max_workers=len(group)) as executor:
+          run.results.extend(executor.map(self._execute, group))
+    run.duration = time.time() - run.start_time
+
+    failures = [
+        x for x in run.results if x.return_code != 0 or x.timed_out
+    ]
+    self.logger.info(
+        '[{0}] Ran {1} command(s) in {2:.2f} seconds ({3} failed).'.format(
+            self.name, len(run.results), run.duration, len(failures)))
+
+    self.settings.last_run.CopyFrom(run)
+    if failures:
+      self.settings.status = controller_pb2.CommandLine.FAILED
+      self.proto.status = controller_pb2.Component.FAILED
+    else:
+      self.settings.status = controller_pb2.CommandLine.SUCCEEDED
+      self.proto.status = controller_pb2.Component.NOT_APPLICABLE
+    self.emit('status_changed', self)
+
+  def _group(self, commands):
+    groups = []
+    for command in commands:
+      if (command.group and groups and
+          groups[-1][0].group == command.group):
+        groups[-1].append(command)
+      else:
+        groups.append([command])
+    return groups
+
+  def _execute(self, command):
+    result = controller_pb2.CommandLine.Result(command=command.command)
+    timeout = command.timeout or self.settings.default_timeout
+    self.logger.info('[{0}] Running: {1}'.format(self.name, command.command))
+
+    start_time = time.time()
+    try:
+      proc = subprocess.Popen(
+          command.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+      self.logger.warn('[{0}] Failed to run "{1}": {2}'.format(
+          self.name, command.command, e))
+      result.return_code = -1
+      result.output_tail = str(e)
+      return result
+
+    timer = None
+    if timeout:
+      timer = threading.Timer(
+          timeout, self._kill, kwargs={
+              'proc': proc,
+              'result': result
+          })
+      timer.start()
+
+    # Output is drained by a separate thread, and only the tail is kept in
+    # memory. Processes started in background may hold the pipe after the
+    # command exits, so the command is done when it exits, not at end of
+    # output.
+    tail = collections.deque(maxlen=self._OUTPUT_TAIL_LINES)
+    reader = threading.Thread(
+        target=self._read_output, args=(proc.stdout, tail))
+    reader.daemon = True
+    reader.start()
+    return_code = proc.wait()
+    reader.join(self._OUTPUT_DRAIN_TIMEOUT)
+    if timer:
+      # Waits for a kill in progress, which may reap the process and record its
+      # return code, since Popen can't get it once reaped by psutil.
+      timer.cancel()
+      timer.join()
+    if not result.timed_out or not result.return_code:
+      result.return_code = return_code
+
+    result.duration = time.time() - start_time
+    result.output_tail = b''.join(list(tail)).decode('utf-8', 'replace')
+    self.logger.info(
+        '[{0}] Done (return code={1}, {2:.2f} seconds{3})'.format(
+            self.name, result.return_code, result.duration,
+            ', timed out' if result.timed_out else ''))
+    return result
+
+  def _read_output(self, stream, tail):
+    try:
+      for line in iter(stream.readline, b''):
+        tail.append(line)
+    finally:
+      stream.close()
+
+  def _kill(self, proc, result):
+    if proc.poll() is not None:
+      return
+    try:
+      target = psutil.Process(proc.pid)
+    except psutil.Error:
+      return
+    self.logger.warn('[{0}] Timed out. Killing "{1}"...'.format(
+        self.name, result.command))
+    result.timed_out = True
+    process.terminate([target], self._KILL_GRACE_PERIOD)
+    # psutil.wait_procs() sets returncode, e.g. -15 if terminated by SIGTERM,
+    # if the process is reaped by psutil rather than Popen.wait().
+    return_code = getattr(target, 'returncode', None)
+    if return_code is not None:
+      result.return_code = return_code
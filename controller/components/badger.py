@@ -37,7 +37,15 @@ class BadgeReaderComponent(base.Component):
     """
     super(BadgeReaderComponent, self).__init__(proto, *args, **kwargs)
     self._deauth = None
-    self._validator = badger.BadgeValidator(self.settings.url, self.settings.key_param)
+    self._allowlist = None
+    if self.settings.allowlist_url:
+      self._allowlist = badger.BadgeAllowlist(
+          url=self.settings.allowlist_url,
+          path=self.settings.allowlist_path or None,
+          sync_interval=self.settings.allowlist_sync_interval or 3600)
+      self._allowlist.start()
+    self._validator = badger.BadgeValidator(self.settings.url, self.settings.key_param,
+                                            allowlist=self._allowlist)
     self._reader = badger.BadgeReader(usb_vendor_id=self.settings.usb_vendor_id, usb_product_id=self.settings.usb_product_id)
     self._reader.on('read_success', self._on_read_success)
     self._reader.start()
@@ -45,10 +53,29 @@ class BadgeReaderComponent(base.Component):
 
   def _on_read_success(self, reader, badge_id):
     self.logger.info("Badge %s Read Successfully", badge_id)
-    if self._validator.validate(badge_id):
+    # Validation may take a while, so it doesn't block the reader.
+    self._validator.validate_async(badge_id, self._on_validated)
+
+  def _on_validated(self, badge_id, result):
+    if self._allowlist:
+      stats = self._allowlist.get_stats()
+      self.settings.stats.allowlist_size = stats['size']
+      self.settings.stats.last_sync_time = stats['last_sync_time']
+      self.settings.stats.sync_duration = stats['sync_duration']
+      self.settings.stats.allowlist_hits = stats['hits']
+      self.settings.stats.allowlist_misses = stats['misses']
+      lookups = stats['hits'] + stats['misses']
+      self.logger.info("Allowlist of %d badges synced in %.3f seconds, "
+                       "hit rate %.1f%%", stats['size'], stats['sync_duration'],
+                       100.0 * stats['hits'] / lookups if lookups else 0)
+    if result:
       self.logger.info("Badge Validated")
       self.settings.status = controller_pb2.Badger.AUTHORIZED
       self.emit('status_changed', self)
+    elif result is None:
+      self.logger.info("Badge Validation Unavailable")
+      self.settings.status = controller_pb2.Badger.AUTH_ERROR
+      self.emit('status_changed', self)
     else:
       self.logger.info("Invalid Badge")
       self.settings.status = controller_pb2.Badger.UNAUTHORIZED
@@ -73,5 +100,9 @@ class BadgeReaderComponent(base.Component):
     """Stops the badge reader and deauthorization thread."""
     if self._deauth:
       self._deauth.cancel()
+    self._reader.stop()
+    self._validator.close()
+    if self._allowlist:
+      self._allowlist.stop()
     super(BadgeReaderComponent, self).close()
 
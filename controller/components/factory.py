@@ -13,13 +13,27 @@
 # limitations under the License.
 """Factories for creating components."""
 
+import importlib
 import sys
+import threading
 
 from common import pattern
-from components import app
-from components import display
-from components import light
-from components import media
+
+# Component kind => (module, class name). Modules are only imported when a
+# component of the kind is created, so machines don't pay for dependencies of
+# components they don't have, e.g. pyserial, playsound and evdev.
+_REGISTRY = {
+    'app': ('components.app', 'AppComponent'),
+    'light': ('components.light', 'DMXLightComponent'),
+    'projector': ('components.display', 'ProjectorComponent'),
+    'sound': ('components.media', 'SoundComponent'),
+    'commandline': ('components.app', 'CommandLineComponent'),
+}
+
+if sys.platform.startswith('win'):
+  _REGISTRY['windows_app'] = ('components.windows', 'WindowsAppComponent')
+else:
+  _REGISTRY['badger'] = ('components.badger', 'BadgeReaderComponent')
 
 
 class ComponentFactory(pattern.Logger):
@@ -27,20 +41,8 @@ class ComponentFactory(pattern.Logger):
 
   def __init__(self, *args, **kwargs):
     super(ComponentFactory, self).__init__(*args, **kwargs)
-    self._mapping = {
-        'app': app.AppComponent,
-        'light': light.DMXLightComponent,
-        'projector': display.ProjectorComponent,
-        'sound': media.SoundComponent,
-        'commandline': app.CommandLineComponent,
-    }
-
-    if sys.platform.startswith('win'):
-      import windows
-      self._mapping['windows_app'] = windows.WindowsAppComponent
-    else:
-      from components import badger
-      self._mapping['badger'] = badger.BadgeReaderComponent
+    self._mapping = {}  # kind => component class loaded
+    self._lock = threading.Lock()
 
   def get_settings(self, component_proto):
     """Gets component-specific configuration protobuf.
@@ -65,10 +67,17 @@ class ComponentFactory(pattern.Logger):
       specifc configuration.
     """
     kind = component_proto.WhichOneof('kind')
-    if kind not in self._mapping:
+    if kind not in _REGISTRY:
       raise UnknownComponentException(
           'Unknown component kind {0}'.format(kind))
-    return self._mapping[kind]
+
+    with self._lock:
+      if kind not in self._mapping:
+        module_name, class_name = _REGISTRY[kind]
+        self.logger.debug('Loading {0}...'.format(module_name))
+        module = importlib.import_module(module_name)
+        self._mapping[kind] = getattr(module, class_name)
+      return self._mapping[kind]
 
   def create_component(self, component_proto):
     """Creates corrsponding instance per component configuration protobuf.
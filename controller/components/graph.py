@@ -0,0 +1,329 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Library for running commands on components in dependency order."""
+
+import collections
+import threading
+import time
+
+from common import pattern
+from protos import controller_pb2
+
+_DEFAULT_READY_TIMEOUT = 60  # sec
+
+
+class _Run(object):
+  """State of a command running through the graph."""
+
+  def __init__(self, command, phases):
+    self.command = command
+    self.phases = phases  # remaining commands, e.g. [STOP, START] for RESTART
+    self.phase = None
+    self.prerequisites = {}  # name => set of names to wait for
+    self.waiting = {}  # name => threading.Timer waiting for readiness
+    self.dispatch_times = {}  # name => time command was dispatched
+    self.ready_times = {}  # name => time component became ready
+
+
+class ComponentGraph(pattern.Logger):
+  """Dependency graph of components on a machine.
+
+  On START, components without dependencies start in parallel, and every other
+  component starts as soon as all components it depends on are ready. On STOP,
+  the order is reversed. RESTART stops all components and then starts them.
+
+  A newer command supersedes the one still running through the graph.
+  Components that haven't been dispatched for the older command are skipped.
+  Components added while a command is running join it. See update().
+
+  If dependencies contain a cycle, they are ignored and all components run in
+  parallel.
+  """
+
+  def __init__(self, components, executor, *args, **kwargs):
+    """Creates ComponentGraph instance.
+
+    Args:
+      components: list of components.base.Component.
+      executor: common.executor.KeyedExecutor to run commands on.
+    """
+    super(ComponentGraph, self).__init__(*args, **kwargs)
+    self._executor = executor
+    self._components = collections.OrderedDict(
+        (x.name, x) for x in components)
+    self._build_edges()
+
+    self._lock = threading.RLock()
+    self._run = None
+    for component in components:
+      component.on('status_changed', self._on_status_changed)
+
+  def run(self, command):
+    """Runs a command on all components in dependency order.
+
+    Args:
+      command: flightlab.SystemCommand.Command.
+    """
+    if not self._components:
+      return
+    if command == controller_pb2.SystemCommand.RESTART:
+      phases = [controller_pb2.SystemCommand.STOP,
+                controller_pb2.SystemCommand.START]
+    else:
+      phases = [command]
+    with self._lock:
+      if self._run:
+        self._cancel_waiting(self._run)
+      self._run = _Run(command, phases)
+      self._next_phase(self._run)
+
+  def update(self, components):
+    """Changes components in the graph without interrupting running command.
+
+    Components added, or replaced by another instance of the same name, join
+    the running command: they are dispatched as soon as their prerequisites are
+    ready, or right away if those are done. Components waiting only for removed
+    ones are dispatched.
+
+    Args:
+      components: list of components.base.Component, replacing current ones.
+    Returns:
+      List of components added that joined the running command.
+    """
+    with self._lock:
+      old = self._components
+      self._components = collections.OrderedDict(
+          (x.name, x) for x in components)
+      added = [x for x in components if old.get(x.name) is not x]
+      for component in old.values():
+        if self._components.get(component.name) is not component:
+          component.off('status_changed', self._on_status_changed)
+      for component in added:
+        component.on('status_changed', self._on_status_changed)
+      self._build_edges()
+
+      run = self._run
+      if not run:
+        return []
+      for component in old.values():
+        if self._components.get(component.name) is not component:
+          self._forget(run, component.name)
+      self._update_phase(run)
+      return added
+
+  def close(self):
+    """Stops tracking components and cancels the command running through it."""
+    for component in self._components.values():
+      component.off('status_changed', self._on_status_changed)
+    with self._lock:
+      if self._run:
+        self._cancel_waiting(self._run)
+        self._run = None
+
+  def _next_phase(self, run):
+    """Starts next phase of a run. Lock must be held."""
+    run.phase = run.phases.pop(0)
+    if run.phase == controller_pb2.SystemCommand.STOP:
+      edges = self._dependents
+    else:
+      edges = self._depends_on
+    run.prerequisites = dict((x, set(edges[x])) for x in self._components)
+    run.dispatch_times = {}
+    run.ready_times = {}
+    for name, prerequisites in run.prerequisites.items():
+      if not prerequisites:
+        self._dispatch(run, name)
+
+  def _forget(self, run, name):
+    """Drops state of a component from a run. Lock must be held."""
+    timer = run.waiting.pop(name, None)
+    if timer:
+      timer.cancel()
+    run.prerequisites.pop(name, None)
+    run.dispatch_times.pop(name, None)
+    run.ready_times.pop(name, None)
+
+  def _update_phase(self, run):
+    """Adapts current phase to changed components. Lock must be held."""
+    if run.phase == controller_pb2.SystemCommand.STOP:
+      edges = self._dependents
+    else:
+      edges = self._depends_on
+    for name in self._components:
+      if name not in run.dispatch_times:
+        run.prerequisites[name] = set(edges[name]) - set(run.ready_times)
+    for name, prerequisites in list(run.prerequisites.items()):
+      if not prerequisites and name not in run.dispatch_times:
+        self._dispatch(run, name)
+    self._check_phase_done(run)
+
+  def _dispatch(self, run, name):
+    """Schedules command of a component. Lock must be held."""
+    run.dispatch_times[name] = time.time()
+    self._executor.submit(
+        key=name,
+        name=controller_pb2.SystemCommand.Command.Name(run.phase),
+        target=self._execute,
+        kwargs={
+            'run': run,
+            'phase': run.phase,
+            'name': name
+        })
+
+  def _execute(self, run, phase, name):
+    component = self._components.get(name)
+    if run is not self._run or phase != run.phase or not component:
+      return
+    try:
+      component.on_command(phase)
+    except Exception as e:
+      self.logger.error('[{0}] Failed to handle {1}: {2}'.format(
+          name, controller_pb2.SystemCommand.Command.Name(phase), e))
+
+    with self._lock:
+      if (run is not self._run or phase != run.phase or
+          self._components.get(name) is not component):
+        return
+      if (phase != controller_pb2.SystemCommand.START or
+          component.proto.ready_when == controller_pb2.Component.STARTED or
+          self._is_ready(component)):
+        self._on_ready(run, name)
+        return
+      timeout = component.proto.ready_timeout or _DEFAULT_READY_TIMEOUT
+      timer = threading.Timer(
+          timeout, self._on_ready_timeout, kwargs={
+              'run': run,
+              'phase': phase,
+              'name': name
+          })
+      timer.daemon = True
+      run.waiting[name] = timer
+      timer.start()
+
+  def _on_status_changed(self, component):
+    with self._lock:
+      run = self._run
+      if (run and component.name in run.waiting and
+          self._is_ready(component)):
+        run.waiting.pop(component.name).cancel()
+        self._on_ready(run, component.name)
+
+  def _on_ready_timeout(self, run, phase, name):
+    with self._lock:
+      if run is not self._run or phase != run.phase or name not in run.waiting:
+        return
+      del run.waiting[name]
+      component = self._components[name]
+      self.logger.warn('[{0}] Not ready in {1} seconds (status={2}). Going on '
+                       'with its dependents.'.format(
+                           name, component.proto.ready_timeout or
+                           _DEFAULT_READY_TIMEOUT,
+                           controller_pb2.Component.Status.Name(
+                               component.proto.status)))
+      self._on_ready(run, name)
+
+  def _on_ready(self, run, name):
+    """Dispatches components waiting for the ready one. Lock must be held."""
+    run.ready_times[name] = time.time()
+    if run.phase == controller_pb2.SystemCommand.STOP:
+      edges = self._depends_on
+    else:
+      edges = self._dependents
+    for dependent in edges[name]:
+      prerequisites = run.prerequisites[dependent]
+      prerequisites.discard(name)
+      if not prerequisites and dependent not in run.dispatch_times:
+        self._dispatch(run, dependent)
+    self._check_phase_done(run)
+
+  def _check_phase_done(self, run):
+    """Goes on to next phase if all components are ready. Lock must be held."""
+    if len(run.ready_times) < len(self._components):
+      return
+    if run.ready_times:
+      self._log_critical_path(run)
+    if run.phases:
+      self._next_phase(run)
+    else:
+      self._run = None
+
+  def _log_critical_path(self, run):
+    phase_name = controller_pb2.SystemCommand.Command.Name(run.phase)
+    start_time = min(run.dispatch_times.values())
+    name = max(run.ready_times, key=lambda x: run.ready_times[x])
+    duration = run.ready_times[name] - start_time
+
+    if run.phase == controller_pb2.SystemCommand.STOP:
+      edges = self._dependents
+    else:
+      edges = self._depends_on
+    path = []
+    while name:
+      path.insert(0, '{0} ({1:.2f}s)'.format(
+          name, run.ready_times[name] - run.dispatch_times[name]))
+      prerequisites = edges[name]
+      name = (max(prerequisites, key=lambda x: run.ready_times[x])
+              if prerequisites else None)
+    self.logger.info('{0} of {1} components finished in {2:.2f} seconds. '
+                     'Critical path: {3}'.format(phase_name,
+                                                 len(run.ready_times), duration,
+                                                 ' -> '.join(path)))
+
+  def _cancel_waiting(self, run):
+    """Stops waiting for readiness of an older run. Lock must be held."""
+    for timer in run.waiting.values():
+      timer.cancel()
+    run.waiting.clear()
+
+  def _build_edges(self):
+    self._depends_on = {}
+    for component in self._components.values():
+      self._depends_on[component.name] = []
+      for name in component.proto.depends_on:
+        if name in self._components:
+          self._depends_on[component.name].append(name)
+        else:
+          self.logger.warn('[{0}] Unknown dependency "{1}" is ignored.'.format(
+              component.name, name))
+    if not self._is_acyclic():
+      self.logger.error('Dependencies of components contain a cycle. All '
+                        'components will run in parallel.')
+      self._depends_on = dict((x, []) for x in self._components)
+    self._dependents = dict((x, []) for x in self._components)
+    for name, prerequisites in self._depends_on.items():
+      for prerequisite in prerequisites:
+        self._dependents[prerequisite].append(name)
+
+  def _is_ready(self, component):
+    return component.proto.status in (controller_pb2.Component.ON,
+                                       controller_pb2.Component.NOT_APPLICABLE)
+
+  def _is_acyclic(self):
+    visiting = set()
+    visited = set()
+
+    def visit(name):
+      if name in visited:
+        return True
+      if name in visiting:
+        return False
+      visiting.add(name)
+      for prerequisite in self._depends_on[name]:
+        if not visit(prerequisite):
+          return False
+      visiting.discard(name)
+      visited.add(name)
+      return True
+
+    return all(visit(x) for x in self._components)
@@ -14,11 +14,18 @@
 """Library for lighting components."""
 
 from components import base
+from protos import controller_pb2
 from utils import light
+from utils import simproxy
 
 
 class DMXLightComponent(base.Component):
-  """Component to control DMX lighting."""
+  """Component to control DMX lighting.
+
+  While the system is off, lights show an idle color shifting effect. If
+  sim_mappings are configured, lights follow data from the flight simulator
+  while the system is on.
+  """
 
   _CHANNELS = [1, 17, 33, 49]
 
@@ -36,8 +43,17 @@ class DMXLightComponent(base.Component):
     for effect in self._effects:
       effect.start()
 
+    self._mappings = []
+    self._sim = None
+    self._telemetry = None
+    if self.settings.sim_proxy and self.settings.sim_mappings:
+      self._mappings = [
+          self._create_mapping(x) for x in self.settings.sim_mappings
+      ]
+
   def close(self):
     """Stops effects and turns off lights."""
+    self._stop_telemetry()
     for effect in self._effects:
       effect.stop()
     self._effects = []
@@ -47,9 +63,70 @@ class DMXLightComponent(base.Component):
     super(DMXLightComponent, self).close()
 
   def _start(self):
+    if self._mappings:
+      self.logger.info('[Light - {0}] Following simulator...'.format(
+          self.name))
+      for effect in self._effects:
+        effect.stop()
+      # Stream from simulator is shared with other components on this machine.
+      if not self._sim:
+        self._sim = simproxy.SimProxyClient.instance(
+            self.settings.sim_proxy).subscribe(
+                set(x.data_type for x in self._mappings))
+      if not self._telemetry:
+        self._telemetry = light.TelemetryLightEffect(
+            dmx=self._dmx,
+            channels=self._CHANNELS,
+            source=self._sim,
+            mappings=self._mappings)
+      self._telemetry.start()
+      return
+
     for effect in self._effects:
       effect.on()
 
   def _stop(self):
+    if self._telemetry:
+      self._stop_telemetry()
+      for effect in self._effects:
+        effect.start()
+
     for effect in self._effects:
       effect.off()
+
+  def _stop_telemetry(self):
+    if self._telemetry:
+      self._telemetry.stop()
+      self._telemetry = None
+    if self._sim:
+      self._sim.close()
+      self._sim = None
+
+  def _create_mapping(self, config):
+    data_type = simproxy.get_data_type(config.data_type)
+    channels = list(config.channels)
+    effect = config.effect
+    if effect == controller_pb2.DMXLight.SimMapping.AMBIENT:
+      return light.AmbientMapping(data_type=data_type, channels=channels)
+    elif effect == controller_pb2.DMXLight.SimMapping.FLASH:
+      return light.FlashMapping(
+          data_type=data_type,
+          channels=channels,
+          hue=config.hue,
+          saturation=config.saturation,
+          period=config.period if config.period else 1.0,
+          duty=config.duty if config.duty else 0.1)
+    elif effect == controller_pb2.DMXLight.SimMapping.STEADY:
+      return light.SteadyMapping(
+          data_type=data_type,
+          channels=channels,
+          hue=config.hue,
+          saturation=config.saturation)
+    else:
+      return light.LevelMapping(
+          data_type=data_type,
+          channels=channels,
+          hue=config.hue,
+          saturation=config.saturation,
+          min_value=config.min_value,
+          max_value=config.max_value)
@@ -17,6 +17,7 @@ import win32con
 import subprocess
 import threading
 
+from components import app
 from components import base
 from protos import controller_pb2
 from utils import windows
@@ -47,6 +48,7 @@ class WindowsAppComponent(base.Component):
           controller_pb2.WindowsApp.UNKNOWN: controller_pb2.Component.UNKNOWN,
           controller_pb2.WindowsApp.RUNNING: controller_pb2.Component.ON,
           controller_pb2.WindowsApp.NOT_RUNNING: controller_pb2.Component.OFF,
+          controller_pb2.WindowsApp.CRASH_LOOP: controller_pb2.Component.FAILED,
       }
     else:
       self._status_mapping = {
@@ -56,6 +58,8 @@ class WindowsAppComponent(base.Component):
           controller_pb2.Component.NOT_APPLICABLE,
           controller_pb2.WindowsApp.NOT_RUNNING:
           controller_pb2.Component.NOT_APPLICABLE,
+          controller_pb2.WindowsApp.CRASH_LOOP:
+          controller_pb2.Component.NOT_APPLICABLE,
       }
 
     self._app = windows.WindowsApplication(
@@ -67,9 +71,12 @@ class WindowsAppComponent(base.Component):
         restart_on_crash=(self.settings.restart_on_crash
                           if self.settings.restart_on_crash else False),
         start_minimized=(self.settings.start_minimized
-                         if self.settings.start_minimized else False))
+                         if self.settings.start_minimized else False),
+        output=app.get_output_capture(self.name, self.settings.output),
+        **app.get_restart_options(self.settings.restart_policy))
     self._app.on('started', self._on_app_started)
     self._app.on('stopped', self._on_app_stopped)
+    self._app.on('crash_loop', self._on_app_crash_loop)
 
     self._windows = []
     for window_config in self.settings.windows:
@@ -88,23 +95,45 @@ class WindowsAppComponent(base.Component):
     if self.settings.run_option == controller_pb2.WindowsApp.RUN_ALWAYS:
       self._start_app()
 
+  @property
+  def application(self):
+    """Gets underlaying application.
+
+    Returns:
+      utils.windows.WindowsApplication.
+    """
+    return self._app
+
   def close(self):
     if self._monitor:
       self._monitor.cancel()
       self._monitor = None
     self._stop_app()
+    if self._app.output:
+      self._app.output.close()
 
     super(WindowsAppComponent, self).close()
 
+  def update_resource_usage(self, summary):
+    """Updates resource usage and other statistics of the app.
+
+    Args:
+      summary: dictionary from utils.process.ResourceSampler.get_summary().
+    """
+    app.update_stats(self.settings.stats, self._app)
+    app.update_usage(self.settings.stats.resource_usage, summary)
+
   def _check_status(self):
-    if self._app.has_running_instance():
+    if self._app.in_crash_loop:
+      new_status = controller_pb2.WindowsApp.CRASH_LOOP
+    elif self._app.has_running_instance():
       new_status = controller_pb2.WindowsApp.RUNNING
     else:
       new_status = controller_pb2.WindowsApp.NOT_RUNNING
     if self.settings.status != new_status:
       self.settings.status = new_status
       self.proto.status = self._status_mapping[new_status]
-      self.emit('status_changed', self)
+      self._emit_status_changed()
 
   def _start(self):
     if self.settings.run_option == controller_pb2.WindowsApp.RUN_WHEN_OFF:
@@ -172,13 +201,24 @@ class WindowsAppComponent(base.Component):
           width=config.width,
           height=config.height)
 
-  def _on_app_started(self, app):
+  def _on_app_started(self, application):
     self.settings.status = controller_pb2.WindowsApp.RUNNING
     self.proto.status = self._status_mapping[controller_pb2.WindowsApp.RUNNING]
-    self.emit('status_changed', self)
+    self._emit_status_changed()
 
-  def _on_app_stopped(self, app):
+  def _on_app_stopped(self, application):
     self.settings.status = controller_pb2.WindowsApp.NOT_RUNNING
     self.proto.status = self._status_mapping[
         controller_pb2.WindowsApp.NOT_RUNNING]
+    self._emit_status_changed()
+
+  def _on_app_crash_loop(self, application):
+    self.logger.error('[App - {0}] Crash loop detected.'.format(self.name))
+    self.settings.status = controller_pb2.WindowsApp.CRASH_LOOP
+    self.proto.status = self._status_mapping[
+        controller_pb2.WindowsApp.CRASH_LOOP]
+    self._emit_status_changed()
+
+  def _emit_status_changed(self):
+    app.update_stats(self.settings.stats, self._app)
     self.emit('status_changed', self)
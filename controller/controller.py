@@ -31,23 +31,38 @@ class ControlService(controller_pb2_grpc.ControlServiceServicer,
     "status_changed": when status of any component from any machine is changed.
   """
 
-  def __init__(self, server, system_config, *args, **kwargs):
+  _QUEUE_SIZE = 100
+
+  def __init__(self,
+               server,
+               system_config,
+               broadcaster=None,
+               config_lock=None,
+               *args,
+               **kwargs):
     """Creates a ControlService instance.
 
     Args:
       server: gRPC server.
       system_config: configuration protobuf for the entire system.
+      broadcaster: services.broadcast.Broadcaster to display content on clients.
+      config_lock: lock guarding changes to system_config, shared with
+                   common.config.ConfigLoader reloading it.
       *args: additional unnamed arguments.
       **kwargs: additional named arguments.
     """
     super(ControlService, self).__init__(*args, **kwargs)
     self._system_config = system_config
+    self._config_lock = config_lock or threading.RLock()
+    self._broadcaster = broadcaster
     self._stopped = False
     controller_pb2_grpc.add_ControlServiceServicer_to_server(self, server)
 
     self._command = None
     self._command_changed_events = []
-    self._notification_queues = []
+    self._notification_queues = []  # for status
+    self._config_queues = []
+    self._machine_config_queues = {}  # machine name => list of queues
 
   def send_command(self, command):
     """Sends command to all clients.
@@ -59,6 +74,18 @@ class ControlService(controller_pb2_grpc.ControlServiceServicer,
     for event in self._command_changed_events:
       event.set()
 
+  def update_config(self, machine_names):
+    """Notifies clients of configuration change.
+
+    Args:
+      machine_names: names of machines whose configuration is changed.
+    """
+    for queue in self._config_queues:
+      self._notify(queue, None)
+    for name in machine_names:
+      for queue in self._machine_config_queues.get(name, []):
+        self._notify(queue, name)
+
   def stop(self):
     """Stops the service and all on-going streaming calls."""
     self._stopped = True
@@ -75,22 +102,97 @@ class ControlService(controller_pb2_grpc.ControlServiceServicer,
     Returns:
       flightlab.System protobuf.
     """
-    return self._system_config
+    return self._copy_config(self._system_config)
 
   def WatchConfig(self, _, context):
+    """Handler for WatchConfig gRPC call.
+
+    This handler streams the entire system configuration whenever it changes.
+
+    Args:
+      context: gRPC context.
+    Yields:
+      flightlab.System protobuf.
+    """
     self.logger.info('New client starts to watch config...')
-    queue = Queue.Queue(maxsize=100)
-    self._notification_queues.append(queue)
+    queue = Queue.Queue(maxsize=self._QUEUE_SIZE)
+    self._config_queues.append(queue)
     try:
       while not self._stopped:
         try:
           queue.get(block=True, timeout=1)
           self.logger.info('Notifying client config change...')
-          yield self._system_config
+          yield self._copy_config(self._system_config)
         except Queue.Empty:
           pass
     finally:
-      self._notification_queues.remove(queue)
+      self._config_queues.remove(queue)
+
+  def WatchMachineConfig(self, machine_id, context):
+    """Handler for WatchMachineConfig gRPC call.
+
+    This handler streams configuration of a client machine, first the current
+    one and then whenever it changes.
+
+    Args:
+      machine_id: a flightlab.MachineId protobuf identifying the client.
+      context: gRPC context.
+    Yields:
+      flightlab.Machine protobuf.
+    """
+    queue = Queue.Queue(maxsize=self._QUEUE_SIZE)
+    queues = self._machine_config_queues.setdefault(machine_id.name, [])
+    queues.append(queue)
+    self._notify(queue, machine_id.name)
+    try:
+      while not self._stopped:
+        try:
+          queue.get(block=True, timeout=1)
+          with self._config_lock:
+            machine = next((self._copy_config(x)
+                            for x in self._system_config.machines
+                            if x.name == machine_id.name), None)
+          if machine:
+            self.logger.info('Sending config to "{0}"...'.format(
+                machine_id.name))
+            yield machine
+        except Queue.Empty:
+          pass
+    finally:
+      queues.remove(queue)
+
+  def _copy_config(self, message):
+    # Serialized after returning, so a copy is taken while nothing changes it.
+    with self._config_lock:
+      copy = type(message)()
+      copy.CopyFrom(message)
+      return copy
+
+  def _notify(self, queue, item):
+    try:
+      queue.put(item, block=False)
+    except Queue.Full:
+      pass
+
+  def BroadcastDisplay(self, request, context):
+    """Handler for BroadcastDisplay gRPC call.
+
+    Args:
+      request: flightlab.BroadcastRequest protobuf.
+      context: gRPC context.
+    Returns:
+      flightlab.BroadcastResponse protobuf.
+    """
+    if not self._broadcaster:
+      context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+      context.set_details('Broadcast is not available.')
+      return controller_pb2.BroadcastResponse()
+    try:
+      return self._broadcaster.broadcast(request)
+    except ValueError as e:
+      context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+      context.set_details(str(e))
+      return controller_pb2.BroadcastResponse()
 
   def UpdateStatus(self, machine_status, context):
     """Handler for UpdateStatus gRPC call.
@@ -104,11 +206,32 @@ class ControlService(controller_pb2_grpc.ControlServiceServicer,
     Returns:
       google.protobuf.Empty.
     """
+    with self._config_lock:
+      if not self._update_status(machine_status):
+        return
+
+    for queue in self._notification_queues:
+      self.logger.info('Notifying clients watching for status...')
+      try:
+        queue.put(machine_status, block=False)
+      except Queue.Full:
+        pass
+
+    self.emit('status_changed')
+
+    return empty_pb2.Empty()
+
+  def _update_status(self, machine_status):
+    """Updates status of components in system configuration. Lock must be held.
+
+    Returns:
+      True if the machine is found.
+    """
     machine = next((x for x in self._system_config.machines
                     if x.name == machine_status.name), None)
     if not machine:
       self.logger.warn('Machine %s not found.', machine_status.name)
-      return
+      return False
 
     for component_status in machine_status.component_status:
       component = next((x for x in machine.components
@@ -126,18 +249,14 @@ class ControlService(controller_pb2_grpc.ControlServiceServicer,
       kind = component.WhichOneof('kind')
       settings = getattr(component, kind)
       settings.status = status
+      if component_status.HasField('app_stats'):
+        settings.stats.CopyFrom(component_status.app_stats)
+      if component_status.HasField('commandline_run'):
+        settings.last_run.CopyFrom(component_status.commandline_run)
+      if component_status.HasField('badger_stats'):
+        settings.stats.CopyFrom(component_status.badger_stats)
       component.status = component_status.status
-
-    for queue in self._notification_queues:
-      self.logger.info('Notifying clients watching for status...')
-      try:
-        queue.put(machine_status, block=False)
-      except Queue.Full:
-        pass
-
-    self.emit('status_changed')
-
-    return empty_pb2.Empty()
+    return True
 
   def WatchStatus(self, _, context):
     """Handler for WatchStatus gRPC call.
@@ -150,7 +269,7 @@ class ControlService(controller_pb2_grpc.ControlServiceServicer,
       flightlab.MachineStatus.
     """
     self.logger.info('New client starts to watch status...')
-    queue = Queue.Queue(maxsize=100)
+    queue = Queue.Queue(maxsize=self._QUEUE_SIZE)
     self._notification_queues.append(queue)
     try:
       while not self._stopped:
@@ -195,12 +314,17 @@ class ControlService(controller_pb2_grpc.ControlServiceServicer,
 class ControlClient(pattern.Logger):
   """Wrapper for client to use flightlab.ControlService.
 
-  This wrapper listens to commands from server and passes to a callback.
-  It also updates component status to server.
+  This wrapper listens to commands and configuration from server and passes to
+  callbacks. It also updates component status to server.
   """
   _GRPC_RECONNECT_INTERVAL = 5  # sec
 
-  def __init__(self, machine_config, grpc_channel, command_callback, *args,
+  def __init__(self,
+               machine_config,
+               grpc_channel,
+               command_callback,
+               config_callback=None,
+               *args,
                **kwargs):
     """Creates ControlClient instance.
 
@@ -208,15 +332,19 @@ class ControlClient(pattern.Logger):
       machine_config: configuration protobuf for current machine.
       grpc_channel: a channel for gRPC connection.
       command_callback: a function to callback when command is received.
+      config_callback: a function to callback with flightlab.Machine protobuf
+                       when configuration of current machine is received.
       *args: additional unnamed arguments.
       **kwargs: additional named arguments.
     """
     super(ControlClient, self).__init__(*args, **kwargs)
     self._machine_config = machine_config
     self._command_callback = command_callback
+    self._config_callback = config_callback
     self._grpc_channel = grpc_channel
     self._stub = controller_pb2_grpc.ControlServiceStub(self._grpc_channel)
     self._thread = None
+    self._config_response = None
     self._stopped = False
 
   def start(self):
@@ -238,6 +366,8 @@ class ControlClient(pattern.Logger):
       return
 
     self._stopped = True
+    if self._config_response:
+      self._config_response.cancel()
     self._grpc_channel.close()
     self._thread.join()
     self._thread = None
@@ -255,10 +385,17 @@ class ControlClient(pattern.Logger):
       component_status.projector_status = component_proto.projector.status
     elif kind == 'app':
       component_status.app_status = component_proto.app.status
+      component_status.app_stats.CopyFrom(component_proto.app.stats)
     elif kind == 'windows_app':
       component_status.windows_app_status = component_proto.windows_app.status
+      component_status.app_stats.CopyFrom(component_proto.windows_app.stats)
     elif kind == 'badger':
       component_status.badger_status = component_proto.badger.status
+      component_status.badger_stats.CopyFrom(component_proto.badger.stats)
+    elif kind == 'commandline':
+      component_status.commandline_status = component_proto.commandline.status
+      component_status.commandline_run.CopyFrom(
+          component_proto.commandline.last_run)
     else:
       self.logger.warn('%s is not a supported component status', kind)
 
@@ -283,10 +420,12 @@ class ControlClient(pattern.Logger):
         component_status = machine_status.component_status.add(
             name=component.name, status=component.status)
         component_status.app_status = component.app.status
+        component_status.app_stats.CopyFrom(component.app.stats)
       elif kind == 'windows_app':
         component_status = machine_status.component_status.add(
             name=component.name, status=component.status)
         component_status.windows_app_status = component.windows_app.status
+        component_status.app_stats.CopyFrom(component.windows_app.stats)
 
     try:
       self._stub.UpdateStatus(machine_status)
@@ -308,18 +447,39 @@ class ControlClient(pattern.Logger):
       if not self._stopped:
         self._restart()
 
+  def _watch_config(self, response):
+    """Listens to configuration from server and passes to callback.
+
+    Args:
+      response: an iterable containing flightlab.Machine.
+    """
+    try:
+      for machine in response:
+        self._config_callback(machine)
+    except grpc.RpcError:
+      pass  # Reconnected along with command stream.
+
   def _restart(self):
     """Attempt to reconnect to server and retry after an interval if fails."""
     self._thread = None
     try:
-      response = self._stub.WatchCommand(
-          controller_pb2.MachineId(name=self._machine_config.name))
+      machine_id = controller_pb2.MachineId(name=self._machine_config.name)
+      response = self._stub.WatchCommand(machine_id)
       self._thread = threading.Thread(
           target=self._watch, kwargs={
               'response': response
           })
       self._thread.start()
 
+      if self._config_callback:
+        if self._config_response:
+          self._config_response.cancel()
+        self._config_response = self._stub.WatchMachineConfig(machine_id)
+        pattern.run_as_thread(
+            name='ControlClient.watch_config',
+            target=self._watch_config,
+            kwargs={'response': self._config_response})
+
       self.update_all_status()
     except grpc.RpcError:
       if not self._stopped:
@@ -13,33 +13,43 @@
 # limitations under the License.
 """Controller server and client app."""
 
+import functools
 import gflags
 import logging
+import os
 import sys
 import threading
-import api
-import cherrypy
+import time
 
+from common import config
+from common import executor
+from common import fswatch
 from common import pattern
 from common import net
 from components import factory
+from components import graph
 from concurrent import futures
 import controller
-import flask
-import flask_cors
 import grpc
 from protos import controller_pb2
 from services import client
+from utils import process
 from google.apputils import appcommands
-from google.protobuf import text_format
 
 FLAGS = gflags.FLAGS
 
 _CONTROL_SERVICE_GRPC_PORT = 9000
 _CLIENT_SERVICE_GRPC_PORT = 9001
+_RESOURCE_SAMPLE_INTERVAL = 10  # sec
+_RESOURCE_SAMPLE_SIZE = 30
+_COMMAND_WORKERS = 8
+_COMPONENT_INIT_TIMEOUT = 30  # sec
+_CONFIG_RELOAD_DELAY = 0.5  # sec
 
 gflags.DEFINE_string('config', 'config.protoascii',
                      'Path to system configuration file.')
+gflags.DEFINE_string('image_dir', 'data',
+                     'Directory of images allowed to be broadcast.')
 
 
 class ControllerApp(pattern.Logger, appcommands.Cmd):
@@ -55,11 +65,8 @@ class ControllerApp(pattern.Logger, appcommands.Cmd):
     self._stop_event = threading.Event()
     self._machine_config = None
     self._master_machine_config = None
-
-    self._system_config = controller_pb2.System()
-    with open(FLAGS.config, 'r') as f:
-      config_text = f.read()
-      text_format.Merge(config_text, self._system_config)
+    self._config = config.ConfigLoader(FLAGS.config)
+    self._system_config = self._config.load()
 
   @property
   def factory(self):
@@ -85,9 +92,7 @@ class ControllerApp(pattern.Logger, appcommands.Cmd):
       Exception: if configuration for current machine doesn't exist.
     """
     if not self._machine_config:
-      ip = net.get_ip()
-      self._machine_config = next(
-          (x for x in self.system_config.machines if x.ip == ip), None)
+      self._machine_config = self._config.get_machine_by_ip(net.get_ip())
       if not self._machine_config:
         raise Exception('No config found for this machine.')
     return self._machine_config
@@ -102,9 +107,8 @@ class ControllerApp(pattern.Logger, appcommands.Cmd):
       Exception: if configuration for master machine doesn't exist.
     """
     if not self._master_machine_config:
-      self._master_machine_config = next(
-          (x for x in self.system_config.machines
-           if x.name == self.system_config.master_machine_name))
+      self._master_machine_config = self._config.get_machine_by_name(
+          self.system_config.master_machine_name)
       if not self._master_machine_config:
         raise Exception('Master machine config not found.')
     return self._master_machine_config
@@ -149,22 +153,46 @@ class ControllerServerApp(ControllerApp):
     super(ControllerServerApp, self).__init__(*args, **kwargs)
     self._grpc_server = None
     self._control_service = None
+    self._broadcaster = None
     self._web = None
     self._api_service = None
+    self._config_watcher = None
+    self._reload_timer = None
 
   def close(self):
+    import cherrypy
+
+    self._config_watcher.stop()
+    if self._reload_timer:
+      self._reload_timer.cancel()
     self._server.stop(None)
     self._control_service.stop()
+    if self._broadcaster:
+      self._broadcaster.close()
     cherrypy.engine.exit()
     super(ControllerServerApp, self).close()
 
   def _initialize(self):
+    # Web server modules are only needed on master machine.
+    import api
+    import cherrypy
+    import flask
+    import flask_cors
+    from services import broadcast
+
     super(ControllerServerApp, self)._initialize()
 
     # Start control service
     self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=50))
+    self._broadcaster = broadcast.Broadcaster(
+        system_config=self.system_config,
+        port=_CLIENT_SERVICE_GRPC_PORT,
+        image_dir=FLAGS.image_dir)
     self._control_service = controller.ControlService(
-        server=self._server, system_config=self.system_config)
+        server=self._server,
+        system_config=self.system_config,
+        broadcaster=self._broadcaster,
+        config_lock=self._config.lock)
     self._control_service.on('status_changed', self._on_status_changed)
     self._server.add_insecure_port(
         '[::]:{0}'.format(_CONTROL_SERVICE_GRPC_PORT))
@@ -176,7 +204,8 @@ class ControllerServerApp(ControllerApp):
     self._api_service = api.ApiService(
         web=self._web,
         system_config=self.system_config,
-        control_service=self._control_service)
+        control_service=self._control_service,
+        broadcaster=self._broadcaster)
     cherrypy.tree.graft(self._web, '/')
     cherrypy.server.socket_host = '0.0.0.0'
     cherrypy.config.update({
@@ -186,19 +215,55 @@ class ControllerServerApp(ControllerApp):
     })
     cherrypy.engine.start()
 
+    # Watch configuration file. Editors may replace the file instead of writing
+    # to it, so the directory is watched.
+    path = os.path.abspath(FLAGS.config)
+    self._config_watcher = fswatch.DirectoryWatcher(
+        os.path.dirname(path), names=[os.path.basename(path)])
+    self._config_watcher.on('created', self._on_config_file_changed)
+    self._config_watcher.on('modified', self._on_config_file_changed)
+    self._config_watcher.start()
+
+  def _on_config_file_changed(self, path):
+    # A file may be written in several steps, so reload after it settles.
+    if self._reload_timer:
+      self._reload_timer.cancel()
+    self._reload_timer = threading.Timer(_CONFIG_RELOAD_DELAY,
+                                         self._reload_config)
+    self._reload_timer.daemon = True
+    self._reload_timer.start()
+
+  def _reload_config(self):
+    start_time = time.time()
+    try:
+      machine_names = self._config.reload()
+    except Exception as e:
+      self.logger.error('Failed to reload config. Keeping current one.\n'
+                        '{0}'.format(e))
+      return
+    self._machine_config = None
+    self._master_machine_config = None
+    self._control_service.update_config(machine_names)
+    self._on_status_changed()
+    self.logger.info('Reloaded config in {0:.3f} seconds. Machines changed: '
+                     '{1}'.format(time.time() - start_time,
+                                  ', '.join(machine_names) or 'none'))
+
   def _on_status_changed(self):
     counter = {
         controller_pb2.Component.UNKNOWN: 0,
         controller_pb2.Component.OFF: 0,
         controller_pb2.Component.TRANSIENT: 0,
         controller_pb2.Component.ON: 0,
+        controller_pb2.Component.FAILED: 0,
     }
     for machine in self.system_config.machines:
       for component in machine.components:
         if component.status != controller_pb2.Component.NOT_APPLICABLE:
           counter[component.status] += 1
 
-    if counter[controller_pb2.Component.UNKNOWN] > 0:
+    if (counter[controller_pb2.Component.UNKNOWN] > 0 or
+        counter[controller_pb2.Component.FAILED] > 0):
       self.system_config.state = controller_pb2.System.UNKNOWN
     elif counter[controller_pb2.Component.TRANSIENT] > 0:
       self.system_config.state = controller_pb2.System.TRANSIENT
@@ -223,14 +288,30 @@ class ControllerClientApp(ControllerApp):
     super(ControllerClientApp, self).__init__(*args, **kwargs)
     self._control_client = None
     self._components = []
+    self._components_lock = threading.Lock()
+    self._graph = None
+    self._last_command = None
+    self._startup_times = {}  # component name => seconds taken to create
+    self._closing = False
+    self._components_ready = threading.Event()
+    self._reload_lock = threading.Lock()
+    self._sampler = process.ResourceSampler(
+        interval=_RESOURCE_SAMPLE_INTERVAL, size=_RESOURCE_SAMPLE_SIZE)
+    self._sampler.on('sampled', self._on_resources_sampled)
+    self._executor = executor.KeyedExecutor(max_workers=_COMMAND_WORKERS)
 
   def close(self):
     self.logger.info('Closing app...')
+    self._closing = True
 
     self._server.stop(None)
     self._client_service.close()
 
     self._control_client.stop()
+    self._sampler.stop()
+    if self._graph:
+      self._graph.close()
+    self._executor.close()
 
     for component in self._components:
       if isinstance(component, pattern.Closable):
@@ -245,16 +326,208 @@ class ControllerClientApp(ControllerApp):
     self._initialize_components()
 
   def _initialize_components(self):
-    for component_config in self.machine_config.components:
-      component = self.factory.create_component(component_config)
-      component.on('status_changed', self._on_component_status_changed)
+    start_time = time.time()
+    configs = list(self.machine_config.components)
+    self._add_components(configs)
+    self.logger.info('Created {0} of {1} components in {2:.2f} seconds.'.format(
+        len(self._components), len(configs), time.time() - start_time))
+    self._update_graph()
+    self._sampler.start()
+    self._components_ready.set()
+
+  def _add_components(self, configs):
+    """Creates and adds components.
+
+    Constructors may block on devices, so components are created in parallel
+    and those not created in time are adopted whenever they are ready. They are
+    created on daemon threads, so a constructor that never returns doesn't
+    block exit.
+
+    Args:
+      configs: list of flightlab.Component protobufs.
+    Returns:
+      List of components created in time.
+    """
+    creations = [(self._create_component_async(x), x) for x in configs]
+    futures.wait([x for x, _ in creations], timeout=_COMPONENT_INIT_TIMEOUT)
+
+    created = []
+    for future, component_config in creations:
+      if future.done():
+        component = self._on_component_created(future, component_config)
+        if component:
+          created.append(component)
+      else:
+        self.logger.error(
+            '[{0}] Not created in {1} seconds. It will be added once '
+            'created.'.format(component_config.name, _COMPONENT_INIT_TIMEOUT))
+        component_config.status = controller_pb2.Component.UNKNOWN
+        self._control_client.update_status(component_config)
+        future.add_done_callback(
+            functools.partial(
+                self._on_component_created_late,
+                component_config=component_config))
+    return created
+
+  def _update_graph(self):
+    """Updates component graph with current components.
+
+    The graph is updated in place, so a command running through it goes on.
+
+    Returns:
+      List of components added that joined the running command.
+    """
+    with self._components_lock:
+      if not self._graph:
+        self._graph = graph.ComponentGraph(self._components, self._executor)
+        return []
+      return self._graph.update(self._components)
+
+  def _create_component_async(self, component_config):
+    """Creates a component on a daemon thread.
+
+    Returns:
+      concurrent.futures.Future of (component, seconds taken).
+    """
+    future = futures.Future()
+
+    def create():
+      if not future.set_running_or_notify_cancel():
+        return
+      try:
+        future.set_result(self._create_component(component_config))
+      except Exception as e:
+        future.set_exception(e)
+
+    thread = threading.Thread(
+        target=create, name='Create {0}'.format(component_config.name))
+    thread.daemon = True
+    thread.start()
+    return future
+
+  def _create_component(self, component_config):
+    start_time = time.time()
+    component = self.factory.create_component(component_config)
+    return component, time.time() - start_time
+
+  def _on_component_created(self, future, component_config):
+    """Adds a created component.
+
+    Returns:
+      The component added, or None if it failed to be created.
+    """
+    if future.exception():
+      self.logger.error('[{0}] Failed to create: {1}'.format(
+          component_config.name, future.exception()))
+      component_config.status = controller_pb2.Component.FAILED
+      self._control_client.update_status(component_config)
+      return None
+
+    component, duration = future.result()
+    self.logger.info('[{0}] Created in {1:.2f} seconds.'.format(
+        component.name, duration))
+    component.on('status_changed', self._on_component_status_changed)
+    with self._components_lock:
+      self._startup_times[component.name] = duration
       self._components.append(component)
+    if hasattr(component, 'application'):
+      self._sampler.watch(component.name, component.application)
+    return component
+
+  def _on_component_created_late(self, future, component_config):
+    if self._closing:
+      if not future.exception():
+        future.result()[0].close()
+      return
+    component = self._on_component_created(future, component_config)
+    if not component:
+      return
+
+    joined = self._update_graph()
+    self._control_client.update_status(component.proto)
+    if component not in joined:
+      self._catch_up(component)
+
+  def _catch_up(self, component):
+    """Runs the latest command that a new component missed."""
+    if self._last_command is not None:
+      self._executor.submit(
+          key=component.name,
+          name=controller_pb2.SystemCommand.Command.Name(self._last_command),
+          target=component.on_command,
+          kwargs={'command': self._last_command})
+
+  def _on_machine_config(self, machine):
+    self._components_ready.wait()
+    with self._reload_lock:
+      start_time = time.time()
+      self._check_machine_fields(machine)
+      added, removed, changed = config.diff(self.machine_config.components,
+                                            machine.components)
+      if not (added or removed or changed):
+        return
+      self.logger.info('Reloading config (added: {0}, removed: {1}, changed: '
+                       '{2})...'.format(added, removed, changed))
+
+      # Components whose configuration is unchanged keep running.
+      touched = set(removed + changed)
+      with self._components_lock:
+        stale = [x for x in self._components if x.name in touched]
+        self._components = [
+            x for x in self._components if x.name not in touched
+        ]
+      for component in stale:
+        self._sampler.unwatch(component.name)
+        if isinstance(component, pattern.Closable):
+          component.close()
+
+      # Configuration is updated in place, as components hold their protobufs.
+      components = self.machine_config.components
+      for name in removed:
+        del components[[x.name for x in components].index(name)]
+      new_configs = dict((x.name, x) for x in machine.components)
+      configs = []
+      for component_config in components:
+        if component_config.name in changed:
+          component_config.CopyFrom(new_configs[component_config.name])
+          configs.append(component_config)
+      for name in added:
+        component_config = components.add()
+        component_config.CopyFrom(new_configs[name])
+        configs.append(component_config)
+
+      created = self._add_components(configs)
+      joined = self._update_graph()
+      for component in created:
+        if component not in joined:
+          self._catch_up(component)
+      self._control_client.update_all_status()
+      self.logger.info(
+          'Reloaded config in {0:.2f} seconds. {1} component(s) touched, {2} '
+          'untouched.'.format(time.time() - start_time,
+                              len(added) + len(removed) + len(changed),
+                              len(components) - len(added) - len(changed)))
+
+  def _check_machine_fields(self, machine):
+    """Logs changes of machine-level fields, which are not reloaded."""
+    old = config.strip_runtime_fields(self.machine_config)
+    new = config.strip_runtime_fields(machine)
+    del old.components[:]
+    del new.components[:]
+    fields = set(x.name for x, _ in old.ListFields())
+    fields.update(x.name for x, _ in new.ListFields())
+    changed = sorted(x for x in fields if getattr(old, x) != getattr(new, x))
+    if changed:
+      self.logger.warn('Changes of machine fields ({0}) take effect after '
+                       'restart.'.format(', '.join(changed)))
 
   def _initialize_client(self):
     # Start remote service
     self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
     self._client_service = client.ClientService(
-        server=self._server, machine_config=self.machine_config)
+        server=self._server,
+        machine_config=self.machine_config,
+        output_provider=self._get_component_output)
     self._server.add_insecure_port(
         '[::]:{0}'.format(_CLIENT_SERVICE_GRPC_PORT))
     self._server.start()
@@ -266,7 +539,8 @@ class ControllerClientApp(ControllerApp):
     self._control_client = controller.ControlClient(
         machine_config=self.machine_config,
         grpc_channel=grpc_channel,
-        command_callback=self._on_command)
+        command_callback=self._on_command,
+        config_callback=self._on_machine_config)
     self._control_client.start()
 
   def _on_command(self, command):
@@ -279,17 +553,39 @@ class ControllerClientApp(ControllerApp):
           threading.active_count()))
       for thread in threading.enumerate():
         self.logger.debug('Thread (name="{0}")'.format(thread.name))
+      for name, duration in sorted(self._startup_times.items()):
+        self.logger.debug('Component (name="{0}") created in {1:.3f} '
+                          'seconds.'.format(name, duration))
+      for name, tasks in sorted(self._executor.get_metrics().items()):
+        for task, metrics in sorted(tasks.items()):
+          self.logger.debug('Component (name="{0}", command={1}): {2}'.format(
+              name, task, ', '.join('{0}={1:.3f}'.format(k, v)
+                                    for k, v in sorted(metrics.items()))))
       return
 
+    # Components run in dependency order, and commands of the same component
+    # run in order without overlapping.
+    self._last_command = command
+    with self._components_lock:
+      component_graph = self._graph
+    if component_graph:
+      component_graph.run(command)
+
+  def _get_component_output(self, name):
     for component in self._components:
-      pattern.run_as_thread(
-          name='{0}.on_command({1})'.format(component.name, command),
-          target=component.on_command,
-          kwargs={'command': command})
+      if component.name == name and hasattr(component, 'application'):
+        return component.application.output
+    return None
 
   def _on_component_status_changed(self, component):
     self._control_client.update_status(component.proto)
 
+  def _on_resources_sampled(self, sampler):
+    for component in self._components:
+      if hasattr(component, 'update_resource_usage'):
+        component.update_resource_usage(sampler.get_summary(component.name))
+    self._control_client.update_all_status()
+
 
 def init_log():
   """Initializes logging settings."""
@@ -0,0 +1,182 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Broadcasts display content from master to client machines."""
+
+import grpc
+import os
+import threading
+import time
+
+from concurrent import futures
+from google.protobuf import empty_pb2
+
+from common import pattern
+from protos import client_pb2
+from protos import client_pb2_grpc
+from protos import controller_pb2
+from services import client
+
+
+class Broadcaster(pattern.Closable, pattern.Logger):
+  """Calls flightlab.ClientService of many client machines at once.
+
+  Calls to all targeted machines are made concurrently, each with a deadline,
+  so a slow or offline machine doesn't hold up the others. Channels to client
+  machines are kept open and reused across broadcasts.
+  """
+
+  _DEFAULT_TIMEOUT = 5  # sec
+
+  def __init__(self,
+               system_config,
+               port,
+               image_dir,
+               max_workers=16,
+               *args,
+               **kwargs):
+    """Creates Broadcaster instance.
+
+    Args:
+      system_config: configuration protobuf for the entire system.
+      port: gRPC port of flightlab.ClientService on client machines.
+      image_dir: directory of images allowed to be broadcast. Relative image
+                 paths are relative to it.
+      max_workers: maximum number of calls in parallel.
+    """
+    super(Broadcaster, self).__init__(*args, **kwargs)
+    self._system_config = system_config
+    self._port = port
+    self._image_dir = os.path.realpath(image_dir)
+    self._lock = threading.Lock()
+    self._channels = {}  # target => (channel, stub)
+    self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+
+  def close(self):
+    """Closes all channels to client machines."""
+    self._executor.shutdown(wait=False)
+    with self._lock:
+      for channel, _ in self._channels.values():
+        channel.close()
+      self._channels.clear()
+
+  def broadcast(self, request):
+    """Displays content on targeted client machines.
+
+    Args:
+      request: flightlab.BroadcastRequest protobuf.
+    Returns:
+      flightlab.BroadcastResponse protobuf with a result per targeted machine.
+    Raises:
+      ValueError: if request has no content, an image outside image directory
+                  or an invalid timeout.
+    """
+    if not request.WhichOneof('content'):
+      raise ValueError('Content to display is not given.')
+    if not 0 <= request.timeout < float('inf'):  # also rejects NaN
+      raise ValueError('Invalid timeout {0}.'.format(request.timeout))
+    start_time = time.time()
+    timeout = request.timeout or self._DEFAULT_TIMEOUT
+    response = controller_pb2.BroadcastResponse()
+    try:
+      call = self._get_call(request)
+    except (IOError, OSError) as e:
+      for machine in self._get_machines(request):
+        response.results.add(
+            machine_name=machine.name, succeed=False, error_message=str(e))
+      return response
+
+    calls = []
+    for machine in self._get_machines(request):
+      result = response.results.add(machine_name=machine.name)
+      if not machine.ip:
+        result.error_message = 'Machine has no IP.'
+        continue
+      stub = self._get_stub(machine.ip)
+      calls.append((result,
+                    self._executor.submit(self._call, call, stub, timeout)))
+
+    # Each call has its own deadline. Pushing an image takes up to 3 calls, and
+    # calls may be queued if there are more machines than workers.
+    futures.wait([x[1] for x in calls], timeout=timeout * 4)
+    for result, future in calls:
+      if not future.done():
+        result.error_message = 'Call was not made in time.'
+        continue
+      try:
+        succeed, error_message, latency = future.result()
+      except Exception as e:
+        self.logger.error('Broadcast to {0} failed: {1}'.format(
+            result.machine_name, e))
+        result.error_message = str(e)
+        continue
+      result.succeed = succeed
+      result.error_message = error_message
+      result.latency = latency
+    response.duration = time.time() - start_time
+    self.logger.info('Broadcast {0} to {1} machines in {2:.3f} seconds.'.format(
+        request.WhichOneof('content'), len(response.results),
+        response.duration))
+    return response
+
+  def _get_machines(self, request):
+    machines = []
+    names = set(request.machine_names)
+    for machine in self._system_config.machines:
+      if names and machine.name not in names:
+        continue
+      if request.group_name and machine.groupName != request.group_name:
+        continue
+      machines.append(machine)
+    return machines
+
+  def _get_call(self, request):
+    content = request.WhichOneof('content')
+    if content == 'message':
+      message = client_pb2.Message(message=request.message)
+      return lambda stub, timeout: stub.DisplayMessage(message, timeout=timeout)
+    if content == 'image_path':
+      # Image is read once and only uploaded to machines not having it cached.
+      with open(self._get_image_path(request.image_path), 'rb') as f:
+        data = f.read()
+      return lambda stub, timeout: client.push_image(stub, data, timeout)
+    if content == 'off':
+      return lambda stub, timeout: stub.DisplayOff(
+          empty_pb2.Empty(), timeout=timeout)
+    raise ValueError('Unknown content "{0}".'.format(content))
+
+  def _get_image_path(self, image_path):
+    # Symbolic links are resolved, so they can't point outside either.
+    path = os.path.realpath(os.path.join(self._image_dir, image_path))
+    if not path.startswith(os.path.join(self._image_dir, '')):
+      raise ValueError('Image "{0}" is not in {1}.'.format(
+          image_path, self._image_dir))
+    return path
+
+  def _get_stub(self, ip):
+    target = '{0}:{1}'.format(ip, self._port)
+    with self._lock:
+      if target not in self._channels:
+        channel = grpc.insecure_channel(target)
+        self._channels[target] = (channel,
+                                  client_pb2_grpc.ClientServiceStub(channel))
+      return self._channels[target][1]
+
+  def _call(self, call, stub, timeout):
+    start_time = time.time()
+    try:
+      response = call(stub, timeout)
+      succeed, error_message = response.succeed, response.error_message
+    except grpc.RpcError as e:
+      succeed, error_message = False, '{0}: {1}'.format(e.code(), e.details())
+    return succeed, error_message, time.time() - start_time
@@ -13,26 +13,76 @@
 # limitations under the License.
 """Service handler for controller client."""
 
+import grpc
+
 from common import pattern
 from protos import client_pb2
 from protos import client_pb2_grpc
 from utils import display
+from utils import image_cache
+
+_IMAGE_CHUNK_SIZE = 64 * 1024
+_MAX_IMAGE_SIZE = 32 * 1024 * 1024  # bytes of an uploaded image
+
+
+def push_image(stub, data, timeout=None):
+  """Displays an image on a client machine, uploading it only if not cached.
+
+  Args:
+    stub: flightlab.ClientService stub of the client machine.
+    data: content of the image file.
+    timeout: seconds to wait for each call.
+  Returns:
+    flightlab.GeneralResponse of displaying the image.
+  """
+  image_hash = image_cache.get_hash(data)
+  image = client_pb2.Image(image_hash=image_hash)
+  if not stub.HasImage(image, timeout=timeout).cached:
+    chunks = (client_pb2.ImageChunk(
+        image_hash=image_hash, data=data[i:i + _IMAGE_CHUNK_SIZE])
+              for i in range(0, len(data), _IMAGE_CHUNK_SIZE))
+    response = stub.UploadImage(chunks, timeout=timeout)
+    if not response.succeed:
+      return response
+  return stub.DisplayImage(image, timeout=timeout)
 
 
 class ClientService(client_pb2_grpc.ClientServiceServicer, pattern.Closable):
   """Provider for flightlab.ClientService."""
 
-  def __init__(self, server, machine_config, *args, **kwargs):
+  _TAIL_POLL_INTERVAL = 1  # seconds to check if a tail is cancelled.
+
+  def __init__(self,
+               server,
+               machine_config,
+               output_provider=None,
+               *args,
+               **kwargs):
     """Creates ClientService instance.
 
     Args:
       server: gRPC server.
       machine_config: Configuration protobuf of current machine.
+      output_provider: callable that takes a component name and returns its
+                       utils.output.OutputCapture, or None if not available.
     """
     super(ClientService, self).__init__(*args, **kwargs)
+    self._output_provider = output_provider
     client_pb2_grpc.add_ClientServiceServicer_to_server(self, server)
     self._display = display.Display(
         chrome_path=machine_config.chrome_executable_path)
+    for screen in machine_config.screens:
+      self._display.add_screen(
+          name=screen.name,
+          message=screen.message,
+          image_path=screen.image_path,
+          template_path=screen.template_path or None)
+    cache_config = machine_config.image_cache
+    self._image_cache = image_cache.ImageCache(
+        cache_dir=cache_config.cache_dir or None,
+        max_size=cache_config.max_size or 256 * 1024 * 1024,
+        max_width=cache_config.max_width,
+        max_height=cache_config.max_height)
 
   def close(self):
     """Stops client service."""
@@ -59,7 +109,73 @@ class ClientService(client_pb2_grpc.ClientServiceServicer, pattern.Closable):
     Returns:
       flightlab.GeneralResponse.
     """
-    self._display.show_image(image.image_path)
+    image_path = image.image_path
+    if not image_path:
+      image_path = self._image_cache.get_path(image.image_hash)
+      if not image_path:
+        return client_pb2.GeneralResponse(
+            succeed=False,
+            error_message='Image {0} is not cached.'.format(image.image_hash))
+    self._display.show_image(image_path)
+    return client_pb2.GeneralResponse(succeed=True)
+
+  def HasImage(self, image, context):
+    """Checks if an image is cached on client machine.
+
+    Args:
+      image: flightlab.Image protobuf with image_hash.
+      context: gRPC context.
+    Returns:
+      flightlab.ImageStatus.
+    """
+    return client_pb2.ImageStatus(
+        cached=self._image_cache.has(image.image_hash))
+
+  def UploadImage(self, chunks, context):
+    """Uploads an image into the cache of client machine.
+
+    Upload is aborted with INVALID_ARGUMENT once larger than 32 MB.
+
+    Args:
+      chunks: iterator of flightlab.ImageChunk protobuf.
+      context: gRPC context.
+    Returns:
+      flightlab.GeneralResponse.
+    """
+    image_hash = None
+    data = []
+    size = 0
+    for chunk in chunks:
+      image_hash = chunk.image_hash
+      data.append(chunk.data)
+      size += len(chunk.data)
+      if size > _MAX_IMAGE_SIZE:
+        message = 'Image is larger than {0} bytes.'.format(_MAX_IMAGE_SIZE)
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details(message)
+        return client_pb2.GeneralResponse(succeed=False, error_message=message)
+    if not image_hash:
+      return client_pb2.GeneralResponse(
+          succeed=False, error_message='No image uploaded.')
+    try:
+      self._image_cache.put(image_hash, b''.join(data))
+    except (ValueError, IOError, OSError) as e:
+      return client_pb2.GeneralResponse(succeed=False, error_message=str(e))
+    return client_pb2.GeneralResponse(succeed=True)
+
+  def DisplayScreen(self, screen, context):
+    """Displays a screen defined in machine configuration.
+
+    Args:
+      screen: flightlab.ScreenName protobuf.
+      context: gRPC context.
+    Returns:
+      flightlab.GeneralResponse.
+    """
+    if not self._display.show_screen(screen.name):
+      return client_pb2.GeneralResponse(
+          succeed=False,
+          error_message='Screen "{0}" is not defined.'.format(screen.name))
     return client_pb2.GeneralResponse(succeed=True)
 
   def DisplayOff(self, request, context):
@@ -71,5 +187,40 @@ class ClientService(client_pb2_grpc.ClientServiceServicer, pattern.Closable):
     Returns:
       flightlab.GeneralResponse.
     """
-    self._display.close()
+    self._display.turn_off()
     return client_pb2.GeneralResponse(succeed=True)
+
+  def TailOutput(self, request, context):
+    """Streams captured output of an app component.
+
+    Args:
+      request: flightlab.TailRequest protobuf.
+      context: gRPC context.
+    Yields:
+      flightlab.OutputChunk.
+    """
+    output = None
+    if self._output_provider:
+      output = self._output_provider(request.component_name)
+    if not output:
+      context.set_code(grpc.StatusCode.NOT_FOUND)
+      context.set_details('No output captured for component "{0}".'.format(
+          request.component_name))
+      return
+
+    offset = request.offset
+    if offset < 0:
+      offset = max(output.end_offset + offset, 0)
+    while context.is_active():
+      data, start, next_offset = output.read(offset)
+      if data:
+        yield client_pb2.OutputChunk(
+            data=data,
+            offset=start,
+            next_offset=next_offset,
+            truncated=start > offset)
+        offset = next_offset
+      elif not request.follow:
+        return
+      else:
+        output.wait(offset, self._TAIL_POLL_INTERVAL)
@@ -12,14 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Testcases for services.client.ClientService."""
+from __future__ import print_function
 
 import grpc
 import sys
+import time
 
 from google.protobuf import empty_pb2
 
 from protos import client_pb2
 from protos import client_pb2_grpc
+from services import client
 
 try:
   raw_input          # Python 2
@@ -39,11 +42,36 @@ def test_image_display(argv):
   target = argv[1]
   image_path = argv[2]
   grpc_channel = grpc.insecure_channel(target)
-  stub = client_pb2_grpc.RemoteServiceStub(grpc_channel)
+  stub = client_pb2_grpc.ClientServiceStub(grpc_channel)
   stub.DisplayImage(client_pb2.Image(image_path=image_path))
   raw_input('Press ENTER to continue.')
   stub.DisplayOff(empty_pb2.Empty())
 
 
+def test_image_upload(argv):
+  """Test uploading an image to client machine and displaying it from cache.
+
+  Usage: python client_service_test.py [host:port] [image file path] upload
+    host: IP address of client machine.
+    port: gRPC service port. (see _CLIENT_SERVICE_GRPC_PORT in main.py)
+    image file path: path to an image file on this machine.
+  """
+  target = argv[1]
+  with open(argv[2], 'rb') as f:
+    data = f.read()
+  grpc_channel = grpc.insecure_channel(target)
+  stub = client_pb2_grpc.ClientServiceStub(grpc_channel)
+  for i in range(2):
+    start_time = time.time()
+    response = client.push_image(stub, data)
+    print('Push #{0}: succeed={1} in {2:.1f} ms.'.format(
+        i + 1, response.succeed, (time.time() - start_time) * 1000))
+  raw_input('Press ENTER to continue.')
+  stub.DisplayOff(empty_pb2.Empty())
+
+
 if __name__ == '__main__':
-  test_image_display(sys.argv)
+  if len(sys.argv) > 3 and sys.argv[3] == 'upload':
+    test_image_upload(sys.argv)
+  else:
+    test_image_display(sys.argv)
@@ -0,0 +1,93 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Testcases and benchmark for utils.recorder.
+
+Usage: python testing/recorder_test.py [seconds]
+  seconds: seconds to record from a local SimProxy stand-in. Defaults to 5.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import sim_proxy_server
+from protos import sim_proxy_pb2
+from utils import recorder
+
+_RATE = 60  # Hz
+_PORT = 50052
+
+
+def test_record(seconds):
+  """Records from a SimProxy stand-in and reports CPU time spent."""
+  path = tempfile.mkdtemp()
+  server = sim_proxy_server.serve(
+      sim_proxy_server.SimProxyServer(rate=_RATE), port=_PORT)
+  data_types = sim_proxy_pb2.DataType.values()
+  start_cpu = sum(os.times()[:2])
+  r = recorder.SimProxyRecorder(
+      'localhost:{0}'.format(_PORT), data_types, path, chunk_size=256)
+  time.sleep(seconds)
+  r.close()
+  cpu = sum(os.times()[:2]) - start_cpu
+  server.stop(None)
+
+  recording = recorder.Recording(path)
+  timestamps, values = recording.get('HEADING_INDICATOR_INDICATION')
+  print('Recorded {0} samples of {1} types in {2} seconds.'.format(
+      len(timestamps), len(recording.names), seconds))
+  print('CPU time of server and recorder: {0:.1f}%.'.format(
+      cpu / seconds * 100))
+  shutil.rmtree(path)
+
+
+def test_read(hours=1):
+  """Writes an hour of data at 60 Hz for all types and reads it back."""
+  path = tempfile.mkdtemp()
+  names = sim_proxy_pb2.DataType.keys()
+  writer = recorder.RecordingWriter(path)
+  start_time = time.time()
+  count = int(hours * 3600 * _RATE)
+  for i in range(count):
+    timestamp = start_time + float(i) / _RATE
+    for name in names:
+      writer.append(name, timestamp, i)
+  writer.close()
+  print('Wrote {0} samples in {1:.1f} us per sample.'.format(
+      count * len(names),
+      (time.time() - start_time) / (count * len(names)) * 1e6))
+
+  read_time = time.time()
+  recording = recorder.Recording(path)
+  total = 0
+  for name in recording.names:
+    timestamps, values = recording.get(name)
+    total += float(values.sum())
+  print('Read {0} series of {1} samples in {2:.1f} ms.'.format(
+      len(recording.names), count, (time.time() - read_time) * 1000))
+
+  read_time = time.time()
+  timestamps, values = recording.get(
+      'AIRCRAFT_ALTITUDE', start=start_time + 600, end=start_time + 660)
+  print('Read a minute of {0} samples in {1:.3f} ms.'.format(
+      len(values), (time.time() - read_time) * 1000))
+  shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+  test_record(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
+  test_read()
@@ -0,0 +1,311 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stand-in of SimProxy service for testing consumers of flight simulator data.
+
+It implements flightlab SimProxy gRPC service without a flight simulator, so
+consumers can be tested and benchmarked on any platform. Data is synthesized
+from an aircraft flying circles, or replayed from a recording in CSV format with
+lines of "seconds,DataType name,value". Set and Trigger calls change the
+values streamed.
+
+Usage: python testing/sim_proxy_server.py [options]
+  Run with --help for options.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import grpc
+import math
+import sys
+import threading
+import time
+
+from concurrent import futures
+
+from protos import sim_proxy_pb2
+from protos import sim_proxy_pb2_grpc
+
+_DATA_TYPES = sorted(sim_proxy_pb2.DataType.values())
+
+# Events toggling a switch => data type of the switch.
+_TOGGLES = {
+    sim_proxy_pb2.EVENT_TOGGLE_MASTER_BATTERY:
+        sim_proxy_pb2.MASTER_BATTERY_SWITCH,
+    sim_proxy_pb2.EVENT_TOGGLE_MASTER_ALTERNATOR:
+        sim_proxy_pb2.MASTER_ALTERNATOR_SWITCH,
+    sim_proxy_pb2.EVENT_TOGGLE_AVIONICS_MASTER:
+        sim_proxy_pb2.AVIONICS_MASTER_SWITCH,
+    sim_proxy_pb2.EVENT_TOGGLE_TAXI_LIGHT: sim_proxy_pb2.TAXI_LIGHT,
+    sim_proxy_pb2.EVENT_TOGGLE_LANDING_LIGHT: sim_proxy_pb2.LANDING_LIGHT,
+    sim_proxy_pb2.EVENT_TOGGLE_BEACON_LIGHT: sim_proxy_pb2.BEACON_LIGHT,
+    sim_proxy_pb2.EVENT_TOGGLE_NAVIGATION_LIGHT:
+        sim_proxy_pb2.NAVIGATION_LIGHT,
+    sim_proxy_pb2.EVENT_TOGGLE_STROBE_LIGHT: sim_proxy_pb2.STROBE_LIGHT,
+    sim_proxy_pb2.EVENT_TOGGLE_FUEL_PUMP_SWITCH:
+        sim_proxy_pb2.FUEL_PUMP_SWITCH,
+    sim_proxy_pb2.EVENT_TOGGLE_PITOT_HEAT_SWITCH: sim_proxy_pb2.PITOT_HEAT,
+}
+
+# Magneto events => (left magneto, right magneto, engine starter).
+_MAGNETOS = {
+    sim_proxy_pb2.EVENT_MAGNETO_OFF: (0, 0, 0),
+    sim_proxy_pb2.EVENT_MAGNETO_LEFT: (1, 0, 0),
+    sim_proxy_pb2.EVENT_MAGNETO_RIGHT: (0, 1, 0),
+    sim_proxy_pb2.EVENT_MAGNETO_BOTH: (1, 1, 0),
+    sim_proxy_pb2.EVENT_MAGNETO_START: (1, 1, 1),
+}
+
+
+def synthesize(t):
+  """Gets data of an aircraft flying circles, which takes 2 minutes each.
+
+  Args:
+    t: seconds since start.
+  Returns:
+    Dictionary of DataType => value.
+  """
+  heading = (t * 3) % 360
+  altitude = 3000 + 200 * math.sin(t / 20.0)
+  pitch = 2 * math.cos(t / 20.0)
+  radius = 0.03  # degree
+  data = {
+      sim_proxy_pb2.AIRSPEED_INDICATOR_INDICATION: 110 + 5 * math.sin(t / 7.0),
+      sim_proxy_pb2.ATTITUDE_INDICATOR_BANK_ANGLE: 20,
+      sim_proxy_pb2.ATTITUDE_INDICATOR_PITCH_ANGLE: pitch,
+      sim_proxy_pb2.HEADING_INDICATOR_INDICATION: heading,
+      sim_proxy_pb2.ALTIMETER_INDICATION: altitude,
+      sim_proxy_pb2.ALTIMETER_KOHLSMAN_SETTING: 29.92,
+      sim_proxy_pb2.MAGNETIC_COMPASS_INDICATION: heading,
+      sim_proxy_pb2.FLAPS_POSITION: 0,
+      sim_proxy_pb2.AIRCRAFT_LATITUDE:
+          37.4 + radius * math.sin(math.radians(heading)),
+      sim_proxy_pb2.AIRCRAFT_LONGITUDE:
+          -122.1 - radius * math.cos(math.radians(heading)),
+      sim_proxy_pb2.AIRCRAFT_ALTITUDE: altitude,
+      sim_proxy_pb2.AIRCRAFT_PITCH: pitch,
+      sim_proxy_pb2.AIRCRAFT_BANK: 20,
+      sim_proxy_pb2.AIRCRAFT_HEADING_TRUE: heading,
+      sim_proxy_pb2.ELEVATOR_TRIM_POSITION: 1.5,
+      sim_proxy_pb2.ELEVATOR_TRIM_INDICATOR: 0.08,
+      sim_proxy_pb2.TIME: 63650000000 + time.time(),
+      sim_proxy_pb2.TIME_OF_DAY: 1,
+      sim_proxy_pb2.MAGNETIC_VARIATION: 13,
+  }
+  # Strobe light flashes about once a second.
+  data[sim_proxy_pb2.STROBE_LIGHT] = 1 if t % 1.0 < 0.1 else 0
+  return data
+
+
+class Recording(object):
+  """Data replayed in a loop from a CSV file."""
+
+  def __init__(self, path):
+    """Loads a recording.
+
+    Args:
+      path: CSV file with lines of "seconds,DataType name,value".
+    """
+    self._samples = []  # (seconds, data type, value)
+    with open(path, 'r') as f:
+      for row in csv.reader(f):
+        if len(row) != 3 or row[0].startswith('#'):
+          continue
+        self._samples.append((float(row[0]), sim_proxy_pb2.DataType.Value(
+            row[1].strip()), float(row[2])))
+    self._samples.sort()
+    self._duration = self._samples[-1][0] if self._samples else 0
+
+  def get(self, t):
+    """Gets latest value of every data type at a time of the recording.
+
+    Args:
+      t: seconds since start. It loops around at the end of recording.
+    Returns:
+      Dictionary of DataType => value.
+    """
+    if self._duration:
+      t %= self._duration
+    data = {}
+    for seconds, data_type, value in self._samples:
+      if seconds > t:
+        break
+      data[data_type] = value
+    return data
+
+
+class SimProxyServer(sim_proxy_pb2_grpc.SimProxyServicer):
+  """Provider for SimProxy service with synthesized or recorded data."""
+
+  def __init__(self,
+               rate=30,
+               max_types=0,
+               latency=0,
+               disconnect_interval=0,
+               recording=None):
+    """Creates SimProxyServer instance.
+
+    Args:
+      rate: responses per second of each stream.
+      max_types: maximum number of data types to stream, or 0 for no limit.
+      latency: seconds to delay each response and call.
+      disconnect_interval: seconds after which a stream is disconnected, or 0
+                           to never disconnect.
+      recording: Recording to replay, or None to synthesize data.
+    """
+    self._rate = rate
+    self._max_types = max_types
+    self._latency = latency
+    self._disconnect_interval = disconnect_interval
+    self._recording = recording
+    self._start_time = time.time()
+    self._lock = threading.Lock()
+    self._overrides = {}  # DataType => value set by Set or Trigger
+    self._responses = 0
+    self._streams = 0
+
+  def get_stats(self):
+    """Gets number of active streams and responses sent so far."""
+    with self._lock:
+      return self._streams, self._responses
+
+  def Watch(self, request, context):
+    data_types = list(request.types) or _DATA_TYPES
+    if self._max_types:
+      data_types = data_types[:self._max_types]
+    start_time = time.time()
+    next_time = start_time
+    with self._lock:
+      self._streams += 1
+    try:
+      while context.is_active():
+        if (self._disconnect_interval and
+            time.time() - start_time > self._disconnect_interval):
+          context.set_code(grpc.StatusCode.UNAVAILABLE)
+          context.set_details('Disconnected by test server.')
+          return
+        if self._latency:
+          time.sleep(self._latency)
+        values = self._get_values()
+        yield sim_proxy_pb2.WatchResponse(data=[
+            sim_proxy_pb2.Data(type=x, value=values.get(x, 0))
+            for x in data_types
+        ])
+        with self._lock:
+          self._responses += 1
+        # Keeps the rate regardless of time spent on each response.
+        next_time += 1.0 / self._rate
+        time.sleep(max(next_time - time.time(), 0))
+    finally:
+      with self._lock:
+        self._streams -= 1
+
+  def Set(self, data, context):
+    if self._latency:
+      time.sleep(self._latency)
+    with self._lock:
+      self._overrides[data.type] = data.value
+    return sim_proxy_pb2.EmptyResponse()
+
+  def Trigger(self, event, context):
+    if self._latency:
+      time.sleep(self._latency)
+    values = self._get_values()
+    with self._lock:
+      if event.type in _TOGGLES:
+        data_type = _TOGGLES[event.type]
+        self._overrides[data_type] = 0 if values.get(data_type) else 1
+      elif event.type in _MAGNETOS:
+        left, right, starter = _MAGNETOS[event.type]
+        self._overrides[sim_proxy_pb2.LEFT_MAGNETO] = left
+        self._overrides[sim_proxy_pb2.RIGHT_MAGNETO] = right
+        self._overrides[sim_proxy_pb2.ENGINE_STARTER] = starter
+    return sim_proxy_pb2.EmptyResponse()
+
+  def _get_values(self):
+    t = time.time() - self._start_time
+    if self._recording:
+      values = self._recording.get(t)
+    else:
+      values = synthesize(t)
+    with self._lock:
+      values.update(self._overrides)
+    return values
+
+
+def serve(servicer, port=50051, max_streams=50):
+  """Starts gRPC server of a SimProxyServer.
+
+  Every call occupies a worker thread, and a Watch stream does for its
+  lifetime, so at most max_streams streams are served at once. Further calls,
+  including Set and Trigger, are queued until a worker is free.
+
+  Args:
+    servicer: SimProxyServer to serve.
+    port: port to listen on.
+    max_streams: maximum number of concurrent streams.
+  Returns:
+    grpc.Server, which should be stopped when no longer needed.
+  """
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_streams))
+  sim_proxy_pb2_grpc.add_SimProxyServicer_to_server(servicer, server)
+  server.add_insecure_port('[::]:{0}'.format(port))
+  server.start()
+  return server
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--port', type=int, default=50051)
+  parser.add_argument(
+      '--rate', type=float, default=30, help='responses per second')
+  parser.add_argument(
+      '--types', type=int, default=0, help='maximum data types per response')
+  parser.add_argument(
+      '--latency', type=float, default=0, help='seconds to delay each response')
+  parser.add_argument(
+      '--disconnect',
+      type=float,
+      default=0,
+      help='seconds after which streams are disconnected')
+  parser.add_argument('--replay', help='CSV recording to replay')
+  parser.add_argument(
+      '--max-streams',
+      type=int,
+      default=50,
+      help='maximum concurrent streams, beyond which streams are queued')
+  args = parser.parse_args(argv[1:])
+
+  servicer = SimProxyServer(
+      rate=args.rate,
+      max_types=args.types,
+      latency=args.latency,
+      disconnect_interval=args.disconnect,
+      recording=Recording(args.replay) if args.replay else None)
+  server = serve(servicer, port=args.port, max_streams=args.max_streams)
+  print('SimProxy stand-in is listening on port {0}.'.format(args.port))
+  last_responses = 0
+  try:
+    while True:
+      time.sleep(10)
+      streams, responses = servicer.get_stats()
+      print('{0} streams, {1:.1f} responses per second.'.format(
+          streams, (responses - last_responses) / 10.0))
+      last_responses = responses
+  except KeyboardInterrupt:
+    server.stop(None)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,136 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for cold-start import time of controller in client and server mode.
+
+Every round runs in a fresh interpreter, so nothing is cached in sys.modules.
+Configuration is loaded through common.config.ConfigLoader as main does, so
+rounds after the first one read its binary cache.
+Modules imported for the first time are timed cumulatively, like
+"python -X importtime" on Python 3.7+, which is not available on Python 2.
+
+Usage: python testing/startup_test.py [config path] [machine name] [rounds]
+  config path: system configuration file. Defaults to config.protoascii.
+  machine name: machine to load components for in client mode. Defaults to the
+                first machine.
+  rounds: number of rounds to take the fastest of. Defaults to 5.
+"""
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+
+_TOP_MODULES = 8
+
+_CHILD = r'''
+import json
+import sys
+import time
+
+try:
+  import builtins
+except ImportError:
+  import __builtin__ as builtins
+
+_import = builtins.__import__
+_depth = [0]
+modules = {}
+
+
+def timed_import(name, *args, **kwargs):
+  level = args[3] if len(args) > 3 else kwargs.get('level', 0)
+  if name in sys.modules or level > 0:
+    return _import(name, *args, **kwargs)
+  start = time.time()
+  _depth[0] += 1
+  try:
+    return _import(name, *args, **kwargs)
+  finally:
+    _depth[0] -= 1
+    if _depth[0] == 0:
+      modules[name] = modules.get(name, 0) + time.time() - start
+
+
+builtins.__import__ = timed_import
+mode, config_path, machine_name = sys.argv[1:4]
+steps = []
+start = time.time()
+
+import main
+steps.append(('import main', time.time() - start))
+
+if mode == 'client':
+  from common import config
+  from components import factory
+  step_start = time.time()
+  loader = config.ConfigLoader(config_path)
+  system = loader.load()
+  machine = loader.get_machine_by_name(machine_name) or system.machines[0]
+  steps.append(('load config', time.time() - step_start))
+
+  step_start = time.time()
+  component_factory = factory.ComponentFactory()
+  for component in machine.components:
+    try:
+      component_factory.get_component_class(component)
+    except Exception as e:
+      sys.stderr.write('{0}: {1}\n'.format(component.name, e))
+  steps.append(('load components', time.time() - step_start))
+else:
+  step_start = time.time()
+  import api
+  import cherrypy
+  import flask
+  import flask_cors
+  steps.append(('load web server', time.time() - step_start))
+
+steps.append(('total', time.time() - start))
+print(json.dumps({'steps': steps, 'modules': modules}))
+'''
+
+
+def measure(mode, config_path, machine_name):
+  """Measures startup of a mode in a fresh interpreter.
+
+  Returns:
+    Dictionary of "steps" (list of [name, seconds]) and "modules" (top-level
+    module => seconds).
+  """
+  output = subprocess.check_output(
+      [sys.executable, '-c', _CHILD, mode, config_path, machine_name],
+      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+  return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def benchmark(argv):
+  config_path = os.path.abspath(argv[1] if len(argv) > 1 else
+                                'config.protoascii')
+  machine_name = argv[2] if len(argv) > 2 else ''
+  rounds = int(argv[3]) if len(argv) > 3 else 5
+
+  for mode in ('client', 'server'):
+    results = [measure(mode, config_path, machine_name) for _ in range(rounds)]
+    best = min(results, key=lambda x: x['steps'][-1][1])
+    print('{0} mode (fastest of {1} rounds):'.format(mode, rounds))
+    for name, seconds in best['steps']:
+      print('  {0:<20} {1:8.1f} ms'.format(name, seconds * 1000))
+    print('  Slowest modules:')
+    modules = sorted(best['modules'].items(), key=lambda x: -x[1])
+    for name, seconds in modules[:_TOP_MODULES]:
+      print('    {0:<18} {1:8.1f} ms'.format(name, seconds * 1000))
+
+
+if __name__ == '__main__':
+  benchmark(sys.argv)
@@ -16,22 +16,41 @@
 This library provides classes to control Windows application and UI.
 """
 
+import collections
 import os
 import psutil
 import subprocess
+import threading
 import time
 
 from common import pattern
+from utils import process
 
 
-class Application(pattern.EventEmitter, pattern.Worker, pattern.Logger):
+class Application(pattern.EventEmitter, pattern.Startable, pattern.Stopable,
+                  pattern.Logger):
   """Class to represent an application.
 
+  Exit of the launched process is detected by ProcessSupervisor, which watches
+  all applications from a single thread.
+
+  If restart_on_crash is set, a crashed application is restarted with
+  exponential backoff. Backoff doubles with every crash within crash loop window.
+  Once crash_loop_count crashes happen within the window, the application is
+  considered in crash loop and is no longer restarted until start() is called.
+
+  On stop, the whole process tree is asked to terminate and is killed if it
+  doesn't exit within shutdown grace period.
+
+  If output is given, stdout and stderr of every launched instance are captured
+  into it, along with a line marking each launch and exit.
+
   Events:
     "starting": right before the application is about to start.
     "started": right after the application started.
     "stopping": right before the application is about to be terminated.
     "stopped": right after the application is terminated.
+    "crash_loop": when the application crashed too often and is given up.
   """
 
   def __init__(self,
@@ -41,6 +60,13 @@ class Application(pattern.EventEmitter, pattern.Worker, pattern.Logger):
                working_dir=None,
                restart_on_crash=False,
                env=None,
+               initial_backoff=1,
+               max_backoff=60,
+               crash_loop_count=5,
+               crash_loop_window=300,
+               shutdown_grace_period=5,
+               resources=None,
+               output=None,
                *args,
                **kwargs):
     """Creates an Application instance.
@@ -52,9 +78,18 @@ class Application(pattern.EventEmitter, pattern.Worker, pattern.Logger):
       restart_on_crash: if True, restarts the application if it exited
                         unexpectedly.
       env: dictionary of environment variables.
+      initial_backoff: seconds to wait before restarting after first crash.
+      max_backoff: maximum seconds to wait before restarting.
+      crash_loop_count: number of crashes within crash_loop_window to give up
+                        restarting.
+      crash_loop_window: time window in seconds to count crashes.
+      shutdown_grace_period: seconds to wait for processes to terminate before
+                             killing them.
+      resources: utils.resources.ResourceControl to apply to every launched
+                 instance.
+      output: utils.output.OutputCapture to capture stdout and stderr into.
     """
-    super(Application, self).__init__(
-        worker_name='Application ({0})'.format(name), *args, **kwargs)
+    super(Application, self).__init__(*args, **kwargs)
     self._name = name
     self._bin_path = bin_path.lower()
     self._arguments = arguments
@@ -65,70 +100,248 @@ class Application(pattern.EventEmitter, pattern.Worker, pattern.Logger):
       self._env.update(env)
     else:
       self._env = None
+    self._cmdline = process.normalize_cmdline([self._bin_path] +
+                                              self._arguments)
 
+    self._initial_backoff = initial_backoff
+    self._max_backoff = max_backoff
+    self._crash_loop_count = crash_loop_count
+    self._crash_loop_window = crash_loop_window
+    self._shutdown_grace_period = shutdown_grace_period
+    self._resources = resources
+    self._output = output
+
+    self._lock = threading.RLock()
+    self._running = False
     self._app_proc = None
+    self._retry = None
+    self._in_crash_loop = False
+    self._crashes = collections.deque()  # time of recent crashes
+    self._restarts = collections.deque()  # time of recent restarts
+    self._crash_count = 0
+    self._restart_count = 0
+    self._start_time = None
+    self._shutdown_duration = 0
+    self._applied_resources = {}
 
   @property
   def name(self):
     """Gets name of the application."""
     return self._name
 
+  @property
+  def pid(self):
+    """Gets process id of the instance launched here, or None if not running."""
+    proc = self._app_proc
+    return proc.pid if proc else None
+
+  @property
+  def output(self):
+    """Gets utils.output.OutputCapture of the application, or None."""
+    return self._output
+
+  @property
+  def in_crash_loop(self):
+    """Whether the application crashed too often and is no longer restarted."""
+    return self._in_crash_loop
+
+  @property
+  def crash_count(self):
+    """Gets number of crashes."""
+    return self._crash_count
+
+  @property
+  def restart_count(self):
+    """Gets number of restarts after crash."""
+    return self._restart_count
+
+  @property
+  def restart_rate(self):
+    """Gets restarts per minute within crash loop window."""
+    with self._lock:
+      self._expire(self._restarts)
+      return len(self._restarts) * 60.0 / self._crash_loop_window
+
+  @property
+  def start_time(self):
+    """Gets epoch time the current instance started, or None if not running."""
+    return self._start_time
+
+  @property
+  def uptime(self):
+    """Gets seconds the current instance has been running."""
+    start_time = self._start_time
+    return time.time() - start_time if start_time else 0
+
+  @property
+  def shutdown_duration(self):
+    """Gets seconds taken by the latest shutdown."""
+    return self._shutdown_duration
+
+  @property
+  def applied_resources(self):
+    """Gets resource settings applied to the latest instance.
+
+    Returns:
+      Dictionary. See utils.resources.ResourceControl.apply().
+    """
+    return self._applied_resources
+
+  def start(self):
+    """Starts the application.
+
+    Instance(s) that are not started here will be terminated first. This also
+    resets crash loop state.
+    """
+    with self._lock:
+      if self._running:
+        return
+      self._running = True
+      self._in_crash_loop = False
+      self._crashes.clear()
+    self.kill()
+    self._launch()
+
   def stop(self):
     """Stops the application."""
-    super(Application, self).stop()
-    self.kill()
+    with self._lock:
+      self._running = False
+      if self._retry:
+        self._retry.cancel()
+        self._retry = None
+      proc = self._app_proc
+      self._app_proc = None
+      self._start_time = None
+
+    if proc:
+      process.ProcessSupervisor.instance().unwatch(proc)
+      self.emit('stopping', self)
+      self._terminate([proc])
+      self.emit('stopped', self)
+    else:
+      self.kill()
+
+  def close(self):
+    """Stops the application."""
+    self.stop()
+    super(Application, self).close()
 
   def has_running_instance(self):
     """Checks if any instance of the application is running."""
     return self._get_proc() is not None
 
   def kill(self):
-    """Terminates all the applications of the same executable."""
-    while True:
-      proc = self._get_proc()
-      if not proc:
+    """Terminates all instances of the application and their child processes.
+
+    Returns:
+      Seconds taken.
+    """
+    return self._terminate([])
+
+  def _terminate(self, popens):
+    start_time = time.time()
+    table = process.ProcessTable.instance()
+    procs = table.find(self._cmdline, max_age=0)
+    pids = set(x.pid for x in procs)
+    for popen in popens:
+      if popen.pid not in pids:
+        try:
+          procs.append(psutil.Process(popen.pid))
+        except psutil.NoSuchProcess:
+          pass
+    if not procs:
+      return 0
+
+    self.logger.debug('[App - {0}] Terminating instances (pid={1})...'.format(
+        self._name, ', '.join(str(x.pid) for x in procs)))
+    killed = process.terminate(procs, self._shutdown_grace_period)
+    for proc in procs:
+      table.remove(proc)
+    for popen in popens:
+      popen.wait()
+
+    self._shutdown_duration = time.time() - start_time
+    self.logger.info('[App - {0}] Shut down in {1:.2f} seconds ({2} killed '
+                     'after grace period).'.format(
+                         self._name, self._shutdown_duration, len(killed)))
+    return self._shutdown_duration
+
+  def _launch(self):
+    crash_loop = False
+    with self._lock:
+      self._retry = None
+      if not self._running or self._app_proc:
         return
+      self._app_proc = self._launch_app()
+      if self._app_proc:
+        self._start_time = time.time()
+        if self._output:
+          self._output.note('Started (pid={0}).'.format(self._app_proc.pid))
+        if self._resources:
+          self._applied_resources = self._resources.apply(self._app_proc.pid)
+        process.ProcessSupervisor.instance().watch(self._app_proc,
+                                                   self._on_exit)
+      elif self._restart_on_crash:
+        crash_loop = self._on_crash()
+    if crash_loop:
+      self.emit('crash_loop', self)
 
-      self.logger.debug('[App - {0}] Terminating instance (pid={1})...'.format(
-          self._name, proc.pid))
-      try:
-        proc.kill()
-      except psutil.NoSuchProcess:
-        self.logger.debug('[App - {0}] Instance exited.'.format(self._name))
+  def _relaunch(self):
+    with self._lock:
+      if not self._running:
         return
+      self._restart_count += 1
+      self._restarts.append(time.time())
+    self._launch()
 
-      self.logger.debug('[App - {0}] Waiting for instance to exit...'.format(
-          self._name))
-      while proc:
-        proc = self._get_proc()
-        if proc:
-          time.sleep(0.1)
-      self.logger.debug('[App - {0}] Instance exited.'.format(self._name))
+  def _on_exit(self, proc):
+    with self._lock:
+      if proc is not self._app_proc:
+        return
+      self._app_proc = None
+      self._start_time = None
+    self.logger.info('[App - {0}] Exited unexpectedly.'.format(self._name))
+    if self._output:
+      self._output.note('Exited unexpectedly (pid={0}, code={1}).'.format(
+          proc.pid, proc.poll()))
+    self.emit('stopped', self)
 
-  def _on_start(self):
-    # Kill instance(s) that are not started here.
-    self.kill()
-    self._app_proc = self._launch_app()
+    if self._restart_on_crash:
+      with self._lock:
+        crash_loop = self._on_crash()
+      if crash_loop:
+        self.emit('crash_loop', self)
 
-  def _on_run(self):
-    if self._app_proc:
-      if self._app_proc.poll() is not None:
-        self.logger.info('[App - {0}] Exited unexpectedly.'.format(self._name))
-        self._app_proc = None
-        self.emit('stopped', self)
+  def _on_crash(self):
+    """Schedules restart, or gives up if in crash loop. Lock must be held.
 
-    if not self._app_proc:
-      if self._restart_on_crash:
-        self._app_proc = self._launch_app()
+    Returns:
+      True if in crash loop, in which case "crash_loop" should be emitted after
+      releasing the lock.
+    """
+    self._crash_count += 1
+    self._crashes.append(time.time())
+    self._expire(self._crashes)
+    if len(self._crashes) >= self._crash_loop_count:
+      self.logger.error('[App - {0}] Crashed {1} times in {2} seconds. '
+                        'Giving up.'.format(self._name, len(self._crashes),
+                                            self._crash_loop_window))
+      self._running = False
+      self._in_crash_loop = True
+      return True
 
-    self._sleep(1)
+    backoff = min(self._initial_backoff * 2**(len(self._crashes) - 1),
+                  self._max_backoff)
+    self.logger.info('[App - {0}] Restarting in {1} seconds...'.format(
+        self._name, backoff))
+    self._retry = process.ProcessSupervisor.instance().call_later(
+        backoff, self._relaunch)
+    return False
 
-  def _on_stop(self):
-    if self._app_proc:
-      self.emit('stopping', self)
-      self._app_proc.kill()
-      self._app_proc = None
-      self.emit('stopped', self)
+  def _expire(self, times):
+    deadline = time.time() - self._crash_loop_window
+    while times and times[0] < deadline:
+      times.popleft()
 
   def _launch_app(self):
     args = [self._bin_path] + self._arguments
@@ -139,24 +352,31 @@ class Application(pattern.EventEmitter, pattern.Worker, pattern.Logger):
 
     proc = None
     try:
-      proc = subprocess.Popen(
-          args, cwd=self._working_dir, close_fds=True, env=self._env)
+      proc = subprocess.Popen(args, **self._get_popen_kwargs())
     except Exception as e:
       self.logger.debug('[App - {0}] Failed to launch. {1}'.format(
           self._name, e))
       return None
 
+    if self._output:
+      self._output.attach(proc.stdout)
     self.emit('started', self)
     return proc
 
+  def _get_popen_kwargs(self):
+    """Gets keyword arguments of subprocess.Popen shared by subclasses."""
+    # Output is drained by a reader thread of OutputCapture, so the app never
+    # blocks on a full pipe.
+    return {
+        'cwd': self._working_dir,
+        'close_fds': True,
+        'env': self._env,
+        'stdout': subprocess.PIPE if self._output else None,
+        'stderr': subprocess.STDOUT if self._output else None,
+        'preexec_fn': (self._resources.get_preexec_fn()
+                       if self._resources else None),
+    }
+
   def _get_proc(self):
-    target_cmd = (' '.join([self._bin_path] + self._arguments)).lower()
-    for proc in psutil.process_iter():
-      cmd = ''
-      try:
-        cmd = (' '.join(proc.cmdline())).lower()
-      except:
-        pass
-      if cmd == target_cmd:
-        return proc
-    return None
\ No newline at end of file
+    procs = process.ProcessTable.instance().find(self._cmdline)
+    return procs[0] if procs else None
\ No newline at end of file
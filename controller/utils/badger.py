@@ -13,19 +13,220 @@
 # limitations under the License.
 """ Utility for reading USB badge scanners with authorization via HTTP APIs."""
 
+import collections
+import errno
+import hashlib
+import os
 import requests
+import select
+import tempfile
+import threading
 import time
 
+from common import fswatch
 from common import pattern
-from evdev import InputDevice, ecodes, list_devices
+from concurrent import futures
 
 class BadgeReaderException(Exception):
   pass
 
-class BadgeValidator(pattern.EventEmitter):
-  """Class for badge authorization via HTTP API."""
+def _hash_badge(badge_id):
+  digest = hashlib.sha1(badge_id.encode('utf-8')).digest()
+  return digest[:BadgeAllowlist.HASH_SIZE]
 
-  def __init__(self, url, key_param, *args, **kwargs):
+class BadgeAllowlist(pattern.Worker):
+  """Locally held list of authorized badges, synced from a HTTP service.
+
+  Badges are kept as a sorted array of truncated hashes, which is compact,
+  quick to look up and doesn't keep badge IDs on disk. The list is persisted,
+  so it is available right after restart even if the service is not.
+
+  The service should respond to a GET request with authorized badge IDs, one
+  per line.
+
+  Anyone able to write the persisted file could authorize any badge, so it is
+  kept in a directory only accessible by current user, and not loaded if it is
+  owned by another user or writable by others.
+  """
+
+  HASH_SIZE = 8  # bytes
+  _RETRY_INTERVAL = 60  # sec
+
+  def __init__(self, url, path=None, sync_interval=3600, timeout=10,
+               *args, **kwargs):
+    """Creates a BadgeAllowlist instance.
+
+    Args:
+      url: URL to get authorized badge IDs from.
+      path: File to persist the list to. Defaults to one in ~/.flightlab.
+      sync_interval: Seconds between syncs.
+      timeout: Seconds to wait for connection and response of the service.
+    """
+    super(BadgeAllowlist, self).__init__(*args, **kwargs)
+    self._url = url
+    self._path = path or os.path.join(
+        os.path.expanduser('~'), '.flightlab', 'badge_allowlist')
+    self._sync_interval = sync_interval
+    self._timeout = timeout
+    self._session = requests.Session()
+    self._lock = threading.Lock()
+    self._hashes = b''  # sorted hashes of HASH_SIZE bytes each
+    self._stats = {
+        'size': 0,
+        'last_sync_time': 0,
+        'sync_duration': 0,
+        'hits': 0,
+        'misses': 0
+    }
+
+  def contains(self, badge_id):
+    """Checks if a badge is in the list.
+
+    Args:
+      badge_id: String containing the badge identifier.
+    Returns:
+      True if the badge is authorized.
+    """
+    with self._lock:
+      found = self._find(_hash_badge(badge_id))[1]
+      self._stats['hits' if found else 'misses'] += 1
+    return found
+
+  def add(self, badge_id):
+    """Adds a badge authorized by the server. It is kept until next sync.
+
+    Args:
+      badge_id: String containing the badge identifier.
+    """
+    badge_hash = _hash_badge(badge_id)
+    with self._lock:
+      offset, found = self._find(badge_hash)
+      if not found:
+        self._hashes = (self._hashes[:offset] + badge_hash +
+                        self._hashes[offset:])
+        self._stats['size'] += 1
+
+  def get_stats(self):
+    """Gets statistics of the list.
+
+    Returns:
+      Dictionary of "size", "last_sync_time" (seconds since epoch),
+      "sync_duration" (seconds), "hits" and "misses" of lookups.
+    """
+    with self._lock:
+      return dict(self._stats)
+
+  def sync(self):
+    """Replaces the list with the one from the service.
+
+    Returns:
+      True if succeeded.
+    """
+    start_time = time.time()
+    try:
+      r = self._session.get(url=self._url, timeout=self._timeout)
+      r.raise_for_status()
+    except requests.RequestException as e:
+      self.logger.warn('Failed to sync badge allowlist: {0}'.format(e))
+      return False
+
+    hashes = set(
+        _hash_badge(x.strip()) for x in r.text.splitlines() if x.strip())
+    hashes = b''.join(sorted(hashes))
+    with self._lock:
+      self._hashes = hashes
+      self._stats['size'] = len(hashes) // self.HASH_SIZE
+      self._stats['last_sync_time'] = time.time()
+      self._stats['sync_duration'] = time.time() - start_time
+    self._save(hashes)
+    self.logger.info('Synced {0} badges in {1:.3f} seconds.'.format(
+        len(hashes) // self.HASH_SIZE, time.time() - start_time))
+    return True
+
+  def _on_start(self):
+    self._load()
+
+  def _on_run(self):
+    if self.sync():
+      self._sleep(self._sync_interval)
+    else:
+      self._sleep(min(self._sync_interval, self._RETRY_INTERVAL))
+
+  def _on_stop(self):
+    self._session.close()
+
+  def _find(self, badge_hash):
+    """Binary searches a hash. Returns (offset to insert at, found)."""
+    low, high = 0, len(self._hashes) // self.HASH_SIZE
+    while low < high:
+      middle = (low + high) // 2
+      offset = middle * self.HASH_SIZE
+      if self._hashes[offset:offset + self.HASH_SIZE] < badge_hash:
+        low = middle + 1
+      else:
+        high = middle
+    offset = low * self.HASH_SIZE
+    return offset, self._hashes[offset:offset + self.HASH_SIZE] == badge_hash
+
+  def _load(self):
+    try:
+      with open(self._path, 'rb') as f:
+        if not self._is_trusted(os.fstat(f.fileno())):
+          self.logger.error('Not loading {0}, which is owned by another user '
+                            'or writable by others.'.format(self._path))
+          return
+        hashes = f.read()
+    except (IOError, OSError):
+      return
+    hashes = hashes[:len(hashes) - len(hashes) % self.HASH_SIZE]
+    with self._lock:
+      self._hashes = hashes
+      self._stats['size'] = len(hashes) // self.HASH_SIZE
+    self.logger.info('Loaded {0} badges from {1}.'.format(
+        len(hashes) // self.HASH_SIZE, self._path))
+
+  def _save(self, hashes):
+    try:
+      directory = os.path.dirname(os.path.abspath(self._path))
+      if not os.path.exists(directory):
+        os.makedirs(directory, 0o700)
+      if not self._is_trusted(os.stat(directory)):
+        self.logger.error('Not saving to {0}, which is owned by another user '
+                          'or writable by others.'.format(directory))
+        return
+      fd, temp_path = tempfile.mkstemp(dir=directory)  # only readable by owner
+      with os.fdopen(fd, 'wb') as f:
+        f.write(hashes)
+      if hasattr(os, 'replace'):
+        os.replace(temp_path, self._path)
+      else:
+        if os.name == 'nt' and os.path.exists(self._path):
+          os.remove(self._path)
+        os.rename(temp_path, self._path)
+    except (IOError, OSError) as e:
+      self.logger.warn('Failed to save badge allowlist: {0}'.format(e))
+
+  def _is_trusted(self, stat):
+    if not hasattr(os, 'getuid'):
+      return True  # Ownership is not checked on Windows.
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+class BadgeValidator(pattern.Closable, pattern.Logger):
+  """Class for badge authorization via HTTP API.
+
+  Connections to the authorization server are kept alive and reused, and every
+  request has a timeout. Results are cached for a while, so a repeated scan is
+  authorized without a request. validate_async() runs validation on a small
+  pool of threads, so the caller, e.g. a badge reader, is never blocked by a
+  slow server.
+
+  If an allowlist is given, it is checked first and the server is only asked
+  about badges not in it.
+  """
+
+  def __init__(self, url, key_param, timeout=2, cache_ttl=300,
+               negative_cache_ttl=10, cache_size=1024, max_workers=2,
+               allowlist=None, *args, **kwargs):
     """Creates a BadgeValidator instance for validating badges.
 
     The URL parameter will be appended with the customer key_param
@@ -35,14 +236,34 @@ class BadgeValidator(pattern.EventEmitter):
     Args:
       url: Authorization server URL
       key_param: Name of badge parameter to add to the URL
+      timeout: Seconds to wait for connection and response of the server.
+      cache_ttl: Seconds to keep an authorized result.
+      negative_cache_ttl: Seconds to keep an unauthorized result.
+      cache_size: Maximum number of badges to keep results for.
+      max_workers: Maximum number of requests in parallel.
+      allowlist: BadgeAllowlist to check first, or None.
     """
     super(BadgeValidator, self).__init__(*args, **kwargs)
     self._url = url
     self._key_param = key_param
+    self._timeout = timeout
+    self._cache_ttl = cache_ttl
+    self._negative_cache_ttl = negative_cache_ttl
+    self._cache_size = cache_size
+    self._allowlist = allowlist
+    self._cache = collections.OrderedDict()  # badge_id => (result, expiry)
+    self._lock = threading.Lock()
+    self._session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=max_workers)
+    self._session.mount('http://', adapter)
+    self._session.mount('https://', adapter)
+    self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
 
   def close(self):
     """Closes the communication."""
-    super(BadgeReader, self).close()
+    self._executor.shutdown(wait=False)
+    self._session.close()
 
   def validate(self, badge_id):
     """Validates the badge ID with a HTTP service. Any 2xx is considered success.
@@ -50,72 +271,229 @@ class BadgeValidator(pattern.EventEmitter):
     Args:
       badge_id: String containing the badge identifier to authorize.
     Returns:
-      Response boolean.
+      Response boolean, or None if the service is not available.
     """
+    if self._allowlist and self._allowlist.contains(badge_id):
+      return True
+
+    now = time.time()
+    with self._lock:
+      cached = self._cache.pop(badge_id, None)
+      if cached and cached[1] > now:
+        self._cache[badge_id] = cached
+        return cached[0]
+
     try:
-      r = requests.get(url = self._url, params = {self._key_param: badge_id})
-      return r.status_code >= 200 and r.status_code < 300
-    except requests.ConnectionError:
-      return False
+      r = self._session.get(
+          url=self._url,
+          params={self._key_param: badge_id},
+          timeout=self._timeout)
+    except requests.RequestException as e:
+      self.logger.warn('Failed to validate badge: {0}'.format(e))
+      return None
+    if r.status_code >= 500:
+      self.logger.warn('Failed to validate badge: HTTP {0}'.format(
+          r.status_code))
+      return None
+    result = r.status_code >= 200 and r.status_code < 300
+
+    if result and self._allowlist:
+      self._allowlist.add(badge_id)
+    ttl = self._cache_ttl if result else self._negative_cache_ttl
+    with self._lock:
+      self._cache[badge_id] = (result, time.time() + ttl)
+      while len(self._cache) > self._cache_size:
+        self._cache.popitem(last=False)
+    return result
+
+  def validate_async(self, badge_id, callback):
+    """Validates the badge ID in background.
+
+    Args:
+      badge_id: String containing the badge identifier to authorize.
+      callback: Function called with badge_id and result of validate().
+    """
+    def _validate():
+      try:
+        callback(badge_id, self.validate(badge_id))
+      except Exception as e:
+        self.logger.exception(
+            'Failed to handle badge validation: {0}'.format(e))
+    self._executor.submit(_validate)
+
+class _Device(object):
+  """State of an input device being read."""
+
+  def __init__(self, path, device):
+    self.path = path
+    self.device = device
+    self.badge_id = ''
 
 class BadgeReader(pattern.Worker, pattern.EventEmitter):
-  """Worker that monitors the badge reader and emits the badge ID on success.
+  """Worker that monitors badge readers and emits the badge ID on success.
 
   This class supports Google's USB pcProx RFID Reader configured to support Google
   employee badges.  However, it may support other USB HID based readers given
   the proper vendor and product codes. It currently only supports reading the
   0-9 and : ASCII characters.
+
+  All matching devices are read on one thread with select(). Devices plugged in
+  or out are detected by watching the device directory, so a reconnected reader
+  is used right away.
+
+  Events:
+    "read_success": when a badge is read.
+      Args:
+        reader: this BadgeReader.
+        badge_id: String containing the badge identifier.
   """
-  def __init__(self, usb_vendor_id, usb_product_id,  *args, **kwargs):
+
+  _EV_KEY = 1
+  _KEY_ENTER = 28
+  _SELECT_TIMEOUT = 1  # sec
+
+  def __init__(self, usb_vendor_id, usb_product_id, device_dir='/dev/input',
+               open_device=None, *args, **kwargs):
     """Creates a BadgeReader instance.
 
     Args:
       usb_vendor_id: USB Vendor ID of the device.
       usb_product_id: USB Product ID of the device.
+      device_dir: Directory of input device files.
+      open_device: Function that takes path of a device file and returns an
+                   evdev.InputDevice-like object, or raises IOError or OSError.
+                   Defaults to evdev.InputDevice. Mainly for testing.
     """
     super(BadgeReader, self).__init__(worker_name='BadgeReader', *args, **kwargs)
-    self._device = None
-    self._usb_vendor_id = usb_vendor_id
-    self._usb_product_id = usb_product_id
+    self._usb_vendor_id = int(usb_vendor_id, 16)
+    self._usb_product_id = int(usb_product_id, 16)
+    self._device_dir = device_dir
+    self._open_device = open_device or self._open_evdev
+    self._devices = {}  # fd => _Device
+    self._scans = collections.Counter()  # path => number of badges read
+    self._lock = threading.Lock()
+    self._plugged = set()  # paths of device files created or changed
+    self._wake_fds = None
+    self._watcher = None
     self._key_codes = {
             2: u'1', 3: u'2', 4: u'3', 5: u'4', 6: u'5', 7: u'6',
             8: u'7', 9: u'8', 10: u'9', 11: u'0', 39: u':'}
 
+  def get_stats(self):
+    """Gets number of badges read from each device.
+
+    Returns:
+      Dictionary of device path => number of badges read.
+    """
+    with self._lock:
+      return dict(self._scans)
+
   def _on_start(self):
-    devices = [InputDevice(path) for path in list_devices()]
-    for device in devices:
-      if device.info.vendor == int(self._usb_vendor_id, 16) and device.info.product == int(self._usb_product_id, 16):
-        self._device = device
-        self.logger.info("Badge reader device found.")
-        break
-    if self._device == None:
-      self.logger.warn("Device may be disconnected. Attempting to reconnect...")
-      time.sleep(10)
-      self._on_start()
+    self._wake_fds = os.pipe()
+    self._watcher = fswatch.DirectoryWatcher(self._device_dir)
+    self._watcher.on('created', self._on_device_plugged)
+    # Permission of a new device file may be set after it's created.
+    self._watcher.on('modified', self._on_device_plugged)
+    self._watcher.start()
+    try:
+      names = sorted(os.listdir(self._device_dir))
+    except OSError as e:
+      self.logger.warn("Failed to list devices: %s", e)
+      names = []
+    for name in names:
+      self._add_device(os.path.join(self._device_dir, name))
+    if not self._devices:
+      self.logger.warn("Badge reader device not found. Waiting for it...")
 
   def _on_run(self):
-    """Read and format an RFID badge ID
+    """Reads and formats RFID badge IDs.
 
-    Raises:
-      BadgeReaderException: When device is unavailable, or reading fails.
     Emits:
       read_success: A badge was successfully read.
     """
+    fds = list(self._devices.keys()) + [self._wake_fds[0]]
+    readable, _, _ = select.select(fds, [], [], self._SELECT_TIMEOUT)
+    for fd in readable:
+      if fd == self._wake_fds[0]:
+        os.read(fd, 4096)
+      else:
+        self._read_device(self._devices[fd])
+
+    with self._lock:
+      plugged = self._plugged
+      self._plugged = set()
+    for path in plugged:
+      self._add_device(path)
+
+  def _on_stop(self):
+    self._watcher.stop()
+    for device in list(self._devices.values()):
+      self._remove_device(device)
+    with self._lock:
+      for fd in self._wake_fds:
+        os.close(fd)
+      self._wake_fds = None
+
+  def _on_device_plugged(self, path):
+    if not os.path.basename(path).startswith('event'):
+      return
+    with self._lock:
+      self._plugged.add(path)
+      if self._wake_fds:
+        os.write(self._wake_fds[1], b'\0')
+
+  def _add_device(self, path):
+    if not os.path.basename(path).startswith('event'):
+      return
+    if any(x.path == path for x in self._devices.values()):
+      return
     try:
-      self._device.grab()
-      badge_id = ""
-      for event in self._device.read_loop():
-        if event.type == ecodes.EV_KEY and event.value == 1:
-          if event.code in (self._key_codes):
-            badge_id += self._key_codes[event.code]
-            continue
-          if event.code is ecodes.KEY_ENTER:
-            self.emit('read_success', self, badge_id)
-            badge_id = ""
-      self._device.ungrab()
-      return True
-    except:
-      self.logger.warn("Device may be disconnected. Attempting to reconnect...")
-      time.sleep(10)
-      self._on_start()
+      device = self._open_device(path)
+    except (IOError, OSError) as e:
+      self.logger.debug("Failed to open %s: %s", path, e)
+      return
+    if (device.info.vendor != self._usb_vendor_id or
+        device.info.product != self._usb_product_id):
+      device.close()
+      return
+    try:
+      device.grab()
+    except (IOError, OSError) as e:
+      self.logger.warn("Failed to grab %s: %s", path, e)
+      device.close()
+      return
+    self._devices[device.fileno()] = _Device(path, device)
+    self.logger.info("Badge reader device found at %s.", path)
+
+  def _remove_device(self, device):
+    del self._devices[device.device.fileno()]
+    try:
+      device.device.ungrab()
+    except (IOError, OSError):
+      pass
+    device.device.close()
+
+  def _read_device(self, device):
+    try:
+      events = list(device.device.read())
+    except (IOError, OSError) as e:
+      if e.errno == errno.EAGAIN:
+        return
+      self.logger.warn("Badge reader at %s is disconnected.", device.path)
+      self._remove_device(device)
+      return
+
+    for event in events:
+      if event.type != self._EV_KEY or event.value != 1:
+        continue
+      if event.code in self._key_codes:
+        device.badge_id += self._key_codes[event.code]
+      elif event.code == self._KEY_ENTER:
+        with self._lock:
+          self._scans[device.path] += 1
+        self.emit('read_success', self, device.badge_id)
+        device.badge_id = ''
 
+  def _open_evdev(self, path):
+    import evdev
+    return evdev.InputDevice(path)
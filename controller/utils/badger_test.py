@@ -0,0 +1,240 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test-cases for utils.badger.
+
+BadgeValidator is tested against a local HTTP stand-in of authorization server,
+and BadgeReader against fake input devices.
+"""
+from __future__ import print_function
+
+import collections
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler  # Python 2
+  from BaseHTTPServer import HTTPServer
+  from SocketServer import ThreadingMixIn
+  from urlparse import parse_qs, urlparse
+except ImportError:
+  from http.server import BaseHTTPRequestHandler  # Python 3
+  from http.server import HTTPServer
+  from socketserver import ThreadingMixIn
+  from urllib.parse import parse_qs, urlparse
+
+import badger
+
+_AUTHORIZED_BADGES = set(['1234:5678'])
+
+
+class _AuthServer(ThreadingMixIn, HTTPServer):
+  """Stand-in of authorization server, with configurable latency."""
+  daemon_threads = True
+  delay = 0
+  requests = 0
+
+
+class _AuthHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'  # keeps connections alive
+
+  def do_GET(self):
+    self.server.requests += 1
+    time.sleep(self.server.delay)
+    if self.path == '/allowlist':
+      data = '\n'.join(_AUTHORIZED_BADGES).encode('utf-8')
+      self.send_response(200)
+      self.send_header('Content-Length', str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+      return
+    badge_id = parse_qs(urlparse(self.path).query).get('badge', [''])[0]
+    code = 200 if badge_id in _AUTHORIZED_BADGES else 403
+    self.send_response(code)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def log_message(self, format, *args):
+    pass
+
+
+_Event = collections.namedtuple('_Event', ['type', 'code', 'value'])
+_Info = collections.namedtuple('_Info', ['vendor', 'product'])
+_KEY_CODES = {'1': 2, '2': 3, '3': 4, '4': 5, '5': 6, '6': 7, '7': 8, '8': 9,
+              '9': 10, '0': 11, ':': 39}
+
+
+class _FakeDevice(object):
+  """Fake of evdev.InputDevice, which is fed with key strokes of badges."""
+
+  def __init__(self, vendor=0x0c27, product=0x3bfa):
+    self.info = _Info(vendor, product)
+    self._read_fd, self._write_fd = os.pipe()
+    self._events = []
+    self._lock = threading.Lock()
+    self.disconnected = False
+
+  def scan(self, badge_id):
+    with self._lock:
+      for c in badge_id + '\n':
+        code = _KEY_CODES.get(c, 28)  # 28 is KEY_ENTER.
+        self._events += [_Event(1, code, 1), _Event(1, code, 0)]
+    os.write(self._write_fd, b'\0')
+
+  def disconnect(self):
+    self.disconnected = True
+    os.write(self._write_fd, b'\0')
+
+  def fileno(self):
+    return self._read_fd
+
+  def read(self):
+    if self.disconnected:
+      raise OSError(errno.ENODEV, 'No such device')
+    os.read(self._read_fd, 4096)
+    with self._lock:
+      events, self._events = self._events, []
+    return events
+
+  def grab(self):
+    pass
+
+  def ungrab(self):
+    pass
+
+  def close(self):
+    os.close(self._read_fd)
+    os.close(self._write_fd)
+
+
+def test_reader():
+  device_dir = tempfile.mkdtemp()
+  devices = {}  # path => _FakeDevice
+
+  def open_device(path):
+    if path not in devices:
+      raise OSError(errno.ENOENT, 'No such device')
+    return devices[path]
+
+  def plug(name, device):
+    path = os.path.join(device_dir, name)
+    devices[path] = device
+    open(path, 'w').close()
+    return device
+
+  reads = []
+  scanned = threading.Event()
+
+  def on_read_success(reader, badge_id):
+    reads.append((badge_id, time.time()))
+    scanned.set()
+
+  plug('event0', _FakeDevice())
+  plug('event1', _FakeDevice(vendor=0x1234))  # not a badge reader
+  reader = badger.BadgeReader('0c27', '3bfa', device_dir=device_dir,
+                              open_device=open_device)
+  reader.on('read_success', on_read_success)
+  reader.start()
+  time.sleep(0.5)
+
+  devices[os.path.join(device_dir, 'event0')].scan('1234:5678')
+  scanned.wait(5)
+  print('Read {0} from event0.'.format(reads[-1][0]))
+
+  # Second reader is plugged in while the first one is unplugged.
+  plug('event2', _FakeDevice()).scan('2222:2222')
+  devices.pop(os.path.join(device_dir, 'event0')).disconnect()
+  os.remove(os.path.join(device_dir, 'event0'))
+  time.sleep(0.5)
+
+  # The first reader is plugged in again.
+  start_time = time.time()
+  scanned.clear()
+  plug('event0', _FakeDevice()).scan('3333:3333')
+  scanned.wait(5)
+  print('Read {0} from reconnected event0 in {1:.1f} ms.'.format(
+      reads[-1][0], (reads[-1][1] - start_time) * 1000))
+  print('Badges read: {0}'.format([x[0] for x in reads]))
+  print('Scans per device: {0}'.format(reader.get_stats()))
+  reader.stop()
+  shutil.rmtree(device_dir)
+
+
+def _measure(validator, badge_id, rounds):
+  start_time = time.time()
+  for _ in range(rounds):
+    result = validator.validate(badge_id)
+  return result, (time.time() - start_time) / rounds * 1000
+
+
+def test():
+  server = _AuthServer(('127.0.0.1', 0), _AuthHandler)
+  threading.Thread(target=server.serve_forever).start()
+  url = 'http://127.0.0.1:{0}/auth'.format(server.server_address[1])
+
+  # Without cache, every scan makes a request over a kept-alive connection.
+  validator = badger.BadgeValidator(url, 'badge', cache_ttl=0,
+                                    negative_cache_ttl=0)
+  print('Uncached: result={0}, {1:.3f} ms per scan.'.format(
+      *_measure(validator, '1234:5678', 100)))
+  validator.close()
+
+  validator = badger.BadgeValidator(url, 'badge', timeout=0.5)
+  requests = server.requests
+  result, latency = _measure(validator, '1234:5678', 10000)
+  print('Cached: result={0}, {1:.3f} ms per scan, {2} requests.'.format(
+      result, latency, server.requests - requests))
+  print('Unauthorized: result={0}, {1:.3f} ms per scan.'.format(
+      *_measure(validator, '0000:0000', 100)))
+
+  # A slow server times out instead of blocking the reader.
+  server.delay = 2
+  start_time = time.time()
+  done = threading.Event()
+  validator.validate_async('1111:1111', lambda badge_id, result: done.set())
+  print('validate_async() returned in {0:.3f} ms.'.format(
+      (time.time() - start_time) * 1000))
+  done.wait()
+  print('Slow server: result={0} after {1:.3f} seconds.'.format(
+      validator.validate('2222:2222'), time.time() - start_time))
+
+  validator.close()
+
+  # Badges in allowlist are authorized even if the server is not available.
+  server.delay = 0
+  _AUTHORIZED_BADGES.update('{0:04d}:{0:04d}'.format(i) for i in range(10000))
+  allowlist_dir = tempfile.mkdtemp()
+  path = os.path.join(allowlist_dir, 'allowlist')
+  allowlist = badger.BadgeAllowlist(
+      'http://127.0.0.1:{0}/allowlist'.format(server.server_address[1]), path)
+  allowlist.sync()
+  server.delay = 2
+  validator = badger.BadgeValidator(url, 'badge', timeout=0.5,
+                                    allowlist=allowlist)
+  print('Allowlist: result={0}, {1:.3f} ms per scan.'.format(
+      *_measure(validator, '0042:0042', 10000)))
+  print('Allowlist miss: result={0}.'.format(validator.validate('9999:0000')))
+  print('Allowlist stats: {0}, {1} bytes on disk.'.format(
+      allowlist.get_stats(), os.path.getsize(path)))
+  validator.close()
+  shutil.rmtree(allowlist_dir)
+  server.shutdown()
+
+
+if __name__ == '__main__':
+  test()
+  test_reader()
@@ -13,60 +13,188 @@
 # limitations under the License.
 """Utility library for displaying arbitrary content on a machine."""
 
+import hashlib
 import jinja2
+import mimetypes
+import os
+import socket
 import tempfile
+import threading
+import time
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler  # Python 2
+  from BaseHTTPServer import HTTPServer
+  from SocketServer import ThreadingMixIn
+except ImportError:
+  from http.server import BaseHTTPRequestHandler  # Python 3
+  from http.server import HTTPServer
+  from socketserver import ThreadingMixIn
 
 from common import pattern
 from utils import app
 
+_SHELL_PAGE_PATH = './data/display_shell.html'
+_MESSAGE_TEMPLATE_PATH = './data/display_message.html'
+_IMAGE_TEMPLATE_PATH = './data/display_image_default.html'
+
+
+class _ContentServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+  """Serves shell page, content events and images of a Display."""
+
+  def do_GET(self):
+    display = self.server.display
+    if self.path == '/':
+      self._send(200, 'text/html', display.shell_page)
+    elif self.path == '/events':
+      self._send_events(display)
+    elif self.path.startswith('/images/'):
+      path = display.get_image_path(self.path[len('/images/'):])
+      if not path:
+        self._send(404, 'text/plain', b'Not found')
+        return
+      try:
+        with open(path, 'rb') as f:
+          data = f.read()
+      except IOError:
+        self._send(404, 'text/plain', b'Not found')
+        return
+      self._send(200,
+                 mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                 data)
+    else:
+      self._send(404, 'text/plain', b'Not found')
+
+  def log_message(self, format, *args):
+    pass
+
+  def _send(self, code, content_type, data):
+    self.send_response(code)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def _send_events(self, display):
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/event-stream')
+    self.send_header('Cache-Control', 'no-cache')
+    self.end_headers()
+    version = None
+    try:
+      while not display.closed:
+        content, version = display.wait_content(version)
+        if content is None:
+          self.wfile.write(b': keep-alive\n\n')
+        else:
+          lines = content.splitlines() or ['']
+          self.wfile.write(u''.join(
+              u'data: {0}\n'.format(x) for x in lines).encode('utf-8') + b'\n')
+        self.wfile.flush()
+    except (IOError, socket.error):
+      pass  # Browser disconnected.
+
 
-class Display(pattern.Closable):
+class Display(pattern.Closable, pattern.Logger):
   """Class for displaying arbitrary content on a machine.
 
   The implementation assumes Chrome browser is available on given machine and
   use it to display generated html content in kiosk mode so it appears as an app
   and works on any platform.
+
+  A single Chrome instance keeps running and loads a shell page from a local
+  HTTP server. New content is pushed to the page as server-sent events, so
+  switching content doesn't restart Chrome. Chrome is only relaunched if it
+  crashes.
+
+  Compiled templates are cached and only recompiled when their files change.
+  Screens can be rendered ahead of time with add_screen(), so showing them later
+  only swaps content.
   """
 
-  def __init__(self, chrome_path, *args, **kwargs):
+  _KEEP_ALIVE_INTERVAL = 15  # sec
+
+  def __init__(self, chrome_path, port=9002, *args, **kwargs):
     """Creates Display instance.
 
     Args:
       chrome_path: path to chrome executable.
+      port: local port for Chrome to load content from.
     """
     super(Display, self).__init__(*args, **kwargs)
     self._chrome_path = chrome_path
     self._temp_path = tempfile.gettempdir()
-    self._index_file = tempfile.mktemp(suffix='.html')
+    self._condition = threading.Condition()
+    self._content = ''
+    self._version = 0
+    self._images = {}  # token => image path
+    self._closed = False
+    self._environments = {}  # template directory => jinja2.Environment
+    self._screens = {}  # screen name => rendered html
+    for path in (_MESSAGE_TEMPLATE_PATH, _IMAGE_TEMPLATE_PATH):
+      self._get_template(path)
+    with open(_SHELL_PAGE_PATH, 'rb') as f:
+      self._shell_page = f.read()
+
+    self._server = _ContentServer(('127.0.0.1', port), _RequestHandler)
+    self._server.display = self
+    pattern.run_as_thread(
+        name='Display.server', target=self._server.serve_forever, kwargs={})
+
     self._chrome_app = app.Application(
         name='Browser',
         bin_path=chrome_path,
         arguments=[
-            '--kiosk', self._index_file, '--new-window', '--incognito',
+            '--kiosk', 'http://127.0.0.1:{0}/'.format(
+                self._server.server_address[1]), '--new-window', '--incognito',
             '--noerrordialogs', '--user-data-dir={0}'.format(self._temp_path)
         ],
         restart_on_crash=True)
 
+  @property
+  def closed(self):
+    """Whether the display is closed."""
+    return self._closed
+
+  @property
+  def shell_page(self):
+    """Gets html of the page Chrome loads."""
+    return self._shell_page
+
   def close(self):
-    """Closes Chrome browser."""
+    """Closes Chrome browser and stops serving content."""
+    self._closed = True
+    with self._condition:
+      self._condition.notify_all()
+    self.turn_off()
+    self._server.shutdown()
+    self._server.server_close()
+
+  def turn_off(self):
+    """Closes Chrome browser. It is launched again on next content."""
     self._chrome_app.stop()
 
-  def show_message(self, message, template_path='./data/display_message.html'):
+  def show_message(self, message, template_path=_MESSAGE_TEMPLATE_PATH):
     """Shows a text message in full screen.
 
     Args:
       message: text to show.
       template_path: a html template to use. It should contain "{{ message }}".
     """
-    self._generate_page(
-        template_path=template_path, kwargs={
-            'message': message
-        })
-    self._relaunch()
+    self._show(
+        self._generate_page(
+            template_path=template_path, kwargs={
+                'message': message
+            }))
 
   def show_image(self,
                  image_path,
-                 template_path='./data/display_image_default.html'):
+                 template_path=_IMAGE_TEMPLATE_PATH):
     """Shows an image in full screen.
 
     Current implementation only displays the image at (0,0) and at its original
@@ -79,19 +207,111 @@ class Display(pattern.Closable):
       template_path: a html template to use. It should contain
                      "{{ image_path }}".
     """
-    self._generate_page(
-        template_path=template_path, kwargs={
-            'image_path': image_path
-        })
-    self._relaunch()
+    self._show(
+        self._generate_page(
+            template_path=template_path,
+            kwargs={
+                'image_path': self._get_image_url(image_path)
+            }))
 
-  def _generate_page(self, template_path, kwargs={}):
-    with open(template_path, 'r') as f:
-      template = jinja2.Template(f.read())
+  def add_screen(self,
+                 name,
+                 message=None,
+                 image_path=None,
+                 template_path=None):
+    """Renders a screen to show later by name.
 
-    with open(self._index_file, 'w') as f:
-      f.write(template.render(**kwargs))
+    Args:
+      name: name of the screen.
+      message: text to show. Either message or image_path should be given.
+      image_path: a locally accessible path to image file.
+      template_path: a html template to use. Defaults to the one of
+                     show_message() or show_image().
+    """
+    if image_path:
+      content = self._generate_page(
+          template_path=template_path or _IMAGE_TEMPLATE_PATH,
+          kwargs={'image_path': self._get_image_url(image_path)})
+    else:
+      content = self._generate_page(
+          template_path=template_path or _MESSAGE_TEMPLATE_PATH,
+          kwargs={'message': message or ''})
+    with self._condition:
+      self._screens[name] = content
 
-  def _relaunch(self):
-    self._chrome_app.stop()
-    self._chrome_app.start()
+  def show_screen(self, name):
+    """Shows a screen added by add_screen().
+
+    Args:
+      name: name of the screen.
+    Returns:
+      False if the screen is not found.
+    """
+    with self._condition:
+      content = self._screens.get(name)
+    if content is None:
+      return False
+    self._show(content)
+    return True
+
+  def get_image_path(self, token):
+    """Gets path of an image shown.
+
+    Args:
+      token: token in image url.
+    Returns:
+      Path to the image file, or None if not found.
+    """
+    with self._condition:
+      return self._images.get(token)
+
+  def wait_content(self, version, timeout=None):
+    """Waits for content newer than given version.
+
+    Args:
+      version: version of content the caller has, or None to get current one.
+      timeout: seconds to wait. Defaults to keep-alive interval.
+    Returns:
+      (content, version), or (None, version) if no newer content in time.
+    """
+    with self._condition:
+      if version == self._version and not self._closed:
+        self._condition.wait(timeout or self._KEEP_ALIVE_INTERVAL)
+      if version == self._version:
+        return None, version
+      return self._content, self._version
+
+  def _show(self, content):
+    start_time = time.time()
+    with self._condition:
+      self._content = content
+      self._version += 1
+      self._condition.notify_all()
+    if not self._chrome_app.pid:
+      self._chrome_app.start()
+    self.logger.debug('Content pushed in {0:.1f} ms.'.format(
+        (time.time() - start_time) * 1000))
+
+  def _get_image_url(self, image_path):
+    path = os.path.abspath(image_path)
+    token = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    token += os.path.splitext(path)[1]
+    with self._condition:
+      self._images[token] = path
+    return '/images/{0}'.format(token)
+
+  def _generate_page(self, template_path, kwargs={}):
+    return self._get_template(template_path).render(**kwargs)
+
+  def _get_template(self, template_path):
+    path = os.path.abspath(template_path)
+    directory, name = os.path.split(path)
+    with self._condition:
+      environment = self._environments.get(directory)
+      if not environment:
+        environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(directory), auto_reload=True)
+        self._environments[directory] = environment
+    # Environment caches compiled templates and checks modification time of
+    # template files to recompile.
+    return environment.get_template(name)
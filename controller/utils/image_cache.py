@@ -0,0 +1,201 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content-addressed cache of image files on a machine."""
+
+import collections
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+from common import pattern
+
+# Leading bytes of image formats => file extension.
+_SIGNATURES = ((b'\x89PNG\r\n\x1a\n', '.png'), (b'\xff\xd8\xff', '.jpg'),
+               (b'GIF87a', '.gif'), (b'GIF89a', '.gif'), (b'BM', '.bmp'))
+
+
+def get_hash(data):
+  """Gets content hash of image data, which is the key of the cache."""
+  return hashlib.sha1(data).hexdigest()
+
+
+def _get_extension(data):
+  if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+    return '.webp'
+  for signature, extension in _SIGNATURES:
+    if data.startswith(signature):
+      return extension
+  return ''
+
+
+class ImageCache(pattern.Logger):
+  """Keeps image files by hash of their content.
+
+  Least recently used images are evicted once the total size of cached files
+  exceeds the limit. Images larger than the display are downscaled before
+  caching if PIL is available, so the browser doesn't decode oversized images.
+  """
+
+  def __init__(self,
+               cache_dir=None,
+               max_size=256 * 1024 * 1024,
+               max_width=0,
+               max_height=0,
+               *args,
+               **kwargs):
+    """Creates ImageCache instance.
+
+    Args:
+      cache_dir: directory to keep image files in. Defaults to a directory
+                 under system temp directory.
+      max_size: maximum total bytes of cached files.
+      max_width: width of the display, or 0 to not downscale.
+      max_height: height of the display, or 0 to not downscale.
+    """
+    super(ImageCache, self).__init__(*args, **kwargs)
+    self._cache_dir = cache_dir or os.path.join(tempfile.gettempdir(),
+                                                'flightlab', 'images')
+    self._max_size = max_size
+    self._max_width = max_width
+    self._max_height = max_height
+    self._lock = threading.Lock()
+    self._files = collections.OrderedDict()  # hash => (path, size)
+    self._size = 0
+    if not os.path.exists(self._cache_dir):
+      os.makedirs(self._cache_dir)
+    self._load()
+
+  @property
+  def size(self):
+    """Gets total bytes of cached files."""
+    return self._size
+
+  def has(self, image_hash):
+    """Checks if an image is cached.
+
+    Args:
+      image_hash: content hash of the image.
+    Returns:
+      True if the image is cached.
+    """
+    return self.get_path(image_hash) is not None
+
+  def get_path(self, image_hash):
+    """Gets path of a cached image and marks it as recently used.
+
+    Args:
+      image_hash: content hash of the image.
+    Returns:
+      Path to the image file, or None if not cached.
+    """
+    with self._lock:
+      item = self._files.pop(image_hash, None)
+      if item is None:
+        return None
+      self._files[image_hash] = item
+      return item[0]
+
+  def put(self, image_hash, data):
+    """Adds an image to the cache.
+
+    Args:
+      image_hash: content hash of the image, i.e. get_hash(data).
+      data: content of the image file.
+    Returns:
+      Path to the cached image file.
+    Raises:
+      ValueError: if data doesn't match the hash.
+    """
+    if get_hash(data) != image_hash:
+      raise ValueError('Image data does not match hash {0}.'.format(image_hash))
+    path = self.get_path(image_hash)
+    if path:
+      return path
+
+    data = self._downscale(data)
+    path = os.path.join(self._cache_dir, image_hash + _get_extension(data))
+    # Concurrent uploads of the same image each write their own temporary file.
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self._cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    if hasattr(os, 'replace'):
+      os.replace(temp_path, path)
+    else:
+      if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+      os.rename(temp_path, path)
+
+    with self._lock:
+      replaced = self._files.pop(image_hash, None)
+      if replaced:
+        self._size -= replaced[1]
+      self._files[image_hash] = (path, len(data))
+      self._size += len(data)
+      self._evict()
+    return path
+
+  def _load(self):
+    files = []
+    for name in os.listdir(self._cache_dir):
+      path = os.path.join(self._cache_dir, name)
+      image_hash, extension = os.path.splitext(name)
+      if extension == '.tmp':
+        os.remove(path)
+        continue
+      stat = os.stat(path)
+      files.append((stat.st_mtime, image_hash, path, stat.st_size))
+    for _, image_hash, path, size in sorted(files):
+      self._files[image_hash] = (path, size)
+      self._size += size
+    with self._lock:
+      self._evict()
+
+  def _evict(self):
+    # Keeps the most recently used one even if it exceeds the limit by itself.
+    while self._size > self._max_size and len(self._files) > 1:
+      image_hash, (path, size) = self._files.popitem(last=False)
+      self._size -= size
+      try:
+        os.remove(path)
+      except OSError as e:
+        self.logger.warn('Failed to remove cached image {0}: {1}'.format(
+            path, e))
+
+  def _downscale(self, data):
+    if not self._max_width and not self._max_height:
+      return data
+    try:
+      from PIL import Image
+    except ImportError:
+      self.logger.warn('PIL is not available. Image is not downscaled.')
+      return data
+
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    scale = min(
+        float(self._max_width or width) / width,
+        float(self._max_height or height) / height)
+    if scale >= 1:
+      return data
+    image_format = image.format
+    size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    image = image.resize(size, getattr(Image, 'LANCZOS', None) or
+                         Image.ANTIALIAS)
+    output = io.BytesIO()
+    image.save(output, format=image_format)
+    self.logger.info('Downscaled image from {0}x{1} to {2}x{3}.'.format(
+        width, height, image.size[0], image.size[1]))
+    return output.getvalue()
@@ -17,6 +17,7 @@ import colorsys
 import random
 import serial
 import struct
+import time
 
 from common import pattern
 
@@ -169,4 +170,149 @@ class SimLightEffect(pattern.Worker):
     if diff > 0:
       return value + inc
     else:
-      return value - inc
\ No newline at end of file
+      return value - inc
+
+
+class TelemetryMapping(object):
+  """Base class to map a flight simulator value to a light color."""
+
+  def __init__(self, data_type, channels=None):
+    """Creates TelemetryMapping instance.
+
+    Args:
+      data_type: simulator data type to follow.
+      channels: channel numbers of light fixtures to apply. If empty, applies to
+                all fixtures driven by the effect.
+    """
+    self.data_type = data_type
+    self.channels = channels or []
+
+  def evaluate(self, value, now):
+    """Maps a value to a color.
+
+    Args:
+      value: latest value of the data type.
+      now: current time in seconds.
+    Returns:
+      (h, s, v, w) tuple, or None to leave the fixtures to other mappings.
+    """
+    raise NotImplementedError()
+
+
+class AmbientMapping(TelemetryMapping):
+  """Sets cabin ambience by time of day (1=Day, 2=Dusk/Dawn, 3=Night)."""
+
+  _AMBIENCE = {
+      1: (0.0, 0.0, 0.0, 0.3),  # soft white
+      2: (0.08, 1.0, 0.3, 0.0),  # amber
+      3: (0.66, 1.0, 0.1, 0.0),  # dim blue
+  }
+
+  def evaluate(self, value, now):
+    return self._AMBIENCE.get(int(value))
+
+
+class SteadyMapping(TelemetryMapping):
+  """Lights up while value is non-zero."""
+
+  def __init__(self, data_type, channels=None, hue=0.0, saturation=0.0):
+    super(SteadyMapping, self).__init__(data_type, channels)
+    self._color = (hue, saturation, 1.0, 0.0)
+
+  def evaluate(self, value, now):
+    return self._color if value else None
+
+
+class FlashMapping(TelemetryMapping):
+  """Flashes while value is non-zero."""
+
+  def __init__(self,
+               data_type,
+               channels=None,
+               hue=0.0,
+               saturation=0.0,
+               period=1.0,
+               duty=0.1):
+    super(FlashMapping, self).__init__(data_type, channels)
+    self._color = (hue, saturation, 1.0, 0.0)
+    self._period = period
+    self._duty = duty
+
+  def evaluate(self, value, now):
+    if not value:
+      return None
+    if (now % self._period) < self._period * self._duty:
+      return self._color
+    return (0.0, 0.0, 0.0, 0.0)
+
+
+class LevelMapping(TelemetryMapping):
+  """Adjusts brightness linearly with value."""
+
+  def __init__(self,
+               data_type,
+               channels=None,
+               hue=0.0,
+               saturation=0.0,
+               min_value=0.0,
+               max_value=1.0):
+    super(LevelMapping, self).__init__(data_type, channels)
+    self._hue = hue
+    self._saturation = saturation
+    self._min_value = min_value
+    self._max_value = max_value
+
+  def evaluate(self, value, now):
+    span = self._max_value - self._min_value
+    if not span:
+      return None
+    level = min(max((value - self._min_value) / span, 0.0), 1.0)
+    return (self._hue, self._saturation, level, 0.0)
+
+
+class TelemetryLightEffect(pattern.Worker):
+  """Drives light fixtures by flight simulator data.
+
+  Mappings are evaluated once per DMX frame against the latest values held by
+  the data source, so frame rate doesn't depend on how fast data arrives.
+  Mappings are applied in order and later ones take precedence over earlier ones
+  on the same fixture. Fixtures not lit by any mapping are turned off.
+  """
+
+  _FRAME_INTERVAL = 0.05
+  _DARK = (0.0, 0.0, 0.0, 0.0)
+
+  def __init__(self, dmx, channels, source, mappings, *args, **kwargs):
+    """Creates TelemetryLightEffect instance.
+
+    Args:
+      dmx: Dmx instance.
+      channels: channel numbers of all light fixtures driven by the effect.
+      source: object providing latest data by get(data_type).
+      mappings: list of TelemetryMapping.
+    """
+    super(TelemetryLightEffect, self).__init__(
+        worker_name='TelemetryLightEffect', *args, **kwargs)
+    self._dmx = dmx
+    self._channels = channels
+    self._source = source
+    self._mappings = mappings
+
+  def _on_run(self):
+    now = time.time()
+    colors = {}
+    for mapping in self._mappings:
+      value = self._source.get(mapping.data_type)
+      if value is None:
+        continue
+      color = mapping.evaluate(value, now)
+      if color is None:
+        continue
+      for channel in mapping.channels or self._channels:
+        colors[channel] = color
+
+    for channel in self._channels:
+      h, s, v, w = colors.get(channel, self._DARK)
+      self._dmx.set_hsv(channel, h=h, s=s, v=v, w=w)
+    self._dmx.render()
+    self._sleep(self._FRAME_INTERVAL)
@@ -0,0 +1,196 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utility for capturing output of processes."""
+
+import os
+import threading
+import time
+
+from common import pattern
+
+
+class OutputCapture(pattern.Closable, pattern.Logger):
+  """Captures output of a process into an in-memory ring and rotated files.
+
+  Every attached stream is drained by its own reader thread as soon as data is
+  available, so a process never blocks on a full pipe regardless of whether
+  anyone reads the captured output.
+
+  Output is addressed by offset, which is the number of bytes captured since
+  creation. Offsets keep growing across process restarts, so readers can resume
+  from where they left.
+  """
+
+  _READ_SIZE = 4096
+
+  def __init__(self,
+               name,
+               log_dir,
+               ring_size=256 * 1024,
+               max_file_size=10 * 1024 * 1024,
+               backup_count=3,
+               *args,
+               **kwargs):
+    """Creates OutputCapture instance.
+
+    Args:
+      name: name of the output, used as log file name.
+      log_dir: directory of log files.
+      ring_size: bytes of recent output kept in memory.
+      max_file_size: bytes of a log file before it is rotated.
+      backup_count: number of rotated log files to keep. With 0, the log file
+                    is truncated once full.
+    """
+    super(OutputCapture, self).__init__(*args, **kwargs)
+    self._name = name
+    self._ring_size = ring_size
+    self._max_file_size = max_file_size
+    self._backup_count = backup_count
+    self._path = os.path.join(log_dir, '{0}.log'.format(name))
+    if not os.path.isdir(log_dir):
+      os.makedirs(log_dir)
+
+    self._condition = threading.Condition()
+    self._buffer = bytearray()
+    self._start_offset = 0  # offset of first byte in buffer
+    self._closed = False
+    self._file = open(self._path, 'ab')
+    self._file_size = self._file.tell()
+
+  @property
+  def path(self):
+    """Gets path of current log file."""
+    return self._path
+
+  @property
+  def end_offset(self):
+    """Gets offset right after the latest captured byte."""
+    with self._condition:
+      return self._start_offset + len(self._buffer)
+
+  def attach(self, stream):
+    """Starts capturing a stream until it is closed.
+
+    Args:
+      stream: a readable pipe, e.g. stdout of subprocess.Popen.
+    """
+    pattern.run_as_thread(
+        name='OutputCapture ({0})'.format(self._name),
+        target=self._read_stream,
+        kwargs={'stream': stream})
+
+  def note(self, message):
+    """Adds a timestamped line to the output, e.g. to mark process restart.
+
+    Args:
+      message: text to add.
+    """
+    line = '[{0}] {1}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'), message)
+    self._append(line.encode('utf-8'))
+
+  def read(self, offset, max_size=64 * 1024):
+    """Reads captured output.
+
+    Args:
+      offset: offset to read from. If it has been evicted from memory, reading
+              starts from the oldest byte available.
+      max_size: maximum bytes to read.
+    Returns:
+      (data, offset of data, offset right after data)
+    """
+    with self._condition:
+      offset = max(offset, self._start_offset)
+      begin = offset - self._start_offset
+      data = bytes(self._buffer[begin:begin + max_size])
+      return data, offset, offset + len(data)
+
+  def wait(self, offset, timeout):
+    """Waits for output beyond given offset.
+
+    Args:
+      offset: offset to wait for.
+      timeout: maximum seconds to wait.
+    """
+    with self._condition:
+      if self._start_offset + len(self._buffer) <= offset:
+        self._condition.wait(timeout)
+
+  def close(self):
+    """Closes log file."""
+    with self._condition:
+      self._closed = True
+      if self._file:
+        self._file.close()
+        self._file = None
+
+  def _read_stream(self, stream):
+    fd = stream.fileno()
+    try:
+      while True:
+        data = os.read(fd, self._READ_SIZE)
+        if not data:
+          break
+        self._append(data)
+    finally:
+      stream.close()
+
+  def _append(self, data):
+    with self._condition:
+      self._buffer.extend(data)
+      overflow = len(self._buffer) - self._ring_size
+      if overflow > 0:
+        del self._buffer[:overflow]
+        self._start_offset += overflow
+      self._condition.notify_all()
+
+      if not self._closed:
+        try:
+          self._write_file(data)
+        except (IOError, OSError) as e:
+          self.logger.warn('[{0}] Failed to write log file: {1}'.format(
+              self._name, e))
+
+  def _write_file(self, data):
+    if self._file and self._file_size + len(data) > self._max_file_size:
+      self._file.close()
+      self._file = None
+      try:
+        self._rotate_files()
+      except (IOError, OSError) as e:
+        # The log file keeps growing rather than losing output.
+        self.logger.warn('[{0}] Failed to rotate log file: {1}'.format(
+            self._name, e))
+    if not self._file:
+      # Also retried on every write after failing to open.
+      self._file = open(self._path, 'ab')
+      self._file_size = os.fstat(self._file.fileno()).st_size
+    self._file.write(data)
+    self._file.flush()
+    self._file_size += len(data)
+
+  def _rotate_files(self):
+    if not self._backup_count:
+      open(self._path, 'wb').close()
+      return
+    for i in range(self._backup_count - 1, 0, -1):
+      src = '{0}.{1}'.format(self._path, i)
+      if os.path.exists(src):
+        dst = '{0}.{1}'.format(self._path, i + 1)
+        if os.path.exists(dst):
+          os.remove(dst)
+        os.rename(src, dst)
+    dst = '{0}.1'.format(self._path)
+    if os.path.exists(dst):
+      os.remove(dst)
+    os.rename(self._path, dst)
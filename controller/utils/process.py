@@ -0,0 +1,476 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utility for tracking processes running on local machine."""
+
+import collections
+import heapq
+import itertools
+import os
+import psutil
+import select
+import threading
+import time
+
+from common import pattern
+
+
+def normalize_cmdline(args):
+  """Normalizes a command line so it can be used as lookup key.
+
+  Args:
+    args: list of executable path and arguments.
+  Returns:
+    Normalized command line string.
+  """
+  return ' '.join(args).lower()
+
+
+def terminate(procs, grace_period):
+  """Gracefully terminates processes along with all their descendants.
+
+  All processes are asked to terminate at once and are waited for concurrently.
+  Those still alive after grace period are killed.
+
+  Args:
+    procs: list of psutil.Process.
+    grace_period: seconds to wait before killing processes.
+  Returns:
+    List of psutil.Process that had to be killed.
+  """
+  targets = {}
+  for proc in procs:
+    # Children have to be collected before their parent exits and they are
+    # reparented.
+    try:
+      for child in proc.children(recursive=True):
+        targets[child.pid] = child
+    except psutil.Error:
+      pass
+    targets[proc.pid] = proc
+
+  for proc in targets.values():
+    try:
+      proc.terminate()
+    except psutil.Error:
+      pass
+  _, alive = psutil.wait_procs(list(targets.values()), timeout=grace_period)
+
+  for proc in alive:
+    try:
+      proc.kill()
+    except psutil.Error:
+      pass
+  psutil.wait_procs(alive, timeout=grace_period)
+  return alive
+
+
+class ProcessTable(pattern.Logger):
+  """Snapshot of processes on local machine indexed by command line.
+
+  One snapshot is taken per tick and shared by all callers, so any number of
+  applications can check their processes with a dictionary lookup instead of
+  scanning the process table each. Command line of a process is read only once,
+  keyed by pid and creation time.
+  """
+
+  _TICK = 1  # sec
+  # A process may still be between fork and exec right after creation, so its
+  # command line is not cached until it settles.
+  _SETTLE_TIME = 5  # sec
+
+  _instance = None
+  _instance_lock = threading.Lock()
+
+  @classmethod
+  def instance(cls):
+    """Gets the process table shared within current process.
+
+    Returns:
+      ProcessTable.
+    """
+    with cls._instance_lock:
+      if not cls._instance:
+        cls._instance = cls()
+      return cls._instance
+
+  def __init__(self, tick=_TICK, *args, **kwargs):
+    """Creates ProcessTable instance.
+
+    Args:
+      tick: maximum age in seconds of a snapshot before it is refreshed.
+    """
+    super(ProcessTable, self).__init__(*args, **kwargs)
+    self._tick = tick
+    self._lock = threading.Lock()
+    self._cmdlines = {}  # (pid, create_time) => normalized command line
+    self._index = {}  # normalized command line => [psutil.Process]
+    self._timestamp = None
+
+  def find(self, cmdline, max_age=None):
+    """Finds processes by command line.
+
+    Args:
+      cmdline: normalized command line. See normalize_cmdline().
+      max_age: maximum acceptable age of snapshot in seconds. Defaults to tick.
+    Returns:
+      List of psutil.Process.
+    """
+    with self._lock:
+      if max_age is None:
+        max_age = self._tick
+      if self._timestamp is None or time.time() - self._timestamp >= max_age:
+        self._refresh()
+      return list(self._index.get(cmdline, []))
+
+  def remove(self, proc):
+    """Removes an exited process from current snapshot.
+
+    Args:
+      proc: psutil.Process.
+    """
+    with self._lock:
+      for procs in self._index.values():
+        if proc in procs:
+          procs.remove(proc)
+
+  def _refresh(self):
+    now = time.time()
+    cmdlines = {}
+    index = {}
+    for proc in psutil.process_iter():
+      try:
+        key = (proc.pid, proc.create_time())
+        cmdline = self._cmdlines.get(key)
+        if cmdline is None:
+          cmdline = normalize_cmdline(proc.cmdline())
+      except (psutil.Error, OSError):
+        continue
+      if now - key[1] >= self._SETTLE_TIME:
+        cmdlines[key] = cmdline
+      index.setdefault(cmdline, []).append(proc)
+    self._cmdlines = cmdlines
+    self._index = index
+    self._timestamp = now
+
+
+class ProcessSupervisor(pattern.Worker):
+  """Detects exits of supervised child processes from a single thread.
+
+  Where pidfd is supported (Linux 5.3+ with Python 3.9+), exits are detected as
+  soon as they happen by waiting on pidfds with epoll. Elsewhere, all supervised
+  processes are polled from the same thread. Either way, exited processes are
+  reaped and their callbacks are run in separate threads so a slow callback
+  never delays detection of other exits.
+
+  The supervisor also runs delayed callbacks, see call_later().
+  """
+
+  _POLL_INTERVAL = 0.25  # sec
+
+  _instance = None
+  _instance_lock = threading.Lock()
+
+  @classmethod
+  def instance(cls):
+    """Gets the running supervisor shared within current process.
+
+    Returns:
+      ProcessSupervisor.
+    """
+    with cls._instance_lock:
+      if not cls._instance:
+        cls._instance = cls()
+        cls._instance.start()
+      return cls._instance
+
+  def __init__(self, *args, **kwargs):
+    super(ProcessSupervisor, self).__init__(
+        worker_name='ProcessSupervisor', *args, **kwargs)
+    self._lock = threading.Lock()
+    self._watches = {}  # pid => (subprocess.Popen, callback, pidfd)
+    self._timers = []  # heap of (deadline, sequence, _DelayedCall)
+    self._sequence = itertools.count()
+    self._wakeup = threading.Event()
+    self._epoll = None
+    self._pipe = None
+    if hasattr(os, 'pidfd_open') and hasattr(select, 'epoll'):
+      self._epoll = select.epoll()
+      self._pipe = os.pipe()
+      self._epoll.register(self._pipe[0], select.EPOLLIN)
+
+  def watch(self, proc, callback):
+    """Starts supervising a child process.
+
+    Args:
+      proc: subprocess.Popen instance.
+      callback: function to call with "proc" named argument when proc exits.
+    """
+    pidfd = None
+    if self._epoll:
+      try:
+        pidfd = os.pidfd_open(proc.pid)
+      except OSError:
+        pass
+    with self._lock:
+      self._watches[proc.pid] = (proc, callback, pidfd)
+      if pidfd is not None:
+        self._epoll.register(pidfd, select.EPOLLIN)
+    self._wake()
+
+  def unwatch(self, proc):
+    """Stops supervising a child process.
+
+    Args:
+      proc: subprocess.Popen instance.
+    """
+    with self._lock:
+      watch = self._watches.pop(proc.pid, None)
+      if watch:
+        self._close_pidfd(watch[2])
+
+  def call_later(self, delay, callback):
+    """Calls a function after a delay.
+
+    Args:
+      delay: delay in seconds.
+      callback: function to call without argument.
+    Returns:
+      Handle with cancel() method.
+    """
+    call = _DelayedCall(callback)
+    with self._lock:
+      heapq.heappush(self._timers,
+                     (time.time() + delay, next(self._sequence), call))
+    self._wake()
+    return call
+
+  def stop(self):
+    """Stops the supervisor thread."""
+    self._abort_event.set()
+    self._wake()
+    super(ProcessSupervisor, self).stop()
+
+  def _wake(self):
+    if self._pipe:
+      os.write(self._pipe[1], b'x')
+    else:
+      self._wakeup.set()
+
+  def _close_pidfd(self, pidfd):
+    if pidfd is not None:
+      self._epoll.unregister(pidfd)
+      os.close(pidfd)
+
+  def _get_timeout(self):
+    with self._lock:
+      timeout = None
+      if self._timers:
+        timeout = max(self._timers[0][0] - time.time(), 0)
+      # Processes without pidfd can only be polled.
+      if any(x[2] is None for x in self._watches.values()):
+        timeout = (self._POLL_INTERVAL if timeout is None else
+                   min(timeout, self._POLL_INTERVAL))
+      return timeout
+
+  def _on_run(self):
+    timeout = self._get_timeout()
+    if self._epoll:
+      for fd, _ in self._epoll.poll(-1 if timeout is None else timeout):
+        if fd == self._pipe[0]:
+          os.read(fd, 4096)
+    else:
+      self._wakeup.wait(timeout)
+      self._wakeup.clear()
+
+    with self._lock:
+      exited = [x for x in self._watches.values() if x[0].poll() is not None]
+      for proc, _, pidfd in exited:
+        del self._watches[proc.pid]
+        self._close_pidfd(pidfd)
+
+      now = time.time()
+      due = []
+      while self._timers and self._timers[0][0] <= now:
+        due.append(heapq.heappop(self._timers)[2])
+
+    for proc, callback, _ in exited:
+      pattern.run_as_thread(
+          name='ProcessSupervisor (pid={0})'.format(proc.pid),
+          target=callback,
+          kwargs={'proc': proc})
+    for call in due:
+      if not call.cancelled:
+        pattern.run_as_thread(
+            name='ProcessSupervisor (delayed call)',
+            target=call.callback,
+            kwargs={})
+
+
+class _DelayedCall(object):
+  """Handle of a call scheduled by ProcessSupervisor.call_later()."""
+
+  def __init__(self, callback):
+    self.callback = callback
+    self.cancelled = False
+
+  def cancel(self):
+    self.cancelled = True
+
+
+class ResourceSampler(pattern.Worker, pattern.EventEmitter):
+  """Samples resource usage of applications and their child processes.
+
+  All applications are sampled in one pass on a fixed cadence. Recent samples
+  of each application are kept in a fixed-size ring.
+
+  Events:
+    "sampled": after each pass.
+      Args:
+        sampler: instance of this class.
+  """
+
+  _Sample = collections.namedtuple(
+      '_Sample',
+      ['timestamp', 'cpu_percent', 'rss', 'num_threads', 'read_bytes',
+       'write_bytes'])
+
+  def __init__(self, interval=10, size=30, *args, **kwargs):
+    """Creates ResourceSampler instance.
+
+    Args:
+      interval: seconds between samples.
+      size: number of recent samples to keep per application.
+    """
+    super(ResourceSampler, self).__init__(
+        worker_name='ResourceSampler', *args, **kwargs)
+    self._interval = interval
+    self._size = size
+    self._lock = threading.Lock()
+    self._apps = {}  # name => utils.app.Application
+    self._samples = {}  # name => deque of _Sample
+    # psutil.Process instances are kept across passes since CPU percent is
+    # measured against previous call on the same instance.
+    self._procs = {}  # pid => psutil.Process
+
+  def watch(self, name, application):
+    """Starts sampling an application.
+
+    Args:
+      name: name to identify the application.
+      application: utils.app.Application.
+    """
+    with self._lock:
+      self._apps[name] = application
+      self._samples[name] = collections.deque(maxlen=self._size)
+
+  def unwatch(self, name):
+    """Stops sampling an application.
+
+    Args:
+      name: name of the application.
+    """
+    with self._lock:
+      self._apps.pop(name, None)
+      self._samples.pop(name, None)
+
+  def get_summary(self, name):
+    """Summarizes recent samples of an application.
+
+    Args:
+      name: name of the application.
+    Returns:
+      Dictionary of latest, average and maximum CPU percent, latest and maximum
+      RSS, RSS growth over recent samples, latest thread count, IO read/write
+      rates in bytes per second, number of samples and time of latest sample.
+      None if there is no sample.
+    """
+    with self._lock:
+      samples = list(self._samples.get(name, []))
+    if not samples:
+      return None
+    first = samples[0]
+    last = samples[-1]
+    elapsed = last.timestamp - first.timestamp
+    return {
+        'cpu_percent': last.cpu_percent,
+        'cpu_percent_avg': sum(x.cpu_percent for x in samples) / len(samples),
+        'cpu_percent_max': max(x.cpu_percent for x in samples),
+        'rss': last.rss,
+        'rss_max': max(x.rss for x in samples),
+        'rss_growth': last.rss - first.rss,
+        'num_threads': last.num_threads,
+        'read_rate': ((last.read_bytes - first.read_bytes) / elapsed
+                      if elapsed > 0 else 0.0),
+        'write_rate': ((last.write_bytes - first.write_bytes) / elapsed
+                       if elapsed > 0 else 0.0),
+        'num_samples': len(samples),
+        'timestamp': last.timestamp,
+    }
+
+  def _on_run(self):
+    with self._lock:
+      apps = list(self._apps.items())
+
+    procs = {}
+    for name, application in apps:
+      pid = application.pid
+      if pid:
+        sample = self._sample_tree(pid, procs)
+        if sample:
+          with self._lock:
+            if name in self._samples:
+              self._samples[name].append(sample)
+    self._procs = procs
+
+    self.emit('sampled', self)
+    self._sleep(self._interval)
+
+  def _sample_tree(self, pid, procs):
+    proc = self._get_proc(pid, procs)
+    if not proc:
+      return None
+    try:
+      tree = [proc] + proc.children(recursive=True)
+    except psutil.Error:
+      return None
+
+    cpu_percent = 0.0
+    rss = num_threads = read_bytes = write_bytes = 0
+    for child in tree:
+      child = self._get_proc(child.pid, procs)
+      if not child:
+        continue
+      try:
+        with child.oneshot():
+          cpu_percent += child.cpu_percent()
+          rss += child.memory_info().rss
+          num_threads += child.num_threads()
+          if hasattr(child, 'io_counters'):
+            io = child.io_counters()
+            read_bytes += io.read_bytes
+            write_bytes += io.write_bytes
+      except (psutil.Error, OSError):
+        pass
+    return self._Sample(time.time(), cpu_percent, rss, num_threads, read_bytes,
+                        write_bytes)
+
+  def _get_proc(self, pid, procs):
+    proc = procs.get(pid) or self._procs.get(pid)
+    if not proc:
+      try:
+        proc = psutil.Process(pid)
+      except psutil.Error:
+        return None
+    procs[pid] = proc
+    return proc
@@ -0,0 +1,78 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for utils.process.ProcessTable.
+
+Usage: python -m utils.process_test [number of background processes]
+"""
+from __future__ import print_function
+
+import psutil
+import subprocess
+import sys
+import time
+
+from utils import process
+
+_APP_COUNT = 20
+_ROUNDS = 5
+
+
+def scan(cmdline):
+  """Looks up a process the way Application did before ProcessTable."""
+  for proc in psutil.process_iter():
+    try:
+      if process.normalize_cmdline(proc.cmdline()) == cmdline:
+        return proc
+    except:
+      pass
+  return None
+
+
+def benchmark(argv):
+  count = int(argv[1]) if len(argv) > 1 else 300
+  print('Starting {0} background processes...'.format(count))
+  procs = [
+      subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(600)'])
+      for _ in range(count)
+  ]
+  cmdlines = [
+      process.normalize_cmdline(['app{0}.exe'.format(i), '--flag'])
+      for i in range(_APP_COUNT)
+  ]
+  try:
+    start = time.time()
+    for _ in range(_ROUNDS):
+      for cmdline in cmdlines:
+        scan(cmdline)
+    legacy = (time.time() - start) / _ROUNDS
+
+    table = process.ProcessTable()
+    start = time.time()
+    for _ in range(_ROUNDS):
+      for i, cmdline in enumerate(cmdlines):
+        table.find(cmdline, max_age=0 if i == 0 else None)
+    shared = (time.time() - start) / _ROUNDS
+
+    print('Checking {0} apps per tick with {1} processes running:'.format(
+        _APP_COUNT, len(psutil.pids())))
+    print('  Full scan per app:    {0:8.1f} ms'.format(legacy * 1000))
+    print('  Shared process table: {0:8.1f} ms'.format(shared * 1000))
+  finally:
+    for proc in procs:
+      proc.kill()
+      proc.wait()
+
+
+if __name__ == '__main__':
+  benchmark(sys.argv)
@@ -0,0 +1,251 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utility for recording flight simulator data in columnar format.
+
+A recording is a directory. Every series, e.g. a DataType, has two files of
+float64 in native byte order: "<name>.ts" with timestamps in seconds since epoch
+and "<name>.value" with values. Samples are written in chunks of fixed number of
+samples, except the last one. "index.json" keeps byte order, and time range,
+offset and number of samples of every chunk:
+
+  {
+    "version": 1,
+    "byteorder": "little",
+    "chunk_size": 4096,
+    "series": {
+      "<name>": {"count": 5000, "chunks": [[start, end, offset, count], ...]}
+    }
+  }
+
+Files can be memory mapped as NumPy arrays without parsing. See Recording.
+"""
+
+import array
+import json
+import os
+import sys
+import threading
+
+from common import pattern
+from protos import sim_proxy_pb2
+from utils import simproxy
+
+_INDEX_NAME = 'index.json'
+_VERSION = 1
+
+
+class RecordingWriter(pattern.Closable, pattern.Logger):
+  """Writes samples of series into a recording.
+
+  Samples are buffered in memory and written in bulk once a chunk is full, so
+  appending a sample costs about the same as appending to a list.
+  """
+
+  def __init__(self, path, chunk_size=4096, *args, **kwargs):
+    """Creates RecordingWriter instance.
+
+    Args:
+      path: directory of the recording. It's created if not existing.
+      chunk_size: number of samples in a chunk.
+    """
+    super(RecordingWriter, self).__init__(*args, **kwargs)
+    self._path = path
+    self._chunk_size = chunk_size
+    self._lock = threading.Lock()
+    self._buffers = {}  # name => (array of timestamps, array of values)
+    self._index = {
+        'version': _VERSION,
+        'byteorder': sys.byteorder,
+        'chunk_size': chunk_size,
+        'series': {}
+    }
+    if not os.path.exists(path):
+      os.makedirs(path)
+
+  @property
+  def path(self):
+    """Gets directory of the recording."""
+    return self._path
+
+  def append(self, name, timestamp, value):
+    """Appends a sample to a series.
+
+    Args:
+      name: name of the series.
+      timestamp: seconds since epoch.
+      value: value of the sample.
+    """
+    with self._lock:
+      buffers = self._buffers.get(name)
+      if not buffers:
+        buffers = (array.array('d'), array.array('d'))
+        self._buffers[name] = buffers
+      buffers[0].append(timestamp)
+      buffers[1].append(value)
+      if len(buffers[0]) >= self._chunk_size:
+        self._write(name)
+        self._write_index()
+
+  def flush(self):
+    """Writes all buffered samples, including partial chunks."""
+    with self._lock:
+      for name in list(self._buffers):
+        self._write(name)
+      self._write_index()
+
+  def close(self):
+    """Writes all buffered samples."""
+    self.flush()
+
+  def _write(self, name):
+    timestamps, values = self._buffers.pop(name, (None, None))
+    if not timestamps:
+      return
+    series = self._index['series'].setdefault(name, {'count': 0, 'chunks': []})
+    with open(self._get_file_path(name, 'ts'), 'ab') as f:
+      timestamps.tofile(f)
+    with open(self._get_file_path(name, 'value'), 'ab') as f:
+      values.tofile(f)
+    series['chunks'].append(
+        [timestamps[0], timestamps[-1], series['count'], len(timestamps)])
+    series['count'] += len(timestamps)
+
+  def _write_index(self):
+    path = os.path.join(self._path, _INDEX_NAME)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+      json.dump(self._index, f)
+    # Replaced atomically, so a reader never finds the index missing.
+    if hasattr(os, 'replace'):
+      os.replace(temp_path, path)
+    else:
+      if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+      os.rename(temp_path, path)
+
+  def _get_file_path(self, name, kind):
+    return os.path.join(self._path, '{0}.{1}'.format(name, kind))
+
+
+class SimProxyRecorder(pattern.Closable, pattern.Logger):
+  """Records data from SimProxy into a recording.
+
+  Series are named after DataType, e.g. "AIRSPEED_INDICATOR_INDICATION", with
+  receive time as timestamps. The stream is shared with other consumers of the
+  same SimProxy. See utils.simproxy.SimProxyClient.
+  """
+
+  def __init__(self, address, data_types, path, chunk_size=4096, *args,
+               **kwargs):
+    """Creates SimProxyRecorder instance and starts recording.
+
+    Args:
+      address: address of SimProxy service (host:port).
+      data_types: list of DataType to record.
+      path: directory of the recording.
+      chunk_size: number of samples in a chunk.
+    """
+    super(SimProxyRecorder, self).__init__(*args, **kwargs)
+    self._writer = RecordingWriter(path, chunk_size=chunk_size)
+    self._names = dict(
+        (x, sim_proxy_pb2.DataType.Name(x)) for x in set(data_types))
+    self._last_times = dict((x, None) for x in self._names)
+    self._subscription = simproxy.SimProxyClient.instance(address).subscribe(
+        self._names.keys(), callback=self._on_data)
+
+  def close(self):
+    """Stops recording and writes all buffered samples."""
+    self._subscription.close()
+    self._writer.close()
+    self.logger.info('Recording saved to {0}.'.format(self._writer.path))
+
+  def _on_data(self, subscription):
+    for data_type, name in self._names.items():
+      timestamp = subscription.get_time(data_type)
+      if timestamp is None or timestamp == self._last_times[data_type]:
+        continue
+      self._last_times[data_type] = timestamp
+      self._writer.append(name, timestamp, subscription.get(data_type))
+
+
+class Recording(object):
+  """Reads a recording as NumPy arrays.
+
+  Files are memory mapped, so opening a recording of any length is instant and
+  only the parts accessed are read from disk.
+  """
+
+  def __init__(self, path):
+    """Opens a recording.
+
+    Args:
+      path: directory of the recording.
+    """
+    self._path = path
+    with open(os.path.join(path, _INDEX_NAME), 'r') as f:
+      self._index = json.load(f)
+    self._dtype = '<f8' if self._index['byteorder'] == 'little' else '>f8'
+
+  @property
+  def names(self):
+    """Gets names of all series."""
+    return sorted(self._index['series'].keys())
+
+  def get(self, name, start=None, end=None):
+    """Gets samples of a series.
+
+    Args:
+      name: name of the series.
+      start: seconds since epoch to get samples from, or None for the first.
+      end: seconds since epoch to get samples until, or None for the last.
+    Returns:
+      (timestamps, values) as read-only NumPy arrays of float64.
+    Raises:
+      KeyError: if the series is not in the recording.
+    """
+    import numpy
+
+    series = self._index['series'][name]
+    timestamps = self._map(name, 'ts', series['count'])
+    values = self._map(name, 'value', series['count'])
+    if start is None and end is None:
+      return timestamps, values
+
+    # Narrows down to chunks in range before searching within them.
+    chunks = series['chunks']
+    first, last = 0, series['count']
+    for chunk_start, chunk_end, offset, count in chunks:
+      if start is not None and chunk_end < start:
+        first = offset + count
+      if end is not None and chunk_start > end:
+        last = min(last, offset)
+    if first < last:
+      if start is not None:
+        first += int(numpy.searchsorted(timestamps[first:last], start, 'left'))
+      if end is not None:
+        last = first + int(
+            numpy.searchsorted(timestamps[first:last], end, 'right'))
+    last = max(first, last)
+    return timestamps[first:last], values[first:last]
+
+  def _map(self, name, kind, count):
+    import numpy
+
+    if not count:
+      return numpy.zeros(0)
+    return numpy.memmap(
+        os.path.join(self._path, '{0}.{1}'.format(name, kind)),
+        dtype=self._dtype,
+        mode='r',
+        shape=(count,))
@@ -0,0 +1,213 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utility for controlling CPU, IO and memory resources of processes."""
+
+import os
+import psutil
+
+from common import pattern
+
+_CGROUP_ROOT = '/sys/fs/cgroup'
+_CPU_PERIOD = 100000  # microseconds
+
+
+class ResourceControl(pattern.Logger):
+  """Resource settings to apply to a process.
+
+  CPU affinity and nice value work on all platforms. IO priority and cgroup v2
+  limits are only available on Linux. On POSIX, settings are applied in the
+  child process before exec, and read back afterwards for reporting. Settings
+  that fail to apply are logged and skipped, so a process is still launched on
+  machines without permission.
+  """
+
+  IO_CLASSES = {
+      'realtime': getattr(psutil, 'IOPRIO_CLASS_RT', None),
+      'best_effort': getattr(psutil, 'IOPRIO_CLASS_BE', None),
+      'idle': getattr(psutil, 'IOPRIO_CLASS_IDLE', None),
+  }
+
+  def __init__(self,
+               name,
+               cpu_affinity=None,
+               nice=None,
+               io_class=None,
+               io_priority=None,
+               cgroup=None,
+               cpu_limit=None,
+               memory_limit=None,
+               *args,
+               **kwargs):
+    """Creates ResourceControl instance.
+
+    Args:
+      name: name to identify the settings in log.
+      cpu_affinity: list of CPU cores the process may run on.
+      nice: nice value. On Windows, it is a priority class.
+      io_class: IO scheduling class: "realtime", "best_effort" or "idle".
+      io_priority: IO priority within the class (0 ~ 7, 0 is highest).
+      cgroup: cgroup v2 path relative to cgroup root to place the process in.
+              Defaults to "flightlab/<name>" if any limit is set.
+      cpu_limit: maximum number of CPU cores the cgroup may use.
+      memory_limit: maximum bytes of memory the cgroup may use.
+    """
+    super(ResourceControl, self).__init__(*args, **kwargs)
+    self._name = name
+    self._cpu_affinity = cpu_affinity
+    self._nice = nice
+    self._io_class = io_class
+    self._io_priority = io_priority
+    self._cpu_limit = cpu_limit
+    self._memory_limit = memory_limit
+    if not cgroup and (cpu_limit or memory_limit):
+      cgroup = 'flightlab/{0}'.format(name)
+    self._cgroup = cgroup
+    self._cgroup_path = None  # set up by get_preexec_fn()
+
+  def get_preexec_fn(self):
+    """Gets function applying the settings in a child process before exec.
+
+    Settings are applied before the process runs any of its own code, so it
+    never runs with default priority or outside its cgroup. cgroup directory and
+    limits are set up here in the parent, since they are logged on failure.
+
+    Returns:
+      Function for preexec_fn of subprocess.Popen, or None if not supported on
+      current platform, in which case apply() applies the settings after launch.
+    """
+    if os.name != 'posix':
+      return None
+    self._cgroup_path = None
+    if self._cgroup:
+      try:
+        self._cgroup_path = self._prepare_cgroup()
+      except (IOError, OSError) as e:
+        self.logger.warn('[{0}] Failed to apply cgroup settings: {1}'.format(
+            self._name, e))
+    return self._apply_in_child
+
+  def apply(self, pid):
+    """Reads back the settings from a process.
+
+    On platforms without preexec_fn support, settings are applied first.
+
+    Args:
+      pid: process id.
+    Returns:
+      Dictionary of settings as read back from the process, with the same keys
+      as constructor arguments.
+    """
+    proc = psutil.Process(pid)
+    applied = {}
+    try:
+      if os.name != 'posix':
+        self._apply_cpu_io(proc)
+
+      if hasattr(proc, 'cpu_affinity'):
+        applied['cpu_affinity'] = proc.cpu_affinity()
+      applied['nice'] = proc.nice()
+      if hasattr(psutil, 'IOPRIO_CLASS_IDLE'):
+        ionice = proc.ionice()
+        applied['io_class'] = next(
+            (k for k, v in self.IO_CLASSES.items() if v == ionice.ioclass),
+            None)
+        applied['io_priority'] = ionice.value
+    except (psutil.Error, OSError) as e:
+      self.logger.warn('[{0}] Failed to apply CPU/IO settings: {1}'.format(
+          self._name, e))
+    if ((self._cpu_affinity and 'cpu_affinity' in applied and
+         sorted(applied['cpu_affinity']) != sorted(self._cpu_affinity)) or
+        (self._nice is not None and applied.get('nice', self._nice) !=
+         self._nice)):
+      self.logger.warn('[{0}] CPU settings are not fully applied: {1}'.format(
+          self._name, applied))
+
+    if self._cgroup:
+      try:
+        applied.update(self._read_cgroup(pid))
+      except (IOError, OSError) as e:
+        self.logger.warn('[{0}] Failed to read cgroup settings: {1}'.format(
+            self._name, e))
+      if applied.get('cgroup') != self._cgroup:
+        self.logger.warn('[{0}] Process is not in cgroup {1}.'.format(
+            self._name, self._cgroup))
+    return applied
+
+  def _apply_cpu_io(self, proc):
+    if self._cpu_affinity and hasattr(proc, 'cpu_affinity'):
+      proc.cpu_affinity(self._cpu_affinity)
+    if self._nice is not None:
+      proc.nice(self._nice)
+    io_class = self.IO_CLASSES.get(self._io_class)
+    if io_class is not None:
+      proc.ionice(io_class, self._io_priority or 0)
+
+  def _apply_in_child(self):
+    # Runs between fork and exec, where logging may deadlock on locks held by
+    # other threads of the parent. Failures are found by apply() instead, and
+    # never fail the launch.
+    try:
+      self._apply_cpu_io(psutil.Process(os.getpid()))
+    except Exception:
+      pass
+    if self._cgroup_path:
+      try:
+        self._write(self._cgroup_path, 'cgroup.procs', str(os.getpid()))
+      except Exception:
+        pass
+
+  def _prepare_cgroup(self):
+    path = os.path.join(_CGROUP_ROOT, self._cgroup)
+    if not os.path.isdir(path):
+      os.makedirs(path)
+
+    # Controllers have to be enabled on every ancestor for limits to work.
+    controllers = []
+    if self._cpu_limit:
+      controllers.append('+cpu')
+    if self._memory_limit:
+      controllers.append('+memory')
+    if controllers:
+      parent = os.path.dirname(path)
+      parents = []
+      while parent.startswith(_CGROUP_ROOT) and parent != _CGROUP_ROOT:
+        parents.insert(0, parent)
+        parent = os.path.dirname(parent)
+      for parent in [_CGROUP_ROOT] + parents:
+        self._write(parent, 'cgroup.subtree_control', ' '.join(controllers))
+
+    if self._cpu_limit:
+      quota = int(self._cpu_limit * _CPU_PERIOD)
+      self._write(path, 'cpu.max', '{0} {1}'.format(quota, _CPU_PERIOD))
+    if self._memory_limit:
+      self._write(path, 'memory.max', str(self._memory_limit))
+    return path
+
+  def _read_cgroup(self, pid):
+    applied = {}
+    # Verifies membership as reported by kernel.
+    with open('/proc/{0}/cgroup'.format(pid), 'r') as f:
+      for line in f:
+        if line.startswith('0::'):
+          applied['cgroup'] = line[3:].strip().lstrip('/')
+    if applied.get('cgroup') == self._cgroup:
+      if self._cpu_limit:
+        applied['cpu_limit'] = self._cpu_limit
+      if self._memory_limit:
+        applied['memory_limit'] = self._memory_limit
+    return applied
+
+  def _write(self, path, name, value):
+    with open(os.path.join(path, name), 'w') as f:
+      f.write(value)
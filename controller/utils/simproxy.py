@@ -0,0 +1,275 @@
+# Copyright 2018 Flight Lab authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utility for receiving flight simulator data from SimProxy."""
+
+import grpc
+import threading
+import time
+
+from common import pattern
+from protos import sim_proxy_pb2
+from protos import sim_proxy_pb2_grpc
+
+
+def get_data_type(name):
+  """Gets DataType enum value by its name.
+
+  Args:
+    name: name of DataType defined in sim_proxy.proto, e.g. "STROBE_LIGHT".
+  Returns:
+    DataType enum value.
+  Raises:
+    ValueError: if name is not a known data type.
+  """
+  return sim_proxy_pb2.DataType.Value(name)
+
+
+class Subscription(pattern.Closable):
+  """Interest of a consumer in a set of data types of a SimProxyClient.
+
+  Latest values can be read at any time with get(). If a callback is given, it
+  is also called when any of the data types is updated, at most once per
+  min_interval seconds.
+  """
+
+  def __init__(self, client, data_types, callback, min_interval, *args,
+               **kwargs):
+    super(Subscription, self).__init__(*args, **kwargs)
+    self._client = client
+    self.data_types = frozenset(data_types)
+    self.callback = callback
+    self.min_interval = min_interval
+    self.last_callback_time = 0
+
+  def get(self, data_type, default=None):
+    """Gets latest value of a data type.
+
+    Args:
+      data_type: DataType to read.
+      default: value to return if no value is received yet.
+    Returns:
+      Latest value.
+    """
+    return self._client.get(data_type, default)
+
+  def get_time(self, data_type):
+    """Gets when latest value of a data type was received.
+
+    Args:
+      data_type: DataType to read.
+    Returns:
+      Seconds since epoch, or None if no value is received yet.
+    """
+    return self._client.get_time(data_type)
+
+  def close(self):
+    """Stops receiving data."""
+    self._client.unsubscribe(self)
+
+
+class SimProxyClient(pattern.Worker):
+  """Shared client of a SimProxy service.
+
+  Only one instance exists per address within current process. It keeps a single
+  Watch stream for the union of data types of all subscriptions, so components
+  on the same machine never open duplicated streams. The stream is opened with
+  the first subscription, reopened when the union changes, and closed with the
+  last subscription. If it's disconnected, it is reopened with exponential
+  backoff.
+
+  Latest value and receive time of every data type are kept in a list indexed
+  by DataType. Each entry is replaced as a whole, so it can be read without a
+  lock.
+
+  Callbacks of subscriptions are called on the stream thread. They should return
+  quickly and shouldn't close their subscriptions.
+  """
+
+  _INITIAL_BACKOFF = 0.5  # sec
+  _MAX_BACKOFF = 10  # sec
+
+  _instances = {}  # address => SimProxyClient
+  _instances_lock = threading.Lock()
+
+  @classmethod
+  def instance(cls, address):
+    """Gets the client of a SimProxy service shared within current process.
+
+    Args:
+      address: address of SimProxy service (host:port).
+    Returns:
+      SimProxyClient.
+    """
+    with cls._instances_lock:
+      if address not in cls._instances:
+        cls._instances[address] = cls(address)
+      return cls._instances[address]
+
+  def __init__(self, address, *args, **kwargs):
+    """Creates SimProxyClient instance.
+
+    Args:
+      address: address of SimProxy service (host:port).
+    """
+    super(SimProxyClient, self).__init__(
+        worker_name='SimProxyClient ({0})'.format(address), *args, **kwargs)
+    self._address = address
+    self._latest = [None] * (max(sim_proxy_pb2.DataType.values()) + 1)
+    self._lock = threading.Lock()
+    self._worker_lock = threading.Lock()  # serializes start() and stop()
+    self._subscriptions = ()
+    self._data_types = frozenset()
+    self._reconnect = False
+    self._backoff = self._INITIAL_BACKOFF
+    self._channel = None
+    self._stub = None
+    self._responses = None
+
+  def subscribe(self, data_types, callback=None, min_interval=0):
+    """Starts receiving data types.
+
+    Args:
+      data_types: list of DataType to receive.
+      callback: function called with the Subscription when any of data_types
+                is updated, or None to only read latest values.
+      min_interval: minimum seconds between calls of callback.
+    Returns:
+      Subscription, which should be closed when no longer needed.
+    """
+    subscription = Subscription(self, data_types, callback, min_interval)
+    with self._lock:
+      self._subscriptions += (subscription,)
+      self._update_data_types()
+    with self._worker_lock:
+      self.start()
+    return subscription
+
+  def unsubscribe(self, subscription):
+    """Stops receiving data types of a subscription.
+
+    Args:
+      subscription: Subscription returned by subscribe().
+    """
+    with self._lock:
+      self._subscriptions = tuple(
+          x for x in self._subscriptions if x is not subscription)
+      self._update_data_types()
+    with self._worker_lock:
+      # Checked again, since a subscription may have been added meanwhile.
+      with self._lock:
+        stop = not self._subscriptions
+      if stop:
+        self.stop()
+
+  def get(self, data_type, default=None):
+    """Gets latest value of a data type.
+
+    Args:
+      data_type: DataType to read.
+      default: value to return if no value is received yet.
+    Returns:
+      Latest value.
+    """
+    entry = self._latest[data_type]
+    return entry[0] if entry else default
+
+  def get_time(self, data_type):
+    """Gets when latest value of a data type was received.
+
+    Args:
+      data_type: DataType to read.
+    Returns:
+      Seconds since epoch, or None if no value is received yet.
+    """
+    entry = self._latest[data_type]
+    return entry[1] if entry else None
+
+  def stop(self):
+    """Stops watching and cancels the on-going stream."""
+    # Set before cancelling, so the stream is not reopened.
+    self._abort_event.set()
+    responses = self._responses
+    if responses:
+      responses.cancel()
+    super(SimProxyClient, self).stop()
+
+  def _update_data_types(self):
+    data_types = frozenset()
+    for subscription in self._subscriptions:
+      data_types |= subscription.data_types
+    if data_types == self._data_types:
+      return
+    self._data_types = data_types
+    if self._responses:
+      self._reconnect = True
+      self._responses.cancel()
+
+  def _on_start(self):
+    self._channel = grpc.insecure_channel(self._address)
+    self._stub = sim_proxy_pb2_grpc.SimProxyStub(self._channel)
+    self._backoff = self._INITIAL_BACKOFF
+
+  def _on_run(self):
+    with self._lock:
+      request = sim_proxy_pb2.WatchRequest(types=sorted(self._data_types))
+      self._reconnect = False
+    try:
+      responses = self._stub.Watch(request)
+      with self._lock:
+        self._responses = responses
+        cancel = self._reconnect
+      if cancel or self._abort_event.is_set():
+        responses.cancel()
+      for response in responses:
+        self._on_response(response)
+    except grpc.RpcError as e:
+      if not self._abort_event.is_set() and not self._reconnect:
+        self.logger.warn('[SimProxy - {0}] Disconnected: {1}'.format(
+            self._address, e))
+    finally:
+      with self._lock:
+        self._responses = None
+        reconnect = self._reconnect
+
+    if reconnect:
+      return  # Data types changed, so the stream is reopened right away.
+    self._latest = [None] * len(self._latest)
+    self._sleep(self._backoff)
+    self._backoff = min(self._backoff * 2, self._MAX_BACKOFF)
+
+  def _on_response(self, response):
+    now = time.time()
+    latest = self._latest
+    data_types = set()
+    for data in response.data:
+      latest[data.type] = (data.value, now)
+      data_types.add(data.type)
+    self._backoff = self._INITIAL_BACKOFF
+
+    for subscription in self._subscriptions:
+      if (not subscription.callback or
+          now - subscription.last_callback_time < subscription.min_interval or
+          subscription.data_types.isdisjoint(data_types)):
+        continue
+      subscription.last_callback_time = now
+      try:
+        subscription.callback(subscription)
+      except Exception as e:
+        self.logger.exception('Subscription callback failed: {0}'.format(e))
+
+  def _on_stop(self):
+    self._latest = [None] * len(self._latest)
+    self._channel.close()
+    self._channel = None
+    self._stub = None
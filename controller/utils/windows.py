@@ -240,17 +240,21 @@ class WindowsApplication(app.Application):
       info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
       info.wShowWindow = _SW_MINIMIZE
 
+    kwargs = self._get_popen_kwargs()
+    # Python 2 can't close handles on Windows if output is redirected.
+    kwargs['close_fds'] = not self._output
     try:
       proc = subprocess.Popen(
           args,
-          cwd=self._working_dir,
           creationflags=subprocess.CREATE_NEW_CONSOLE,
-          close_fds=True,
-          startupinfo=info)
+          startupinfo=info,
+          **kwargs)
     except Exception as e:
       self.logger.debug('[App - {0}] Failed to launch. {1}'.format(
           self._name, e))
       return None
 
+    if self._output:
+      self._output.attach(proc.stdout)
     self.emit('started', self)
     return proc
\ No newline at end of file